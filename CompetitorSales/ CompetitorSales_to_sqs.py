@@ -1,5 +1,19 @@
-import boto3
 import json
+import os
+import job_planner
+import sqs_enqueue
+
+# 1URLあたりの取得日数（CompetitorSales の app.py と同じ）
+SCAN_DAYS = 28
+
+# 1メッセージあたりのURL数の上限
+MAX_URLS_PER_MESSAGE = int(os.environ.get('MAX_URLS_PER_MESSAGE', '20'))
+
+# コスト表に実績がないURLの見積もり（従来どおり5件ずつのメッセージになる値）
+DEFAULT_COSTS_MS = {
+    'url_ms': int(os.environ.get('DEFAULT_URL_COST_MS', '40000')),
+    'date_ms': int(os.environ.get('DEFAULT_DATE_COST_MS', '2500')),
+}
 
 def lambda_handler(event, context):
     if 'body' in event:
@@ -21,20 +35,21 @@ def lambda_handler(event, context):
         }
 
     # SQSにメッセージ送信
-    sqs = boto3.client('sqs')
     queue_url = 'https://sqs.ap-northeast-1.amazonaws.com/897729114300/CompetitorSales'
 
     try:
-        # 5個ずつに分割して送信するよう改修
-        for i in range(0, len(urls), 5):
-            batch = urls[i:i + 5]
-            sqs.send_message(
-                QueueUrl=queue_url,
-                MessageBody=json.dumps({
-                    "urls": batch,
-                    "timestamp": context.aws_request_id  # リクエストIDを追加
-                })
-            )
+        # URLごとの処理時間の実績から、見積もり時間の合計が目標に収まるだけ1メッセージにまとめて送信
+        messages = [
+            {
+                "urls": batch,
+                "timestamp": context.aws_request_id  # リクエストIDを追加
+            }
+            for batch in plan_batches(urls)
+        ]
+        result = sqs_enqueue.send_messages(queue_url, messages)
+        if result['failed']:
+            raise Exception(f"{len(result['failed'])}/{len(messages)}件のメッセージを送信できませんでした: "
+                            f"{result['failed'][0]['error']}")
 
         response_body = {
             "message": f"{len(urls)}件のURL処理をキューに追加しました",
@@ -55,3 +70,13 @@ def lambda_handler(event, context):
                 'error': f"キューへの送信エラー: {str(e)}"
             })
         }
+
+
+def plan_batches(urls):
+    """コスト表の実績から、URLを見積もり時間で詰め合わせたリストのリストを返す"""
+    costs = job_planner.load_costs('CompetitorSales', urls)
+    entries = []
+    for url in dict.fromkeys(urls):
+        url_ms, date_ms = job_planner.estimate(costs.get(url), DEFAULT_COSTS_MS)
+        entries.append((url, job_planner.job_cost_ms(url_ms, date_ms, SCAN_DAYS)))
+    return job_planner.pack(entries, max_items=MAX_URLS_PER_MESSAGE)
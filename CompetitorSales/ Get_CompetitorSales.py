@@ -8,6 +8,11 @@ from collections import defaultdict
 # DynamoDB テーブル名
 TABLE_NAME = 'CompetitorSales'
 
+# プランカタログの行（sortKey = 'CATALOG#planId'）。スクレイパー（app.py）が書き込みのたびに更新する
+CATALOG_PREFIX = 'CATALOG#'
+# カタログ導入前のデータのプランを取り込み終えたことを示す行の sortKey（スクレイパーが書く。この Lambda は読むだけ）
+CATALOG_MARKER_KEY = 'CATALOG'
+
 # JST タイムゾーン
 JST = timezone(timedelta(hours=9))
 
@@ -19,10 +24,15 @@ def decimal_default(obj):
 
 def list_plan_ids(table, space_id):
     """
-    spaceId に紐づく全アイテムを走査し、
+    spaceId のプランカタログ行から planId を返す。
+    カタログの取り込みが済んでいなければ（印の行がない）、カタログ行に加えて spaceId に紐づく全アイテムを走査し、
     sortKey のプレフィックス（planId 部分）だけを抽出して返す
     """
-    plan_ids = set()
+    catalog, backfilled = list_catalog_plan_ids(table, space_id)
+    if backfilled:
+        return catalog
+
+    plan_ids = set(catalog)
     response = table.query(
         KeyConditionExpression='spaceId = :space_id',
         ExpressionAttributeValues={':space_id': space_id}
@@ -39,11 +49,34 @@ def list_plan_ids(table, space_id):
     for itm in items:
         sk = itm.get('sortKey', '')
         # sortKey が "planId#..." の形式なら split で planId を取り出す
-        if '#' in sk:
+        if '#' in sk and not sk.startswith(CATALOG_PREFIX):
             plan_id = sk.split('#', 1)[0]
             plan_ids.add(plan_id)
     return list(plan_ids)
 
+def list_catalog_plan_ids(table, space_id):
+    """
+    プランカタログ行と印の行（sortKey が 'CATALOG' で始まる行）だけを Query する。
+    戻り値: (planId のリスト, 取り込み済みの印があるか)
+    """
+    kwargs = {
+        'KeyConditionExpression': 'spaceId = :space_id AND begins_with(sortKey, :catalog)',
+        'ExpressionAttributeValues': {':space_id': space_id, ':catalog': CATALOG_MARKER_KEY},
+        'ProjectionExpression': 'planId, sortKey',
+    }
+    plan_ids = []
+    backfilled = False
+    while True:
+        response = table.query(**kwargs)
+        for itm in response.get('Items', []):
+            if itm.get('sortKey') == CATALOG_MARKER_KEY:
+                backfilled = True
+            elif itm.get('planId'):
+                plan_ids.append(itm['planId'])
+        if 'LastEvaluatedKey' not in response:
+            return plan_ids, backfilled
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 def get_sales_data(table, space_id, plan_id, start_date, end_date):
     """
     特定の spaceId と planId の売上データを取得し、日ごとに集計する
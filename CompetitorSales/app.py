@@ -4,16 +4,43 @@ import re
 import hashlib
 from datetime import datetime, timedelta, timezone
 import time
-from playwright.sync_api import sync_playwright
+import os
 from urllib.parse import urlparse, parse_qs
+import asyncio
+import threading
+import browser_pool
+import async_runner
+import calendar_nav
+import checkpoint
+import time_budget
+import job_planner
+import plan_catalog
 
 # DynamoDB テーブル名
 TABLE_NAME = 'CompetitorSales'
 
+# URLの処理方法: 'sync' = 1件ずつ順番に処理、'async' = asyncio で複数URLを並行処理
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'sync')
+
+# 予約状況を取得する日数（今日から）
+SCAN_DAYS = 28
+
+# 時間予算の見積もりの初期値（実績がない場合）: 'url' = ページを開いて最初の1日分まで、'date' = 2日目以降の1日分
+DEFAULT_COSTS_MS = {
+    'url': int(os.environ.get('DEFAULT_URL_COST_MS', '40000')),
+    'date': int(os.environ.get('DEFAULT_DATE_COST_MS', '3000')),
+}
+
+# DynamoDB リソース（Lambda のウォームスタート間で再利用）。
+# async モードでは on_date が複数のスレッドから呼ばれ、boto3 のセッション・リソースはスレッドセーフでないため、スレッドごとに持つ
+_local = threading.local()
+
 def lambda_handler(event, context):
     # SQSメッセージから URLs パラメータ取得
     all_urls = []
     timestamps = []
+    url_jobs = {}  # URL → チェックポイントのジョブID
+    url_records = {}  # URL → SQS レコード（時間切れ時の再投入先・再投入回数の判定用）
     
     if 'Records' in event:
         # SQSイベントの場合
@@ -25,6 +52,10 @@ def lambda_handler(event, context):
                 if urls and isinstance(urls, list):
                     all_urls.extend(urls)
                     timestamps.append(timestamp)
+                    # 再配信時に処理済みの日付を飛ばすためのジョブID
+                    for url in urls:
+                        url_jobs[url] = checkpoint.job_id_for_record(record)
+                        url_records[url] = record
             except Exception as e:
                 print(f"SQSメッセージ解析エラー: {e}")
                 continue
@@ -32,41 +63,115 @@ def lambda_handler(event, context):
         # 既存のHTTPリクエスト処理（互換性維持）
         if 'body' in event:
             body = json.loads(event['body'] or '{}')
-            urls = body.get('urls')
         else:
-            urls = event.get('urls')
+            body = event
+        urls = body.get('urls')
         if urls and isinstance(urls, list):
             all_urls = urls
+            # 途中から再開するのは checkpoint_job / resume を指定した場合だけ（同じ内容の再実行は全日付を取り直す）
+            job_id = checkpoint.job_id_for_request(body)
+            url_jobs = {url: job_id for url in all_urls}
     
     if not all_urls:
         return { 'statusCode': 400, 'body': json.dumps({'error': 'urls (リスト) が必要です'}) }
 
     results = []
     errors = []  # エラー情報を記録
-    
-    for url in all_urls:
-        # スクレイピング
-        reservation_data = get_reservation_data(url)
-        if 'error' in reservation_data:
-            # エラーでも処理を続行
-            errors.append({
-                'url': url,
-                'error': reservation_data['error']
-            })
-            continue  # 次のURLへ
-        
-        # DynamoDB へ保存
+
+    # 処理済みの日付（前回の実行がタイムアウトした場合など）
+    done_dates = {url: checkpoint.load(url_jobs.get(url), url) for url in all_urls}
+    iso_dates = [d.strftime('%Y-%m-%d') for d in target_dates()]
+    if all(d in done_dates[url] for url in all_urls for d in iso_dates):
+        # 再配信・再実行で全て終わっている場合は成功扱い
+        print(f"全URLの全日付が処理済みのため処理なし: {len(all_urls)}件")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': '全日付が処理済みのため処理なし',
+                'status': 'nothing_to_do',
+                'successful': 0,
+                'failed': 0,
+                'records': [],
+                'errors': [],
+                'requeued': []
+            }, ensure_ascii=False)
+        }
+
+    # Lambda の残り時間から、次の URL・日付を始めるかを判断する
+    budget = time_budget.start(context, DEFAULT_COSTS_MS)
+    should_stop = lambda: not time_budget.can_afford(budget, 'date')
+    progress = {}  # URL → (前回の記録時刻, 次に記録する種別)
+    # URLごとの処理時間・プラン数（投入側がジョブの大きさを決めるためにコスト表へ記録する）
+    measures = {}
+
+    # 書き込んだプラン（実行の最後にプランごとに1回だけカタログを更新する）
+    catalog = plan_catalog.start()
+
+    def start_url(url):
+        progress[url] = (time_budget.now(), 'url')
+        measures[url] = job_planner.start_measure()
+
+    def on_date(url, current_date, date_data):
+        """1日分の予約状況を DynamoDB へ保存し、その日付を処理済みとして記録する"""
+        # 最初の1日分はページを開く時間を含めて 'url'、以降は前の日付からの経過時間を 'date' として記録
+        if url in progress:
+            time_budget.record(progress[url][1], progress[url][0])
+        progress[url] = (time_budget.now(), 'date')
+        if url in measures:
+            job_planner.measure_step(measures[url], plan_ids=[plan['id'] for plan in date_data['plans']])
         try:
-            write_to_dynamodb(url, reservation_data)
-            results.append(reservation_data)
+            written = write_to_dynamodb(url, date_data)
         except Exception as e:
             errors.append({
                 'url': url,
-                'error': f"DynamoDB書き込み失敗: {e}"
+                'error': f"DynamoDB書き込み失敗 ({current_date.strftime('%Y-%m-%d')}): {e}"
             })
+            return
+        # 初めて見つかったプランは、処理済みと記録する前にカタログへ反映する
+        plan_catalog.add(catalog, written)
+        plan_catalog.flush(catalog, TABLE_NAME, 'sortKey', ttl=catalog_ttl(), new_only=True)
+        # プラン情報が取れていない日は書き込みが空のため、再配信時に取り直す
+        if date_data['plans']:
+            checkpoint.mark(url_jobs.get(url), url, [current_date.strftime('%Y-%m-%d')])
+    
+    try:
+        if EXECUTION_MODE == 'async':
+            # 複数URLを1つのブラウザで並行処理（結果は入力順）
+            fetched = fetch_reservation_data_concurrently(all_urls, on_date, done_dates, should_stop, start_url)
+        else:
+            fetched = fetch_reservation_data_in_budget(all_urls, on_date, done_dates, should_stop, budget, start_url)
+
+        # DynamoDB へは日付ごとに on_date で保存済み
+        finished = set()
+        for url, reservation_data in fetched:
+            if not reservation_data.get('stopped'):
+                finished.add(url)
+            if 'error' in reservation_data:
+                # エラーでも処理を続行
+                errors.append({
+                    'url': url,
+                    'error': reservation_data['error']
+                })
+                continue  # 次のURLへ
+            results.append(reservation_data)
+
+        for url, measure in measures.items():
+            job_planner.save_measure('CompetitorSales', url, measure)
+    finally:
+        # まとめていたプランの件数をカタログ（Get_CompetitorSales のプラン一覧）に反映する
+        plan_catalog.flush(catalog, TABLE_NAME, 'sortKey', ttl=catalog_ttl())
+
+    # カタログ導入前のデータのプランを取り込む（スペースごとに初回だけ。時間切れで打ち切った場合は次回に回す）
+    if not budget['stopped']:
+        plan_catalog.backfill(catalog, TABLE_NAME, 'sortKey', [TABLE_NAME], plan_of_item)
+
+    # 時間切れで打ち切った場合は、未処理・途中のURLを元のメッセージごとに新しいメッセージとして戻す
+    requeued = []
+    if budget['stopped']:
+        requeued = requeue_leftovers([url for url in all_urls if url not in finished], url_jobs, url_records)
     
     # 部分的成功でも200を返す
-    if results:
+    if results or requeued:
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -74,7 +179,8 @@ def lambda_handler(event, context):
                 'successful': len(results),
                 'failed': len(errors),
                 'records': results,
-                'errors': errors
+                'errors': errors,
+                'requeued': requeued
             }, ensure_ascii=False)
         }
     else:
@@ -88,6 +194,19 @@ def lambda_handler(event, context):
         }
 
 
+def catalog_ttl():
+    """プランカタログ行の TTL（予約データと同じ3年後）"""
+    return int((datetime.now(timezone(timedelta(hours=9))) + timedelta(days=365 * 3)).timestamp())
+
+
+def plan_of_item(item):
+    """予約データの行（sortKey = 'planId#日付#時刻'）の (planId, 表示名, ttl)。カタログの行は None"""
+    sort_key = item.get('sortKey', '')
+    if '#' not in sort_key or sort_key.startswith(plan_catalog.CATALOG_PREFIX):
+        return None
+    return sort_key.split('#', 1)[0], item.get('planDisplayName', ''), item.get('ttl')
+
+
 def write_to_dynamodb(url, data):
     """
     reservation_data の構造
@@ -100,9 +219,9 @@ def write_to_dynamodb(url, data):
         'space_id': space_id
       }
     を展開して、CompetitorSales テーブルへ put_item します。
+    戻り値: 書き込んだアイテムのリスト
     """
-    dynamo = boto3.resource('dynamodb')
-    table = dynamo.Table(TABLE_NAME)
+    table = get_dynamodb().Table(TABLE_NAME)
 
     # URLからroomIdを抽出（両方のURL形式に対応）
     room_match = re.search(r'/p/([^/?]+)', url)
@@ -133,6 +252,7 @@ def write_to_dynamodb(url, data):
         # 12時以降の場合、12時以降の時間帯のみ処理
         time_threshold = now_jst.replace(hour=12, minute=0, second=0, microsecond=0)
 
+    written = []
     for plan in data['plans']:
         disp_name = plan['name']
         price = int(re.sub(r'\D', '', plan['price'])) if plan['price'] else 0
@@ -188,35 +308,168 @@ def write_to_dynamodb(url, data):
                     'ttl': ttl_timestamp  # 3年後の削除時刻
                 }
                 table.put_item(Item=item)
+                written.append(item)
+    return written
 
 
-def get_reservation_data(original_url):
-    """Playwrightを使用して、トップページ→予約ページと遷移後に予約情報とプラン情報を取得する関数"""
-    # メモリリークを防ぐため、最初に宣言
-    browser = None
-    page = None
-    
-    with sync_playwright() as p:
-        try:
-            browser = p.chromium.launch(
-                headless=True,
-                args=[
-                    "--single-process",
-                    "--no-zygote",
-                    "--no-sandbox",
-                    "--disable-gpu",
-                    "--disable-dev-shm-usage",
-                    "--headless=new",
-                    "--disable-http2",
-                ]
-            )
-            # コンテキストを作らず、直接ページを作成
-            page = browser.new_page()
+def fetch_reservation_data_in_budget(urls, on_date, done_dates, should_stop, budget, on_start):
+    """
+    URLを1件ずつ fetch_reservation_data で処理するジェネレータ（同期モード用）。
+    次のURLを開く時間が残っていない場合はそこで終了する（残りのURLは呼び出し側で再投入する）。
+    """
+    for url in urls:
+        if not time_budget.can_afford(budget, 'url'):
+            return
+        on_start(url)
+        yield url, fetch_reservation_data(url, on_date, done_dates[url], should_stop)
+
+
+def requeue_leftovers(urls, url_jobs, url_records):
+    """
+    時間切れで処理しきれなかったURLを、元のメッセージ（ジョブ）ごとに再投入する。
+    チェックポイントのジョブIDを引き継ぐため、途中まで処理したURLは残りの日付だけが処理される。
+    戻り値: 再投入したメッセージ本文のリスト
+    """
+    jobs = {}
+    for url in urls:
+        jobs.setdefault(url_jobs.get(url), []).append(url)
+
+    requeued = []
+    for job_id, job_urls in jobs.items():
+        record = url_records.get(job_urls[0])
+        previous = json.loads(record['body']) if record else {}
+        body = {
+            'urls': job_urls,
+            'timestamp': previous.get('timestamp', ''),
+            'checkpoint_job': job_id,
+            'requeue_count': previous.get('requeue_count', 0) + 1,
+        }
+        if time_budget.requeue(time_budget.queue_url_for_record(record), body):
+            requeued.append(body)
+    return requeued
+
+
+def get_dynamodb():
+    """DynamoDB リソースを取得（スレッドごとに作成して使い回す）"""
+    if getattr(_local, 'dynamodb', None) is None:
+        _local.dynamodb = boto3.session.Session().resource('dynamodb')
+    return _local.dynamodb
+
+
+def target_dates():
+    """予約状況の取得対象日（今日から SCAN_DAYS 日分）"""
+    today = datetime.now(timezone(timedelta(hours=9)))
+    return [today + timedelta(days=i) for i in range(SCAN_DAYS)]
+
+
+def fetch_reservation_data(original_url, on_date=None, done_dates=(), should_stop=None):
+    """
+    Playwright で予約情報を取得する。
+    1日分を取得するたびに on_date(url, date, 1日分の reservation_data) を呼ぶ。
+    done_dates（YYYY-MM-DD）に含まれる日付は取得しない。
+    should_stop() が True を返した時点で残りの日付を取得せず、'stopped': True を付けて返す。
+    """
+    if all(d.strftime('%Y-%m-%d') in done_dates for d in target_dates()):
+        print(f"全日付が処理済みのためスキップ ({original_url})")
+        return {'url': original_url, 'plans': [], 'reserved_times': {}, 'skipped': True}
+    return get_reservation_data(original_url, on_date, done_dates, should_stop)
+
+
+def fetch_reservation_data_concurrently(urls, on_date=None, done_dates=None, should_stop=None, on_start=None):
+    """
+    複数URLを asyncio で並行スクレイピングする。
+    on_date / done_dates（{url: 処理済みの日付の集合}）/ should_stop は fetch_reservation_data と同じ。
+    on_start(url) は各URLの取得を始める直前に呼ぶ（処理時間の計測用）。
+    戻り値: [(url, reservation_data), ...]（入力順、打ち切りで開始しなかったURLは含まない）
+    """
+    done_dates = done_dates or {}
+    results = {}
+    browser_urls = []
+    for url in urls:
+        if should_stop and should_stop():
+            break
+        url_done = done_dates.get(url, set())
+        if all(d.strftime('%Y-%m-%d') in url_done for d in target_dates()):
+            print(f"全日付が処理済みのためスキップ ({url})")
+            results[url] = {'url': url, 'plans': [], 'reserved_times': {}, 'skipped': True}
+            continue
+        browser_urls.append(url)
+
+    if browser_urls:
+        async def worker(context, url):
+            if should_stop and should_stop():
+                return None
+            if on_start:
+                on_start(url)
+            return await get_reservation_data_async(context, url, on_date, done_dates.get(url, set()), should_stop)
+
+        for url, data, error in async_runner.run_urls(browser_urls, worker):
+            if error is None and data is None:
+                continue
+            results[url] = data if error is None else {'error': str(error)}
+
+    return [(url, results[url]) for url in urls if url in results]
+
+
+def _single_date_data(original_url, plans, space_name, space_id, formatted, ranges):
+    """1日分の予約状況を reservation_data と同じ形式にする（write_to_dynamodb に渡す用）"""
+    return {
+        'url': original_url,
+        'plans': plans,
+        'reserved_times': {formatted: ranges},
+        'timestamp': datetime.now(timezone(timedelta(hours=9))).isoformat(),
+        'name': space_name,
+        'space_id': space_id
+    }
+
+
+def extract_reserved_ranges(availability, current_date):
+    """
+    15分単位の予約可否 [(HH:MM, 状態, 翌日か), ...] から
+    連続した予約不可の時間帯を抽出する
+    """
+    formatted = f"{current_date.month}月{current_date.day}日"
+    rr = []
+    start_idx = None
+    for i, (ts, st, nd) in enumerate(availability):
+        # 予約不可の開始を検出
+        if st == "不可" and (i == 0 or availability[i-1][1] != "不可"):
+            # 開始が24時以降（翌日）の場合はスキップ
+            if nd:
+                start_idx = None  # 明示的にNoneを設定
+                continue
+            start_idx = i
+        
+        # 予約不可の終了を検出して記録
+        if start_idx is not None and (st != "不可" or i == len(availability)-1):
+            end_idx = i if st != "不可" else i+1
             
-            # user_agentを設定
-            page.set_extra_http_headers({
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36"
+            # 開始時刻と終了時刻の処理
+            st_obj = datetime.strptime(availability[start_idx][0], "%H:%M")
+            en_obj = datetime.strptime(availability[end_idx-1][0], "%H:%M") + timedelta(minutes=15)
+            dur = (end_idx - start_idx) * 15
+            
+            # 終了が翌日にまたがる場合の日付処理
+            end_is_next_day = availability[end_idx-1][2] if end_idx-1 < len(availability) else False
+            
+            rr.append({
+                'start_date': formatted,  # 開始は必ず当日
+                'end_date': formatted if not end_is_next_day else f"{(current_date+timedelta(days=1)).month}月{(current_date+timedelta(days=1)).day}日",
+                'start_time': st_obj.strftime("%H:%M"),
+                'end_time': en_obj.strftime("%H:%M"),
+                'duration_hours': dur // 60,
+                'duration_minutes': dur % 60
             })
+            start_idx = None
+    return rr
+
+
+def get_reservation_data(original_url, on_date=None, done_dates=(), should_stop=None):
+    """Playwrightを使用して、トップページ→予約ページと遷移後に予約情報とプラン情報を取得する関数"""
+    try:
+        # ブラウザは使い回し、URLごとに新しいコンテキストを使用（ページはコンテキストと一緒に閉じる）
+        with browser_pool.browser_context(original_url) as context:
+            page = context.new_page()
 
             # URL形式を判定して、roomUidとspaceIdを抽出
             room_match = re.search(r'/p/([^/?]+)', original_url)
@@ -307,7 +560,10 @@ def get_reservation_data(original_url):
 
             # 日付リスト生成
             today = datetime.now(timezone(timedelta(hours=9)))
-            dates = [today + timedelta(days=i) for i in range(28)]
+            dates = target_dates()
+
+            # 表示中のカレンダーの月
+            nav = {}
 
             # プラン情報取得 （フォールバック機能付き）
             plans = []
@@ -316,23 +572,10 @@ def get_reservation_data(original_url):
                 plan_acquired = False
                 for fallback_days in range(8):  # 0日後（今日）から7日後まで
                     target_date = today + timedelta(days=fallback_days)
-                    date_str = f"{target_date.year}年{target_date.month}月{target_date.day}日"
                     
                     try:
-                        # 日付ボタンを探す
-                        btn = page.locator(f'button[aria-label="{date_str}"]')
-                        
-                        # ボタンが見つからない場合は次の月に移動してから再度探す
-                        if btn.count() == 0:
-                            nxt = page.locator('button[aria-label="次の月"]')
-                            if nxt.count() > 0:
-                                nxt.click()
-                                time.sleep(1)
-                                btn = page.locator(f'button[aria-label="{date_str}"]')
-                        
-                        # ボタンが見つかった場合はクリックしてプラン情報を取得
-                        if btn.count() > 0:
-                            btn.click()
+                        # 日付ボタンをクリック（必要な回数だけ月を移動）してプラン情報を取得
+                        if _click_date(page, nav, target_date):
                             time.sleep(2)
                             
                             # プラン要素を取得
@@ -385,22 +628,18 @@ def get_reservation_data(original_url):
 
             # 予約状況取得 （既存ロジック）
             all_reserved_times = {}
+            stopped = False
             for current_date in dates:
+                if current_date.strftime('%Y-%m-%d') in done_dates:
+                    continue
+                if should_stop and should_stop():
+                    stopped = True
+                    break
                 formatted = f"{current_date.month}月{current_date.day}日"
-                date_str = f"{current_date.year}年{current_date.month}月{current_date.day}日"
                 try:
-                    btn = page.locator(f'button[aria-label="{date_str}"]')
-                    if btn.count() == 0:
-                        # 次の月移動ロジック...
-                        nxt = page.locator('button[aria-label="次の月"]')
-                        if nxt.count() > 0:
-                            nxt.click()
-                            time.sleep(1)
-                            btn = page.locator(f'button[aria-label="{date_str}"]')
-                    if btn.count() == 0:
+                    if not _click_date(page, nav, current_date):
                         all_reserved_times[formatted] = []
                         continue
-                    btn.click()
                     time.sleep(1)
                     slots = page.query_selector_all("div.css-1i0gn25")
                     availability = []
@@ -416,41 +655,16 @@ def get_reservation_data(original_url):
                         status = "不可" if disabled else ("選択中" if selected else "可能")
                         availability.append((ts, status, next_day))
                     # 連続予約抽出
-                    rr = []
-                    start_idx = None
-                    for i, (ts, st, nd) in enumerate(availability):
-                        # 予約不可の開始を検出
-                        if st == "不可" and (i == 0 or availability[i-1][1] != "不可"):
-                            # 開始が24時以降（翌日）の場合はスキップ
-                            if nd:
-                                start_idx = None  # 明示的にNoneを設定
-                                continue
-                            start_idx = i
-                        
-                        # 予約不可の終了を検出して記録
-                        if start_idx is not None and (st != "不可" or i == len(availability)-1):
-                            end_idx = i if st != "不可" else i+1
-                            
-                            # 開始時刻と終了時刻の処理
-                            st_obj = datetime.strptime(availability[start_idx][0], "%H:%M")
-                            en_obj = datetime.strptime(availability[end_idx-1][0], "%H:%M") + timedelta(minutes=15)
-                            dur = (end_idx - start_idx) * 15
-                            
-                            # 終了が翌日にまたがる場合の日付処理
-                            end_is_next_day = availability[end_idx-1][2] if end_idx-1 < len(availability) else False
-                            
-                            rr.append({
-                                'start_date': formatted,  # 開始は必ず当日
-                                'end_date': formatted if not end_is_next_day else f"{(current_date+timedelta(days=1)).month}月{(current_date+timedelta(days=1)).day}日",
-                                'start_time': st_obj.strftime("%H:%M"),
-                                'end_time': en_obj.strftime("%H:%M"),
-                                'duration_hours': dur // 60,
-                                'duration_minutes': dur % 60
-                            })
-                            start_idx = None
+                    rr = extract_reserved_ranges(availability, current_date)
                     all_reserved_times[formatted] = rr
                 except:
                     all_reserved_times[formatted] = []
+                    continue
+                # 取得できた日付は都度保存（タイムアウトしても再配信時はここから再開できる）
+                if on_date:
+                    on_date(original_url, current_date, _single_date_data(
+                        original_url, plans, space_name, space_id, formatted, rr
+                    ))
 
             return {
                 'url': original_url,
@@ -458,20 +672,193 @@ def get_reservation_data(original_url):
                 'reserved_times': all_reserved_times,
                 'timestamp': datetime.now(timezone(timedelta(hours=9))).isoformat(),
                 'name': space_name,
-                'space_id': space_id
+                'space_id': space_id,
+                'stopped': stopped
             }
 
+    except Exception as e:
+        return {'error': str(e)}
+
+
+
+# ===== asyncio 実行モード（EXECUTION_MODE=async）=====
+
+async def get_reservation_data_async(context, original_url, on_date=None, done_dates=(), should_stop=None):
+    """get_reservation_data の非同期版（context は呼び出し側で用意・破棄する）"""
+    try:
+        page = await context.new_page()
+
+        # URL形式を判定して、roomUidとspaceIdを抽出
+        room_match = re.search(r'/p/([^/?]+)', original_url)
+        space_match_direct = re.search(r'/spaces/([^/?]+)', original_url)
+
+        if room_match:
+            room_uid = room_match.group(1)
+        elif space_match_direct:
+            space_id_from_url = space_match_direct.group(1)
+            room_uid = parse_qs(urlparse(original_url).query).get('room_uid', [None])[0]
+            if not room_uid:
+                return {'error': 'room_uid パラメータが見つかりません'}
+        else:
+            return {'error': '対応していないURL形式です'}
+
+        # 1) トップページにアクセス（/p/ 形式はリダイレクト後の URL から spaceId を取得）
+        resp = await page.goto(original_url, wait_until='networkidle', timeout=90000)
+        if not resp.ok:
+            return {'error': f"ページロードエラー: {resp.status} {resp.status_text}"}
+        await asyncio.sleep(2)
+        if room_match:
+            space_match = re.search(r'/spaces/([^/]+)/', page.url)
+            if not space_match:
+                return {'error': 'spaceId の抽出失敗'}
+            space_id_from_url = space_match.group(1)
+
+        # 2) 予約ページ URL を組み立てて遷移
+        reservation_url = (
+            f"https://www.spacemarket.com/spaces/{space_id_from_url}"
+            f"/rooms/{room_uid}/reservations/new/"
+            "?from=room_reservation_button&price_type=HOURLY&promotion_ids=4808&rent_type=1"
+        )
+        resp2 = await page.goto(reservation_url, wait_until='networkidle', timeout=90000)
+        if not resp2.ok:
+            return {'error': f"予約ページロードエラー: {resp2.status} {resp2.status_text}"}
+        await asyncio.sleep(3)
+
+        # JSONデータを取得
+        space_id = ''
+        plans_data = []
+        try:
+            script_el = await page.query_selector('script#__NEXT_DATA__')
+            if script_el:
+                json_data = json.loads(await script_el.inner_text())
+                room_fragment = json_data.get('props', {}).get('pageProps', {}).get('roomFragment', {})
+                space_id = room_fragment.get('id', '')
+                plans_data = room_fragment.get('plans', {}).get('results', [])
         except Exception as e:
-            return {'error': str(e)}
-        finally:
-            # 確実なクリーンアップ（メルカリコードの方式）
-            if page:
-                try:
-                    page.close()
-                except:
-                    pass
-            if browser:
-                try:
-                    browser.close()
-                except:
-                    pass
\ No newline at end of file
+            print(f"JSON取得エラー: {e}")
+            space_id = ''
+
+        # スペース名取得
+        space_name = ''
+        try:
+            el = await page.query_selector("p.css-4mpmt5")
+            if el:
+                space_name = await el.inner_text()
+        except:
+            pass
+
+        today = datetime.now(timezone(timedelta(hours=9)))
+        dates = target_dates()
+
+        # 表示中のカレンダーの月
+        nav = {}
+
+        # プラン情報取得（最大7日先まで試行）
+        plans = []
+        for fallback_days in range(8):
+            target_date = today + timedelta(days=fallback_days)
+            try:
+                if not await _click_date_async(page, nav, target_date, 2):
+                    continue
+                elems = await page.query_selector_all("li.css-1vwbwmt, li.css-1cpdoqx")
+                if not elems:
+                    elems = await page.query_selector_all("li button span.css-k6zetj")
+                if not elems:
+                    continue
+                for i, plan in enumerate(elems):
+                    try:
+                        # 価格取得ロジック（優先順位に従って取得）
+                        price = "価格不明"
+                        for selector in ('.css-1y4ezd0', '.css-d362cm', '.css-1sq1blk'):
+                            price_el = await plan.query_selector(selector)
+                            if price_el:
+                                price = await price_el.inner_text()
+                                break
+                        plan_id = plans_data[i].get('id', '') if i < len(plans_data) else ''
+                        plan_name = plans_data[i].get('name', '') if i < len(plans_data) else ''
+                        plans.append({'name': plan_name, 'price': price, 'id': plan_id})
+                    except:
+                        pass
+                print(f"プラン情報を{fallback_days}日後({target_date.month}月{target_date.day}日)のデータから取得しました")
+                break
+            except Exception as e:
+                print(f"{fallback_days}日後のプラン取得試行でエラー: {e}")
+        else:
+            print("7日間の試行でもプラン情報を取得できませんでした")
+
+        # 予約状況取得
+        all_reserved_times = {}
+        stopped = False
+        for current_date in dates:
+            if current_date.strftime('%Y-%m-%d') in done_dates:
+                continue
+            if should_stop and should_stop():
+                stopped = True
+                break
+            formatted = f"{current_date.month}月{current_date.day}日"
+            try:
+                if not await _click_date_async(page, nav, current_date, 1):
+                    all_reserved_times[formatted] = []
+                    continue
+                # スロットの属性は1回の評価でまとめて取得
+                flags = await page.eval_on_selector_all(
+                    "div.css-1i0gn25",
+                    "els => els.map(e => [e.getAttribute('data-disabled'), e.getAttribute('data-selected')])"
+                )
+                availability = []
+                zero = datetime.strptime("00:00", "%H:%M")
+                for i, (disabled_attr, selected_attr) in enumerate(flags):
+                    t = zero + timedelta(minutes=15 * i)
+                    h, m = t.hour, t.minute
+                    next_day = h >= 24
+                    if next_day: h -= 24
+                    disabled = disabled_attr == "true"
+                    selected = selected_attr == "true"
+                    status = "不可" if disabled else ("選択中" if selected else "可能")
+                    availability.append((f"{h:02d}:{m:02d}", status, next_day))
+                all_reserved_times[formatted] = extract_reserved_ranges(availability, current_date)
+            except:
+                all_reserved_times[formatted] = []
+                continue
+            if on_date:
+                # DynamoDB への書き込みはイベントループを止めないよう別スレッドで行う
+                await asyncio.to_thread(on_date, original_url, current_date, _single_date_data(
+                    original_url, plans, space_name, space_id, formatted, all_reserved_times[formatted]
+                ))
+
+        return {
+            'url': original_url,
+            'plans': plans,
+            'reserved_times': all_reserved_times,
+            'timestamp': datetime.now(timezone(timedelta(hours=9))).isoformat(),
+            'name': space_name,
+            'space_id': space_id,
+            'stopped': stopped
+        }
+
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def _click_date(page, nav, target_date):
+    """日付ボタンをクリック（表示中の月から必要な回数だけ月を移動する）。見つからなければ False"""
+    try:
+        calendar_nav.click_date(page, nav, target_date, after=lambda p, _: time.sleep(1))
+        return True
+    except Exception as e:
+        print(f"日付選択エラー: {calendar_nav.date_label(target_date)} - {e}")
+        return False
+
+
+async def _click_date_async(page, nav, target_date, wait_seconds):
+    """_click_date の非同期版（クリック後に wait_seconds 秒待つ）。見つからなければ False"""
+    async def after_month_click(p, _):
+        await asyncio.sleep(1)
+
+    try:
+        await calendar_nav.click_date_async(page, nav, target_date, after=after_month_click)
+    except Exception as e:
+        print(f"日付選択エラー: {calendar_nav.date_label(target_date)} - {e}")
+        return False
+    await asyncio.sleep(wait_seconds)
+    return True
@@ -0,0 +1,96 @@
+import os
+import asyncio
+from playwright.async_api import async_playwright
+import browser_pool
+import resource_blocker
+
+# playwright.async_api で複数URLを1つのブラウザ上で並行処理する実行モード。
+# URLごとに BrowserContext を作成し、同時実行数はセマフォで制限する。
+# イベントループとブラウザはモジュール単位で保持し、ウォームスタート間で使い回す
+# （起動オプション・再起動の条件は browser_pool と同じ）。
+
+# 同時に処理するURL数
+ASYNC_CONCURRENCY = int(os.environ.get('ASYNC_CONCURRENCY', '3'))
+
+# async_api のオブジェクトは作成したイベントループでしか使えないため、ループも呼び出し間で使い回す
+_loop = None
+_playwright = None
+_browser = None
+_pages_opened = 0
+_needs_restart = False
+
+
+def run_urls(urls, worker, concurrency=None):
+    """
+    worker(context, url) を各URLについて並行実行する。
+    戻り値: [(url, 結果, 例外), ...]（入力順、失敗時は結果が None）
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(_run_all(urls, worker, concurrency or ASYNC_CONCURRENCY))
+
+
+async def get_browser():
+    """起動済みのブラウザを返す（未起動・切断・再起動条件に該当する場合は起動し直す）"""
+    global _playwright, _browser, _pages_opened, _needs_restart
+
+    if _browser is not None:
+        reason = browser_pool.restart_reason(_browser, _pages_opened)
+        if _needs_restart:
+            reason = "ブラウザ再起動: 前回の実行でコンテキストを閉じられなかったため"
+        if reason:
+            print(reason)
+            await close_browser()
+
+    if _browser is None:
+        if _playwright is None:
+            _playwright = await async_playwright().start()
+        _browser = await _playwright.chromium.launch(headless=True, args=browser_pool.LAUNCH_ARGS)
+        _pages_opened = 0
+        _needs_restart = False
+    return _browser
+
+
+async def close_browser():
+    """ブラウザを終了する（Playwright 本体は次回の起動に使い回す）"""
+    global _browser
+    if _browser is not None:
+        try:
+            await _browser.close()
+        except Exception:
+            pass
+        _browser = None
+
+
+async def _run_all(urls, worker, concurrency):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # 再起動の判定は実行の開始時だけ行う（実行中は全URLで同じブラウザを使う）
+    browser = await get_browser()
+
+    async def run_one(url):
+        global _needs_restart
+        async with semaphore:
+            context = await browser.new_context(user_agent=browser_pool.USER_AGENT)
+            context.on('page', _count_page)
+            block_stats = await resource_blocker.install_async(context)
+            try:
+                return url, await worker(context, url), None
+            except Exception as e:
+                print(f"並行処理エラー ({url}): {e}")
+                return url, None, e
+            finally:
+                resource_blocker.report(block_stats, url)
+                try:
+                    await context.close()
+                except Exception as e:
+                    # コンテキストが閉じられない場合は、他のURLが使用中のため次回の実行でブラウザごと作り直す
+                    print(f"コンテキストのクローズに失敗: {e}")
+                    _needs_restart = True
+
+    return await asyncio.gather(*(run_one(url) for url in urls))
+
+
+def _count_page(page):
+    global _pages_opened
+    _pages_opened += 1
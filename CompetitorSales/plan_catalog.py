@@ -0,0 +1,209 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import boto3
+
+# スペースごとのプラン一覧（カタログ）。価格・予約の行と同じテーブル・パーティションに、
+# ソートキー 'CATALOG#<planId>' の行をプランごとに持つ
+#   planId, planDisplayName, first_seen / last_seen: 初めて・最後に書き込んだ日（YYYY-MM-DD）、item_count: 書き込んだ行数の累計
+# 問い合わせ側はこの行だけを begins_with で Query すれば、履歴の量によらずプラン一覧を得られる。
+# 同じスペースを複数のジョブが並行して書き込むため、読み込まずに update_item（if_not_exists / ADD）で更新する。
+# 1回の実行中は start / add でプランごとの件数をメモリにまとめ、最後に flush でプランごとに1回だけ更新する。
+# ただし実行中に初めて見つかったプランは、その日付をチェックポイントに処理済みと記録する前に flush(new_only=True) で
+# 反映する（途中で終了して最後の flush が動かなくても、再スキャンされない日付のプランがカタログから漏れないように）。
+
+JST = timezone(timedelta(hours=9))
+
+CATALOG_PREFIX = 'CATALOG#'
+
+# カタログ導入前のデータのプランを取り込み終えたことを示す行のソートキー（スクレイパーが backfill で書く）。
+# 問い合わせ側（Get_*）はこの行がないスペースだけ、カタログ行に加えて全件 Query の結果も使う（読み込みのみ）
+CATALOG_MARKER_KEY = 'CATALOG'
+
+# 'on' = 書き込みのたびにカタログを更新する、'off' = 更新しない
+PLAN_CATALOG_MODE = os.environ.get('PLAN_CATALOG_MODE', 'on')
+
+# boto3 のセッション・リソースはスレッドセーフでないため、呼び出し元のスレッド（書き込みスレッドなど）ごとに持つ
+_local = threading.local()
+
+# 取り込み済みの印の行があることを確認した (テーブル名, spaceId)（Lambda のウォームスタート間で再利用する）
+_backfilled_spaces = set()
+
+
+def get_dynamodb():
+    if getattr(_local, 'dynamodb', None) is None:
+        _local.dynamodb = boto3.session.Session().resource('dynamodb')
+    return _local.dynamodb
+
+
+def catalog_key(plan_id):
+    return f"{CATALOG_PREFIX}{plan_id}"
+
+
+def count_plans(items):
+    """アイテム（spaceId, planId, planDisplayName を持つ dict）を {(spaceId, planId): (表示名, 件数)} にまとめる"""
+    plans = {}
+    for item in items:
+        if not item.get('planId'):
+            continue
+        key = (item['spaceId'], item['planId'])
+        name, count = plans.get(key, ('', 0))
+        plans[key] = (name or item.get('planDisplayName', ''), count + 1)
+    return plans
+
+
+def start():
+    """1回の実行分のカタログ更新をまとめる dict を返す（add は複数のスレッドから呼んでよい）"""
+    return {'plans': {}, 'flushed': set(), 'lock': threading.Lock()}
+
+
+def add(catalog, items):
+    """書き込みに成功したアイテムのプランと件数を catalog に加える"""
+    with catalog['lock']:
+        for key, (name, count) in count_plans(items).items():
+            total_name, total = catalog['plans'].get(key, ('', 0))
+            catalog['plans'][key] = (total_name or name, total + count)
+
+
+def flush(catalog, table_name, sort_key, seen_date=None, ttl=None, new_only=False):
+    """
+    catalog にまとめたプランをカタログ行に反映する（失敗しても書き込みは成功扱い、失敗した分は次の flush で再度反映する）。
+    seen_date: 未指定なら今日（JST）、ttl: 指定した場合はカタログ行の TTL 属性も更新する
+    new_only: True の場合はこの実行でまだ反映していないプランだけを反映する
+    戻り値: 更新したカタログ行の数
+    """
+    with catalog['lock']:
+        if new_only:
+            plans = {key: value for key, value in catalog['plans'].items() if key not in catalog['flushed']}
+        else:
+            plans = dict(catalog['plans'])
+        for key in plans:
+            del catalog['plans'][key]
+        catalog['flushed'].update(plans)
+    if PLAN_CATALOG_MODE == 'off' or not plans:
+        return 0
+    seen_date = seen_date or datetime.now(JST).strftime('%Y-%m-%d')
+    table = get_dynamodb().Table(table_name)
+    updated = 0
+    for (space_id, plan_id), (name, count) in plans.items():
+        expression = ('SET planId = :p, planDisplayName = :n, last_seen = :d, '
+                      'first_seen = if_not_exists(first_seen, :d) ADD item_count :c')
+        names = None
+        values = {':p': plan_id, ':n': name, ':d': seen_date, ':c': count}
+        if ttl is not None:
+            expression = expression.replace(' ADD', ', #ttl = :t ADD')
+            names = {'#ttl': 'ttl'}
+            values[':t'] = ttl
+        kwargs = {
+            'Key': {'spaceId': space_id, sort_key: catalog_key(plan_id)},
+            'UpdateExpression': expression,
+            'ExpressionAttributeValues': values,
+        }
+        if names:
+            kwargs['ExpressionAttributeNames'] = names
+        try:
+            table.update_item(**kwargs)
+            updated += 1
+        except Exception as e:
+            print(f"プランカタログの更新エラー ({space_id}, {plan_id}): {e}")
+            # 件数を戻し、未反映のプランとして次の flush で再度反映する
+            with catalog['lock']:
+                catalog['flushed'].discard((space_id, plan_id))
+                total_name, total = catalog['plans'].get((space_id, plan_id), ('', 0))
+                catalog['plans'][(space_id, plan_id)] = (total_name or name, total + count)
+    print(f"プランカタログ更新: {updated}/{len(plans)}件")
+    return updated
+
+
+def backfill(catalog, table_name, sort_key, source_table_names, plan_of, projection=None):
+    """
+    この実行で書き込んだスペースのうち取り込み済みの印の行がないものについて、カタログ導入前のデータのプランを
+    カタログ行に取り込み、印の行を書く（1スペースにつき初回だけ、source_table_names のパーティション全体を Query する）。
+    plan_of(item): 元データの行から (planId, 表示名, ttl または None) を返す関数（プランの行でなければ None）
+    カタログ行の更新は何度行っても同じ結果になり、印の行は条件付きで書くため、複数のジョブが同時に取り込んでもよい。
+    失敗した場合は印を書かず、次回の実行でもう一度取り込む。戻り値: 取り込んだスペースの数
+    """
+    if PLAN_CATALOG_MODE == 'off':
+        return 0
+    with catalog['lock']:
+        space_ids = sorted({space_id for space_id, _ in catalog['flushed']})
+    table = get_dynamodb().Table(table_name)
+    done = 0
+    for space_id in space_ids:
+        if (table_name, space_id) in _backfilled_spaces:
+            continue
+        try:
+            marker = table.get_item(Key={'spaceId': space_id, sort_key: CATALOG_MARKER_KEY}, ConsistentRead=True)
+            if 'Item' not in marker:
+                legacy_plans = collect_plans(space_id, source_table_names, plan_of, projection)
+                for plan_id, (name, ttl) in legacy_plans.items():
+                    _backfill_plan(table, sort_key, space_id, plan_id, name, ttl)
+                _put_marker(table, sort_key, space_id, len(legacy_plans))
+                print(f"プランカタログに取り込み ({space_id}): {len(legacy_plans)}件")
+                done += 1
+            _backfilled_spaces.add((table_name, space_id))
+        except Exception as e:
+            print(f"プランカタログの取り込みエラー ({space_id}): {e}")
+    return done
+
+
+def collect_plans(space_id, source_table_names, plan_of, projection=None):
+    """元データのテーブルから spaceId のプラン {planId: (表示名, 最大の ttl または None)} を集める"""
+    plans = {}
+    for source_table_name in source_table_names:
+        kwargs = {
+            'KeyConditionExpression': 'spaceId = :space_id',
+            'ExpressionAttributeValues': {':space_id': space_id},
+        }
+        if projection:
+            kwargs['ProjectionExpression'] = projection
+        source = get_dynamodb().Table(source_table_name)
+        while True:
+            response = source.query(**kwargs)
+            for item in response.get('Items', []):
+                plan = plan_of(item)
+                if not plan or not plan[0]:
+                    continue
+                plan_id, name, ttl = plan
+                known_name, known_ttl = plans.get(plan_id, ('', None))
+                if ttl is not None and known_ttl is not None:
+                    ttl = max(ttl, known_ttl)
+                plans[plan_id] = (known_name or name or '', ttl if ttl is not None else known_ttl)
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return plans
+
+
+def _backfill_plan(table, sort_key, space_id, plan_id, name, ttl):
+    """カタログ行がなければ作る（既にあれば表示名・TTL は変えない）"""
+    expression = 'SET planId = :p, planDisplayName = if_not_exists(planDisplayName, :n)'
+    values = {':p': plan_id, ':n': name}
+    kwargs = {}
+    if ttl:
+        # 元データと同じ時期に消えるよう、カタログ行の TTL がなければ元データの最も遅い TTL を使う
+        expression += ', #ttl = if_not_exists(#ttl, :t)'
+        values[':t'] = ttl
+        kwargs['ExpressionAttributeNames'] = {'#ttl': 'ttl'}
+    table.update_item(
+        Key={'spaceId': space_id, sort_key: catalog_key(plan_id)},
+        UpdateExpression=expression,
+        ExpressionAttributeValues=values,
+        **kwargs
+    )
+
+
+def _put_marker(table, sort_key, space_id, plan_count):
+    """取り込み済みの印の行を書く（他のジョブが先に書いていればそのまま）"""
+    try:
+        table.put_item(
+            Item={
+                'spaceId': space_id,
+                sort_key: CATALOG_MARKER_KEY,
+                'backfilled_at': datetime.now(JST).isoformat(),
+                'backfilled_plans': plan_count,
+            },
+            ConditionExpression='attribute_not_exists(spaceId)'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
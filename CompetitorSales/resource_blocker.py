@@ -0,0 +1,139 @@
+import os
+from urllib.parse import urlparse
+
+# BrowserContext にルートを設定し、スクレイピングに不要な画像・フォント・計測タグ等の読み込みを止める。
+# 読み込みが減ることで networkidle までの時間と --single-process Chromium のメモリ使用量を抑える。
+
+# 'on' = ブロックする、'off' = 何もしない
+RESOURCE_BLOCKING = os.environ.get('RESOURCE_BLOCKING', 'on')
+
+# ブロックするリソース種別（Playwright の request.resource_type）
+BLOCK_RESOURCE_TYPES = {
+    t.strip() for t in os.environ.get('BLOCK_RESOURCE_TYPES', 'image,media,font').split(',') if t.strip()
+}
+
+# ブロックするホスト（サブドメインも対象）
+BLOCK_HOSTS = tuple(
+    h.strip() for h in os.environ.get(
+        'BLOCK_HOSTS',
+        'google-analytics.com,googletagmanager.com,doubleclick.net,googlesyndication.com,'
+        'googleadservices.com,facebook.net,facebook.com,connect.facebook.net,analytics.twitter.com,'
+        'ads-twitter.com,bat.bing.com,clarity.ms,hotjar.com,criteo.com,criteo.net,'
+        'tr.line.me,karte.io,datadoghq-browser-agent.com,sentry.io'
+    ).split(',') if h.strip()
+)
+
+# 常に通すホスト（種別・ホストのブロック指定より優先）
+ALLOW_HOSTS = tuple(h.strip() for h in os.environ.get('ALLOW_HOSTS', '').split(',') if h.strip())
+
+# ブロックした分のサイズの推定に使うリソース種別ごとの平均サイズ(バイト)。
+# 中断したリクエストは実サイズが分からないため、件数×この値の目安であり実測値ではない
+ESTIMATED_BYTES = {
+    'image': 60000,
+    'media': 500000,
+    'font': 40000,
+    'stylesheet': 20000,
+    'script': 50000,
+    'xhr': 2000,
+    'fetch': 2000,
+    'other': 5000,
+}
+
+
+def is_enabled():
+    return RESOURCE_BLOCKING != 'off'
+
+
+def should_block(url, resource_type):
+    """リクエストをブロックするか判定する"""
+    host = (urlparse(url).hostname or '').lower()
+    if _match_host(host, ALLOW_HOSTS):
+        return False
+    if resource_type in BLOCK_RESOURCE_TYPES:
+        return True
+    return _match_host(host, BLOCK_HOSTS)
+
+
+def install(context):
+    """同期版 BrowserContext にルートを設定し、集計用の dict を返す（無効時も空の集計を返す）"""
+    stats = new_stats()
+    if not is_enabled():
+        return stats
+
+    def handle(route):
+        request = route.request
+        try:
+            if _record(stats, request.url, request.resource_type):
+                route.abort()
+            else:
+                route.continue_()
+        except Exception:
+            # ページ遷移・クローズ済みのリクエストは無視
+            pass
+
+    context.route('**/*', handle)
+    context.on('response', lambda response: _record_loaded(stats, response))
+    return stats
+
+
+async def install_async(context):
+    """install の非同期版（async_api の BrowserContext 用）"""
+    stats = new_stats()
+    if not is_enabled():
+        return stats
+
+    async def handle(route):
+        request = route.request
+        try:
+            if _record(stats, request.url, request.resource_type):
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception:
+            pass
+
+    await context.route('**/*', handle)
+    context.on('response', lambda response: _record_loaded(stats, response))
+    return stats
+
+
+def new_stats():
+    # blocked_bytes_estimate: ブロックした分の推定サイズ（ESTIMATED_BYTES による目安）
+    # loaded_bytes: 通したリクエストの応答の content-length の合計（実測。ヘッダーがない応答は含まない）
+    return {'requests': 0, 'blocked': 0, 'blocked_bytes_estimate': 0, 'loaded_bytes': 0, 'by_type': {}}
+
+
+def report(stats, label=''):
+    """ブロック件数・ブロック分の推定サイズ・実際に読み込んだサイズをログに出力し、集計をリセットする"""
+    if stats and stats['requests']:
+        by_type = ', '.join(f"{t}={n}" for t, n in sorted(stats['by_type'].items()))
+        print(f"リソースブロック{f' ({label})' if label else ''}: "
+              f"{stats['blocked']}/{stats['requests']}件をブロック [{by_type}]、"
+              f"ブロック分の推定サイズ（種別ごとの平均値による目安・実測ではない）約{stats['blocked_bytes_estimate'] // 1024}KB、"
+              f"読み込んだ応答の content-length 合計 {stats['loaded_bytes'] // 1024}KB")
+    if stats:
+        stats.update(new_stats())
+
+
+def _record(stats, url, resource_type):
+    """リクエストを集計し、ブロック対象なら True を返す"""
+    stats['requests'] += 1
+    if not should_block(url, resource_type):
+        return False
+    stats['blocked'] += 1
+    stats['blocked_bytes_estimate'] += ESTIMATED_BYTES.get(resource_type, ESTIMATED_BYTES['other'])
+    stats['by_type'][resource_type] = stats['by_type'].get(resource_type, 0) + 1
+    return True
+
+
+def _record_loaded(stats, response):
+    """通したリクエストの応答サイズ（content-length）を集計する"""
+    try:
+        stats['loaded_bytes'] += int(response.headers.get('content-length', 0))
+    except Exception:
+        # ヘッダーが不正・ページクローズ済みの応答は数えない
+        pass
+
+
+def _match_host(host, hosts):
+    return any(host == h or host.endswith('.' + h) for h in hosts)
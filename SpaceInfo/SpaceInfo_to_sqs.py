@@ -1,5 +1,15 @@
-import boto3
 import json
+import os
+import job_planner
+import sqs_enqueue
+
+# 1メッセージあたりのURL数の上限
+MAX_URLS_PER_MESSAGE = int(os.environ.get('MAX_URLS_PER_MESSAGE', '100'))
+
+# コスト表に実績がないURLの見積もり
+DEFAULT_COSTS_MS = {
+    'url_ms': int(os.environ.get('DEFAULT_URL_COST_MS', '15000')),
+}
 
 def lambda_handler(event, context):
     if 'body' in event:
@@ -21,18 +31,22 @@ def lambda_handler(event, context):
         }
 
     # SQSにメッセージ送信
-    sqs = boto3.client('sqs')
     queue_url = 'https://sqs.ap-northeast-1.amazonaws.com/897729114300/SpaceInfo'
     
     try:
-        sqs.send_message(
-            QueueUrl=queue_url,
-            MessageBody=json.dumps({
-                "urls": urls,
+        # URLごとの処理時間の実績から、見積もり時間の合計が目標に収まるだけ1メッセージにまとめて送信
+        messages = [
+            {
+                "urls": batch,
                 "timestamp": context.aws_request_id  # リクエストIDを追加
-            })
-        )
-        
+            }
+            for batch in plan_batches(urls)
+        ]
+        result = sqs_enqueue.send_messages(queue_url, messages)
+        if result['failed']:
+            raise Exception(f"{len(result['failed'])}/{len(messages)}件のメッセージを送信できませんでした: "
+                            f"{result['failed'][0]['error']}")
+
         response_body = {
             "message": f"{len(urls)}件のURL処理をキューに追加しました",
             "total_urls": len(urls),
@@ -51,4 +65,11 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'error': f"キューへの送信エラー: {str(e)}"
             })
-        }
\ No newline at end of file
+        }
+
+
+def plan_batches(urls):
+    """コスト表の実績から、URLを見積もり時間で詰め合わせたリストのリストを返す"""
+    costs = job_planner.load_costs('SpaceInfo', urls)
+    entries = [(url, job_planner.estimate(costs.get(url), DEFAULT_COSTS_MS)[0]) for url in dict.fromkeys(urls)]
+    return job_planner.pack(entries, max_items=MAX_URLS_PER_MESSAGE)
\ No newline at end of file
@@ -5,8 +5,53 @@ import re
 from datetime import datetime, timedelta, timezone
 import time
 import json
+import os
+import asyncio
+import threading
 from playwright.sync_api import sync_playwright
 from boto3.dynamodb.conditions import Key
+import async_runner
+import resource_blocker
+import job_planner
+
+# URLの処理方法: 'sync' = 1件ずつ順番に処理、'async' = asyncio で複数URLを並行処理
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'sync')
+
+# DynamoDB リソース（Lambda のウォームスタート間で再利用）。
+# async モードでは process_single_url が複数のスレッドから呼ばれ、boto3 のセッション・リソースはスレッドセーフでないため、スレッドごとに持つ
+_local = threading.local()
+
+# データ抽出用スクリプト（記号をポイントに変換）
+POINTS_JS = '''() => {
+        const buttons = document.querySelectorAll('.css-j3mvlq button');
+        if (!buttons || buttons.length === 0) {
+            return [];
+        }
+        
+        return Array.from(buttons).map(button => {
+            const day = button.querySelector('.css-7tvow, .css-qo22pl, .css-1fvi6cv')?.textContent || "";
+            const date = button.querySelector('.css-lw8eys, .css-b91hki, .css-19jz4op')?.textContent || "";
+            
+            // 記号をポイント(数値)に変換
+            let point = 0; // デフォルトは0
+            
+            if (button.querySelector('.icon-spm-double-circle')) {
+                point = 0; // 二重丸は0
+            } else if (button.querySelector('.icon-spm-single-circle')) {
+                point = 1; // 丸は1
+            } else if (button.querySelector('.icon-spm-triangle')) {
+                point = 2; // 三角は2
+            } // それ以外はデフォルトの0のまま
+            
+            return { day, date, point };
+        });
+    }'''
+
+def get_dynamodb():
+    """DynamoDB リソースを取得（スレッドごとに作成して使い回す）"""
+    if getattr(_local, 'dynamodb', None) is None:
+        _local.dynamodb = boto3.session.Session().resource('dynamodb')
+    return _local.dynamodb
 
 def extract_room_id_from_soup(soup):
     try:
@@ -21,8 +66,8 @@ def extract_room_id_from_soup(soup):
         print(f"room_id取得エラー: {e}")
         return None
 
-def process_single_url(url, now, page=None):
-    """単一URLの処理"""
+def process_single_url(url, now, page=None, points_data=None):
+    """単一URLの処理（points_data を渡した場合はポイント情報の取得を省略）"""
     result = {
         "url": url,
         "success": False,
@@ -36,7 +81,7 @@ def process_single_url(url, now, page=None):
             'User-Agent': 'Mozilla/5.0'
         }
 
-        table = boto3.resource('dynamodb').Table('SpaceInfo')
+        table = get_dynamodb().Table('SpaceInfo')
 
         response = requests.get(url, headers=headers)
         response.raise_for_status()
@@ -120,7 +165,8 @@ def process_single_url(url, now, page=None):
         # ===== 追加ここまで =====
 
         # Playwrightを使用してポイント情報を取得
-        points_data = get_points_data(url, page)
+        if points_data is None:
+            points_data = get_points_data(url, page)
 
         # 1週間分のデータを生成
         for i in range(7):
@@ -167,6 +213,9 @@ def lambda_handler(event, context):
     JST = timezone(timedelta(hours=9))
     now = datetime.now(JST)
     
+    if EXECUTION_MODE == 'async':
+        return process_records_concurrently(event, now)
+
     results = []
     
     # ブラウザを一度だけ作成して全URLで共有
@@ -186,6 +235,8 @@ def lambda_handler(event, context):
         context = browser.new_context(
             user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36'
         )
+        # 画像・フォント・計測タグの読み込みを止める
+        block_stats = resource_blocker.install(context)
         page = context.new_page()
         
         try:
@@ -200,8 +251,14 @@ def lambda_handler(event, context):
                     # 各URLを処理
                     for url in urls:
                         print(f"処理中: {url}")
+                        measure = job_planner.start_measure()
                         result = process_single_url(url, now, page)
                         results.append(result)
+                        resource_blocker.report(block_stats, url)
+                        # 処理時間をコスト表に記録（投入側がメッセージの大きさを決めるため）
+                        if result["success"]:
+                            job_planner.measure_step(measure, dates=0)
+                            job_planner.save_measure('SpaceInfo', url, measure)
                     
                     # 結果をログに出力
                     total_success = sum(1 for r in results if r["success"])
@@ -225,6 +282,51 @@ def lambda_handler(event, context):
         })
     }
 
+def process_records_concurrently(event, now):
+    """全メッセージのURLを asyncio で並行処理する（EXECUTION_MODE=async）"""
+    records = event.get('Records', [])
+    urls = []
+    for record in records:
+        try:
+            message_body = json.loads(record['body'])
+            urls.extend(message_body.get('urls', []))
+        except Exception as e:
+            print(f"メッセージ処理エラー: {e}")
+
+    print(f"処理開始: {len(urls)}件のURL（並行処理）")
+
+    async def worker(context, url):
+        measure = job_planner.start_measure()
+        page = await context.new_page()
+        points_data = await get_points_data_async(url, page)
+        # HTML取得・DynamoDB書き込みは同期処理のため別スレッドで実行
+        result = await asyncio.to_thread(process_single_url, url, now, None, points_data)
+        if result["success"]:
+            job_planner.measure_step(measure, dates=0)
+            await asyncio.to_thread(job_planner.save_measure, 'SpaceInfo', url, measure)
+        return result
+
+    results = []
+    for url, result, error in async_runner.run_urls(urls, worker):
+        if error is not None:
+            result = {"url": url, "success": False, "space_id": None, "space_name": None,
+                      "error": f"URL処理エラー: {str(error)}"}
+        results.append(result)
+
+    total_success = sum(1 for r in results if r["success"])
+    successful_spaces = [r["space_name"] for r in results if r["success"] and r["space_name"]]
+    print(f"処理完了: {total_success}件成功, {len(results) - total_success}件エラー")
+    print(f"成功したスペース: {', '.join(successful_spaces)}")
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'processed_messages': len(records),
+            'processed_urls': len(results),
+            'successful_urls': total_success
+        })
+    }
+
 def get_points_data(url, page=None, should_close_browser=False):
     """Playwrightを使用してポイント情報を取得する関数"""
     print(f"URLにアクセス中: {url}")
@@ -247,6 +349,7 @@ def get_points_data(url, page=None, should_close_browser=False):
             context = browser.new_context(
                 user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36'
             )
+            resource_blocker.install(context)
             page = context.new_page()
             should_close_browser = True
     
@@ -274,52 +377,13 @@ def get_points_data(url, page=None, should_close_browser=False):
             return []
         
         # データを抽出し、記号をポイントに変換
-        data = page.evaluate('''() => {
-                const buttons = document.querySelectorAll('.css-j3mvlq button');
-                if (!buttons || buttons.length === 0) {
-                    return [];
-                }
-                
-                return Array.from(buttons).map(button => {
-                    const day = button.querySelector('.css-7tvow, .css-qo22pl, .css-1fvi6cv')?.textContent || "";
-                    const date = button.querySelector('.css-lw8eys, .css-b91hki, .css-19jz4op')?.textContent || "";
-                    
-                    // 記号をポイント(数値)に変換
-                    let point = 0; // デフォルトは0
-                    
-                    if (button.querySelector('.icon-spm-double-circle')) {
-                        point = 0; // 二重丸は0
-                    } else if (button.querySelector('.icon-spm-single-circle')) {
-                        point = 1; // 丸は1
-                    } else if (button.querySelector('.icon-spm-triangle')) {
-                        point = 2; // 三角は2
-                    } // それ以外はデフォルトの0のまま
-                    
-                    return { day, date, point };
-                });
-            }''')
+        data = page.evaluate(POINTS_JS)
         
         if not data or len(data) == 0:
             print("指定した要素から日付と記号を取得できませんでした。")
             return []
         
-        # 日付フォーマットを整形 (例: "5/14" -> "2025-05-14")
-        formatted_data = []
-        current_year = datetime.now().year
-        for item in data:
-            if item['date']:
-                try:
-                    month, day = item['date'].split('/')
-                    formatted_date = f"{current_year}-{month.zfill(2)}-{day.zfill(2)}"
-                    formatted_data.append({
-                        'day': item['day'],
-                        'date': formatted_date,
-                        'point': item['point']
-                    })
-                except Exception as e:
-                    print(f"日付フォーマットエラー: {str(e)} - {item['date']}")
-            
-        return formatted_data
+        return format_points_data(data)
         
     except Exception as e:
         print(f"スクレイピング中にエラーが発生しました: {str(e)}")
@@ -328,4 +392,59 @@ def get_points_data(url, page=None, should_close_browser=False):
         return []
     finally:
         if should_close_browser and 'browser' in locals():
-            browser.close()
\ No newline at end of file
+            browser.close()
+
+def format_points_data(data):
+    """日付フォーマットを整形 (例: "5/14" -> "2025-05-14")"""
+    formatted_data = []
+    current_year = datetime.now().year
+    for item in data:
+        if item['date']:
+            try:
+                month, day = item['date'].split('/')
+                formatted_date = f"{current_year}-{month.zfill(2)}-{day.zfill(2)}"
+                formatted_data.append({
+                    'day': item['day'],
+                    'date': formatted_date,
+                    'point': item['point']
+                })
+            except Exception as e:
+                print(f"日付フォーマットエラー: {str(e)} - {item['date']}")
+        
+    return formatted_data
+
+async def get_points_data_async(url, page):
+    """get_points_data の非同期版（page は呼び出し側で用意する）"""
+    print(f"URLにアクセス中: {url}")
+    try:
+        # リトライ機能付きでページを読み込み
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                response = await page.goto(url, wait_until='networkidle', timeout=30000)
+                break
+            except Exception as e:
+                if attempt == max_retries - 1:
+                    raise e
+                print(f"ページ読み込み失敗 (試行 {attempt + 1}/{max_retries}): {str(e)}")
+                await asyncio.sleep(2)
+
+        if not response.ok:
+            print(f"ページロードエラー: {response.status} {response.status_text}")
+            return []
+
+        try:
+            await page.wait_for_selector('.css-j3mvlq', timeout=10000)
+        except Exception as e:
+            print(f"要素 '.css-j3mvlq' が見つかりませんでした: {str(e)}")
+            return []
+
+        data = await page.evaluate(POINTS_JS)
+        if not data:
+            print("指定した要素から日付と記号を取得できませんでした。")
+            return []
+        return format_points_data(data)
+
+    except Exception as e:
+        print(f"スクレイピング中にエラーが発生しました: {str(e)}")
+        return []
@@ -0,0 +1,211 @@
+import os
+import math
+import time
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+import boto3
+
+# URLごとのスクレイピング実績（処理時間・営業時間・プラン数）をコスト表（DynamoDB）に記録し、
+# SQS への投入時にその実績から1ジョブの見積もり時間が TARGET_JOB_SECONDS に収まるようにジョブを分割・詰め合わせる。
+# 速いスペースは大きなジョブにまとめ、遅いスペースは小さなジョブに分けることで、Lambda の起動回数とタイムアウトを減らす。
+#
+# コスト表: パーティションキー job_type（'SpaceRate' など）、ソートキー url
+#   url_ms: ページを開いて最初の1日分までの時間、date_ms: 2日目以降の1日あたりの時間、
+#   open_hours: 1日あたりの営業時間数、plan_count: プラン数、samples: 記録回数
+
+JST = timezone(timedelta(hours=9))
+
+COST_TABLE_NAME = os.environ.get('JOB_COST_TABLE', 'ScrapeJobCost')
+
+# 1ジョブ（1メッセージ）の目標実行時間（Lambda のタイムアウトより十分短くする）
+TARGET_JOB_SECONDS = int(os.environ.get('TARGET_JOB_SECONDS', '600'))
+
+# 新しい実績の重み（指数移動平均）
+COST_ALPHA = float(os.environ.get('JOB_COST_ALPHA', '0.3'))
+
+# 処理時間の実績がない場合に営業時間・プラン数から1日あたりの時間を見積もる係数
+HOUR_COST_MS = int(os.environ.get('JOB_HOUR_COST_MS', '2500'))
+PLAN_COST_MS = int(os.environ.get('JOB_PLAN_COST_MS', '200'))
+
+BATCH_GET_SIZE = 100
+
+# UnprocessedKeys の再取得・同時更新の競合時の再試行回数とバックオフの基準秒数
+MAX_RETRIES = int(os.environ.get('JOB_COST_MAX_RETRIES', '5'))
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_MAX_SECONDS = 2.0
+
+# boto3 のセッション・リソースはスレッドセーフでないため、呼び出し元のスレッド（asyncio.to_thread のワーカーなど）ごとに持つ
+_local = threading.local()
+
+
+def get_dynamodb():
+    if getattr(_local, 'dynamodb', None) is None:
+        _local.dynamodb = boto3.session.Session().resource('dynamodb')
+    return _local.dynamodb
+
+
+# ===== スクレイピング側: 実績の記録 =====
+
+def start_measure():
+    """URLの処理開始時に呼び、計測用の dict を返す"""
+    now = time.monotonic()
+    return {'last': now, 'url_ms': None, 'date_ms': 0.0, 'dates': 0, 'hours': 0, 'plans': set()}
+
+
+def measure_step(measure, dates=1, open_hours=0, plan_ids=()):
+    """
+    前回の呼び出し（または start_measure）からの経過時間を記録する。
+    最初の呼び出しはページを開く時間を含めて url_ms、以降は dates 日分の date_ms として扱う。
+    日付がない処理（SpaceInfo など）は dates=0 で1回だけ呼ぶ。
+    """
+    now = time.monotonic()
+    elapsed_ms = (now - measure['last']) * 1000
+    measure['last'] = now
+    if measure['url_ms'] is None:
+        measure['url_ms'] = elapsed_ms
+    elif dates:
+        measure['date_ms'] += elapsed_ms
+    measure['dates'] += dates
+    measure['hours'] += open_hours
+    measure['plans'].update(plan_ids)
+
+
+def save_measure(job_type, url, measure):
+    """計測結果をコスト表の実績に指数移動平均で反映する（失敗してもスクレイピングには影響させない）"""
+    if measure['url_ms'] is None:
+        return
+    observed = {'url_ms': measure['url_ms']}
+    if measure['dates'] > 1 and measure['date_ms']:
+        observed['date_ms'] = measure['date_ms'] / (measure['dates'] - 1)
+    if measure['dates']:
+        observed['open_hours'] = measure['hours'] / measure['dates']
+    if measure['plans']:
+        observed['plan_count'] = len(measure['plans'])
+
+    try:
+        table = get_dynamodb().Table(COST_TABLE_NAME)
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                _backoff(attempt)
+            item = table.get_item(Key={'job_type': job_type, 'url': url}, ConsistentRead=True).get('Item') or {}
+            values = {':one': 1, ':u': datetime.now(JST).isoformat()}
+            sets = ['updated_at = :u']
+            for key, value in observed.items():
+                previous = item.get(key)
+                merged = value if previous is None else float(previous) + COST_ALPHA * (value - float(previous))
+                sets.append(f"{key} = :{key}")
+                values[f":{key}"] = int(round(merged))
+            # 読んだ時点から他のジョブが更新していなければ反映する（更新されていたら読み直して平均し直す）
+            if 'samples' in item:
+                condition = 'samples = :samples'
+                values[':samples'] = item['samples']
+            else:
+                condition = 'attribute_not_exists(samples)'
+            try:
+                table.update_item(
+                    Key={'job_type': job_type, 'url': url},
+                    UpdateExpression='SET ' + ', '.join(sets) + ' ADD samples :one',
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues=values,
+                )
+                return
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                continue
+        print(f"コスト表の更新が他のジョブと競合したため省略 ({url})")
+    except Exception as e:
+        print(f"コスト表の更新エラー ({url}): {e}")
+
+
+def _backoff(attempt):
+    """指数バックオフ（ジッターあり）で待つ"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    time.sleep(random.uniform(delay / 2, delay))
+
+
+# ===== 投入側: 見積もりとジョブの分割・詰め合わせ =====
+
+def load_costs(job_type, urls):
+    """コスト表から {url: 実績の dict} を取得する（取得できないURLは含まない）"""
+    costs = {}
+    keys = [{'job_type': job_type, 'url': url} for url in dict.fromkeys(urls)]
+    try:
+        dynamodb = get_dynamodb()
+        for i in range(0, len(keys), BATCH_GET_SIZE):
+            request = {COST_TABLE_NAME: {'Keys': keys[i:i + BATCH_GET_SIZE]}}
+            attempt = 0
+            while request:
+                resp = dynamodb.batch_get_item(RequestItems=request)
+                for item in resp.get('Responses', {}).get(COST_TABLE_NAME, []):
+                    costs[item['url']] = {k: int(v) for k, v in item.items()
+                                          if k in ('url_ms', 'date_ms', 'open_hours', 'plan_count')}
+                request = resp.get('UnprocessedKeys') or None
+                if not request:
+                    break
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    # 取得できなかったURLは既定値で見積もる
+                    print(f"コスト表の取得未処理: {len(request[COST_TABLE_NAME]['Keys'])}件")
+                    break
+                _backoff(attempt)
+    except Exception as e:
+        print(f"コスト表の取得エラー（既定値で見積もり）: {e}")
+    return costs
+
+
+def estimate(cost, defaults):
+    """
+    1URLの (url_ms, date_ms) を見積もる。
+    実績がなければ営業時間・プラン数から、それもなければ defaults から求める。
+    """
+    cost = cost or {}
+    url_ms = cost.get('url_ms', defaults['url_ms'])
+    date_ms = cost.get('date_ms')
+    if date_ms is None:
+        if 'open_hours' in cost:
+            date_ms = cost['open_hours'] * HOUR_COST_MS + cost.get('plan_count', 0) * PLAN_COST_MS
+        else:
+            date_ms = defaults.get('date_ms', 0)
+    return url_ms, date_ms
+
+
+def job_cost_ms(url_ms, date_ms, days):
+    """days 日分を1ジョブで処理する見積もり時間"""
+    return url_ms + max(0, days - 1) * date_ms
+
+
+def split_days(url_ms, date_ms, total_days, target_ms=None):
+    """
+    total_days 日を、1ジョブが target_ms に収まる日数ずつの区間 [(offset_days, days), ...] に分ける。
+    区間の日数はできるだけ均等にする（前の区間ほど1日多い）。
+    """
+    target_ms = target_ms or TARGET_JOB_SECONDS * 1000
+    per_job = total_days if date_ms <= 0 else int((target_ms - url_ms) // date_ms) + 1
+    per_job = max(1, min(total_days, per_job))
+    count = math.ceil(total_days / per_job)
+    size, extra = divmod(total_days, count)
+    ranges = []
+    offset = 0
+    for i in range(count):
+        days = size + (1 if i < extra else 0)
+        ranges.append((offset, days))
+        offset += days
+    return ranges
+
+
+def pack(entries, target_ms=None, max_items=None):
+    """
+    [(key, 見積もりミリ秒), ...] を、合計が target_ms 以下になるように詰め合わせる（First Fit Decreasing）。
+    1件で target_ms を超えるものは単独のジョブにする。戻り値: [[key, ...], ...]
+    """
+    target_ms = target_ms or TARGET_JOB_SECONDS * 1000
+    bins = []  # [合計ミリ秒, [key, ...]]
+    for key, cost in sorted(entries, key=lambda e: e[1], reverse=True):
+        for b in bins:
+            if b[0] + cost <= target_ms and (not max_items or len(b[1]) < max_items):
+                b[0] += cost
+                b[1].append(key)
+                break
+        else:
+            bins.append([cost, [key]])
+    return [keys for _, keys in bins]
@@ -1,16 +1,85 @@
 import os
 import json
-from decimal import Decimal
-from datetime import datetime, timedelta
+import time
+import random
+from collections import OrderedDict
+from datetime import datetime, timedelta, date
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from botocore.config import Config
 from boto3.dynamodb.conditions import Key
 
+# NumPy があればフォールバックの解決と平均の計算を配列演算で行う（requirements.txt に含める。なければ従来どおり Python で計算）
+try:
+    import numpy as np
+except ImportError:
+    np = None
+    print("NumPy がないため、フォールバックの解決と平均の計算は Python で行います")
+
 # 環境変数から DynamoDB のテーブル名を取得
 TABLE_NAME = os.environ.get('TABLE_NAME', 'SpaceRate')
 
-# boto3 の DynamoDB テーブルオブジェクトを生成
-dynamodb = boto3.resource('dynamodb')
+# 日別レイアウトのテーブル名（spaceId × 日付 × プランで24時間分の価格配列を持つ）
+DAILY_TABLE_NAME = os.environ.get('DAILY_TABLE_NAME', 'SpaceRateDaily')
+
+# 読み込み元: 'legacy' = 時間別テーブルのみ、'daily' = 日別テーブルのみ、
+#            'both' = 日別テーブルを優先し、見つからない分を時間別テーブルから取得（移行期間用）
+STORAGE_LAYOUT = os.environ.get('STORAGE_LAYOUT', 'legacy')
+
+# 集計テーブル（spaceId × 週 × day_type × プランごとの時間別の価格の合計・件数。SpaceRate の書き込み時に更新される）
+AGG_TABLE_NAME = os.environ.get('AGG_TABLE_NAME', 'SpaceRateAgg')
+
+# 価格の取得方法: 'query' = 期間（前後のフォールバック分を含む）を rate_key の範囲で Query し、フォールバックはメモリ上で解決、
+#                'batch_get' = フォールバック候補の rate_key を全て生成して batch_get_item で取得（従来の方法）
+RATE_FETCH_MODE = os.environ.get('RATE_FETCH_MODE', 'query')
+
+# フォールバックで参照する範囲（週単位: ±14日、時間遡及: 24時間前まで）
+FALLBACK_WEEK_OFFSETS = (7, 14, -7, -14)
+FALLBACK_HOURS = 24
+
+# フォールバックの解決方法: 'auto' = NumPy があれば配列演算、'python' = 常に Python のループ
+RESOLVE_MODE = os.environ.get('RESOLVE_MODE', 'auto')
+
+# batch_get_item の100件ごとのチャンクを並行して取得するスレッド数
+BATCH_GET_WORKERS = int(os.environ.get('BATCH_GET_WORKERS', '8'))
+
+# UnprocessedKeys・スロットリング時の再試行回数とバックオフ（秒）
+BATCH_GET_MAX_RETRIES = int(os.environ.get('BATCH_GET_MAX_RETRIES', '8'))
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_MAX_SECONDS = 2.0
+
+# ウォームコンテナ内の結果キャッシュ（件数の上限と有効期限）。0 件にするとキャッシュしない
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', '300'))
+
+# スペースの版数（スクレイピングで価格が書き込まれるたびに進む）を確認し直す間隔（秒）
+VERSION_CHECK_SECONDS = float(os.environ.get('VERSION_CHECK_SECONDS', '5'))
+
+# 版数の行のソートキーの値（rate_writer.VERSION_KEY と同じ）。日時・DIGEST# の範囲外なので価格の Query には含まれない
+VERSION_KEY = 'VERSION'
+
+# プラン一覧の取得方法: 'catalog' = スクレイパーが更新するカタログ行（'CATALOG#planId'）を読む。
+#                      スクレイパーがカタログ導入前のデータのプランを取り込み終えるまで（印の行 'CATALOG' がない間）は
+#                      全件 Query の結果も合わせる（この Lambda はテーブルを読むだけで、書き込み権限は不要）、
+#                      'scan' = パーティションの全件を Query して planId を集める（従来の方法）
+PLAN_DISCOVERY_MODE = os.environ.get('PLAN_DISCOVERY_MODE', 'catalog')
+CATALOG_PREFIX = 'CATALOG#'
+CATALOG_MARKER_KEY = 'CATALOG'
+
+# (spaceId, 期間, 時間帯, day_type, mode) -> (保存時刻, 版数, (plans, 応答に含める mode 等))。Lambda のウォームスタート間で再利用する
+_result_cache = OrderedDict()
+
+# spaceId -> (確認時刻, 版数)
+_space_versions = {}
+
+# boto3 の DynamoDB テーブルオブジェクトを生成（並行取得のスレッド数に合わせて接続プールを広げる）
+dynamodb = boto3.resource('dynamodb', config=Config(
+    max_pool_connections=max(10, BATCH_GET_WORKERS * 2),
+    retries={'max_attempts': 3, 'mode': 'adaptive'}
+))
 table = dynamodb.Table(TABLE_NAME)
+daily_table = dynamodb.Table(DAILY_TABLE_NAME)
+agg_table = dynamodb.Table(AGG_TABLE_NAME)
 
 
 def lambda_handler(event, context):
@@ -24,61 +93,300 @@ def lambda_handler(event, context):
       - end_hour:     時間帯終了 (整数、0-23: 
                        入力例) start_hour=9, end_hour=17 なら 9:00〜17:00 をすべて含める
       - day_type:     'weekday' または 'weekend'
+      - mode:         省略時は時間別の価格から計算（フォールバックあり）、
+                      'aggregate' = 集計テーブルから計算（フォールバックなし）。期間が月曜日〜日曜日の週単位で、
+                      全ての週に集計アイテムがある場合だけ使い、それ以外は時間別の価格から計算する
     戻り値として、プランごとに平均単価を返す。
+
+    複数のスペース・時間帯をまとめて問い合わせる場合は、spaceIds と windows を指定する（_handle_batch を参照）。
     """
 
     try:
         body = _parse_event_body(event)
+        if 'spaceIds' in body or 'windows' in body:
+            return _handle_batch(body)
         space_id   = body['spaceId']
         start_date = datetime.strptime(body['start_date'], '%Y-%m-%d').date()
         end_date   = datetime.strptime(body['end_date'], '%Y-%m-%d').date()
         start_hour = int(body['start_hour'])
         end_hour   = int(body['end_hour'])
         day_type   = body['day_type']
+        mode       = body.get('mode', 'raw')
+        if mode not in ('raw', 'aggregate'):
+            raise ValueError(f'mode は raw または aggregate で指定してください: {mode}')
     except Exception as e:
         return {
             'statusCode': 400,
             'body': json.dumps({'error': f'リクエストパラメータ不正: {str(e)}'}, ensure_ascii=False)
         }
 
+    # 前回と同じ問い合わせで、その後スペースの価格が書き込まれていなければキャッシュを返す
+    version = _space_version(space_id)
+    cache_key = (space_id, start_date, end_date, start_hour, end_hour, day_type, mode)
+    cached = _cache_get(cache_key, version)
+    if cached is not None:
+        result, coverage = cached
+        return {
+            'statusCode': 200,
+            'body': json.dumps(
+                {'spaceId': space_id, 'start_date': str(start_date), 'end_date': str(end_date),
+                 'day_type': day_type, 'plans': result, 'dropped_keys': 0, 'cached': True, **coverage},
+                ensure_ascii=False
+            )
+        }
+
     # 1) 期間内に存在するプラン ID をあらかじめ収集しておく（DynamoDB 全件スキャン→Query でも可）
     plan_ids, plan_names = _collect_all_plans_for_space(space_id)
 
     # 2) 取得対象となる日時（YYYY-MM-DDThh:00）の一覧を作成
     target_datetimes = _generate_target_datetimes(start_date, end_date, start_hour, end_hour)
 
-    # 3) バッチ処理で全プラン×全日時の価格を一括取得
-    plan_prices = _batch_fetch_prices_with_fallback(space_id, plan_ids, target_datetimes, day_type)
-
-    # 4) プランごとに平均を計算
-    result = {}
-    for plan_id in plan_ids:
-        prices = plan_prices.get(plan_id, [])
-        # 該当プランの表示名（最初に見つかったものを使う）
-        display_name = plan_names.get(plan_id, '')
-
-        if prices:
-            avg_price = float(sum(prices) / len(prices))
-        else:
-            avg_price = None
+    # 3) 全プラン×全日時の価格を一括取得（フォールバック含む）し、4) プランごとに平均を計算
+    dropped_keys = []  # 再試行しても取得できなかったキー（batch_get のみ）
+    plan_stats, coverage = None, {}
+    if mode == 'aggregate':
+        agg_rows = _query_aggregate_rows(space_id, start_date, end_date)
+        plan_stats, coverage = _aggregate_stats_if_covered(agg_rows, start_date, end_date, start_hour, end_hour,
+                                                           day_type)
+    if plan_stats is not None:
+        pass
+    elif RATE_FETCH_MODE == 'batch_get':
+        plan_prices = _batch_fetch_prices_with_fallback(space_id, plan_ids, target_datetimes, day_type,
+                                                        dropped_keys)
+        plan_stats = _summarize_prices(plan_prices)
+    else:
+        prices_by_dt = _query_price_maps(space_id, start_date, end_date).get(day_type, {})
+        plan_stats = _resolve_plan_stats(plan_ids, target_datetimes, prices_by_dt)
 
-        result[plan_id] = {
-            'planId': plan_id,
-            'planDisplayName': display_name,
-            'average_price': avg_price,
-            'samples_count': len(prices)
-        }
+    result = _build_plan_results(plan_ids, plan_names, plan_stats)
+    if not dropped_keys:
+        # 取得しきれなかったキーがある結果はキャッシュしない
+        _cache_put(cache_key, version, (result, coverage))
 
     return {
         'statusCode': 200,
         'body': json.dumps(
             {'spaceId': space_id, 'start_date': str(start_date), 'end_date': str(end_date),
-             'day_type': day_type, 'plans': result},
+             'day_type': day_type, 'plans': result, 'dropped_keys': len(dropped_keys), 'cached': False,
+             **coverage},
             ensure_ascii=False
         )
     }
 
 
+def _handle_batch(body):
+    """
+    複数スペース×複数時間帯の一括問い合わせ。リクエストボディ：
+      - spaceIds:     対象スペース ID のリスト
+      - start_date / end_date: 取得期間 (YYYY-MM-DD、windows ごとに上書き可)
+      - windows:      [{'start_hour': 9, 'end_hour': 17, 'day_type': 'weekday'}, ...]
+      - mode:         'aggregate' を指定すると集計テーブルから計算する（週単位でない・集計がない時間帯は
+                      時間別の価格から計算する。lambda_handler と同じ）
+    スペースごとにプラン一覧と期間全体（全 day_type）の価格を1回だけ取得し、
+    各時間帯はその結果から計算する（常に Query で取得する）。
+    全ての時間帯がキャッシュにあるスペースは DynamoDB から取得しない。
+    戻り値: {'results': [{'spaceId', 'start_date', 'end_date', 'start_hour', 'end_hour', 'day_type', 'plans'}, ...]}
+    """
+    try:
+        space_ids = body['spaceIds'] if 'spaceIds' in body else [body['spaceId']]
+        if not isinstance(space_ids, list) or not space_ids:
+            raise ValueError('spaceIds はリストで指定してください')
+        windows = []
+        for window in body['windows']:
+            windows.append({
+                'start_date': datetime.strptime(window.get('start_date', body.get('start_date')), '%Y-%m-%d').date(),
+                'end_date': datetime.strptime(window.get('end_date', body.get('end_date')), '%Y-%m-%d').date(),
+                'start_hour': int(window['start_hour']),
+                'end_hour': int(window['end_hour']),
+                'day_type': window['day_type'],
+            })
+        if not windows:
+            raise ValueError('windows が空です')
+        mode = body.get('mode', 'raw')
+        if mode not in ('raw', 'aggregate'):
+            raise ValueError(f'mode は raw または aggregate で指定してください: {mode}')
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': f'リクエストパラメータ不正: {str(e)}'}, ensure_ascii=False)
+        }
+
+    # 全時間帯を含む期間を1回で取得する
+    fetch_start = min(w['start_date'] for w in windows)
+    fetch_end = max(w['end_date'] for w in windows)
+
+    results = []
+    for space_id in dict.fromkeys(space_ids):
+        version = _space_version(space_id)
+        cache_keys = [(space_id, w['start_date'], w['end_date'], w['start_hour'], w['end_hour'], w['day_type'], mode)
+                      for w in windows]
+        cached = [_cache_get(cache_key, version) for cache_key in cache_keys]
+        price_maps = None  # 時間別の価格は必要になった時だけ取得する
+        if any(entry is None for entry in cached):
+            plan_ids, plan_names = _collect_all_plans_for_space(space_id)
+            if mode == 'aggregate':
+                agg_rows = _query_aggregate_rows(space_id, fetch_start, fetch_end)
+        for w, cache_key, entry in zip(windows, cache_keys, cached):
+            if entry is None:
+                plan_stats, coverage = None, {}
+                if mode == 'aggregate':
+                    plan_stats, coverage = _aggregate_stats_if_covered(agg_rows, w['start_date'], w['end_date'],
+                                                                       w['start_hour'], w['end_hour'], w['day_type'])
+                if plan_stats is None:
+                    if price_maps is None:
+                        price_maps = _query_price_maps(space_id, fetch_start, fetch_end)
+                    target_datetimes = _generate_target_datetimes(w['start_date'], w['end_date'],
+                                                                  w['start_hour'], w['end_hour'])
+                    plan_stats = _resolve_plan_stats(plan_ids, target_datetimes, price_maps.get(w['day_type'], {}))
+                entry = (_build_plan_results(plan_ids, plan_names, plan_stats), coverage)
+                _cache_put(cache_key, version, entry)
+            plans, coverage = entry
+            results.append({
+                'spaceId': space_id,
+                'start_date': str(w['start_date']),
+                'end_date': str(w['end_date']),
+                'start_hour': w['start_hour'],
+                'end_hour': w['end_hour'],
+                'day_type': w['day_type'],
+                'plans': plans,
+                **coverage,
+            })
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'results': results}, ensure_ascii=False)
+    }
+
+
+def _week_start(day):
+    """day を含む週の月曜日"""
+    return day - timedelta(days=day.weekday())
+
+
+def _aggregate_covers(agg_rows, start_date, end_date, day_type):
+    """
+    集計アイテムだけで期間を計算できるか。集計は週×day_type 単位で、書き込み時に集計が有効な場合だけ更新され
+    過去分は埋め戻されないため、期間が月曜日〜日曜日の週単位で、全ての週に day_type の集計アイテムがある場合だけ True
+    """
+    if start_date > end_date or start_date.weekday() != 0 or end_date.weekday() != 6:
+        return False
+    weeks = {row.get('week_start') for row in agg_rows if row.get('day_type') == day_type}
+    week = start_date
+    while week <= end_date:
+        if week.isoformat() not in weeks:
+            return False
+        week += timedelta(days=7)
+    return True
+
+
+def _aggregate_stats_if_covered(agg_rows, start_date, end_date, start_hour, end_hour, day_type):
+    """
+    集計アイテムで計算できる期間なら (plan_stats, 応答に含める mode 等) を返す。
+    できない場合は (None, {'mode': 'raw', 'aggregate_fallback': True})（呼び出し元が時間別の価格から計算する）
+    """
+    if not _aggregate_covers(agg_rows, start_date, end_date, day_type):
+        return None, {'mode': 'raw', 'aggregate_fallback': True}
+    plan_stats = _aggregate_plan_stats(agg_rows, start_date, end_date, start_hour, end_hour, day_type)
+    return plan_stats, {'mode': 'aggregate', 'covered_start': str(start_date), 'covered_end': str(end_date)}
+
+
+def _query_aggregate_rows(space_id, start_date, end_date):
+    """start_date〜end_date を含む週の集計アイテムを Query で取得する"""
+    return _query_all(agg_table, Key('spaceId').eq(space_id) & Key('agg_key').between(
+        _week_start(start_date).isoformat(), f"{_week_start(end_date).isoformat()}#~"
+    ))
+
+
+def _aggregate_plan_stats(agg_rows, start_date, end_date, start_hour, end_hour, day_type):
+    """
+    集計アイテム（週ごとの hXX_sum / hXX_cnt）から {plan_id: (平均 or None, 件数)} を求める。
+    期間は週単位で数えるため、start_date・end_date を含む週の全日が対象になる。
+    """
+    first_week = _week_start(start_date).isoformat()
+    last_week = _week_start(end_date).isoformat()
+    hours = [f"{hour:02d}" for hour in range(max(0, start_hour), min(23, end_hour) + 1)]
+    totals = {}
+    for row in agg_rows:
+        if row.get('day_type') != day_type or not first_week <= row.get('week_start', '') <= last_week:
+            continue
+        total = totals.setdefault(row['planId'], [0, 0])
+        for hh in hours:
+            total[0] += row.get(f"h{hh}_sum", 0)
+            total[1] += int(row.get(f"h{hh}_cnt", 0))
+    return {
+        plan_id: (float(price_sum / count) if count else None, count)
+        for plan_id, (price_sum, count) in totals.items()
+    }
+
+
+def _space_version(space_id):
+    """
+    スペースの版数（版数, 最新の scan_date）を返す。VERSION_CHECK_SECONDS 以内に確認済みなら再取得しない。
+    版数の行がなければ (0, '')、取得に失敗した場合は None（キャッシュを使わない）。
+    """
+    checked = _space_versions.get(space_id)
+    if checked and time.monotonic() - checked[0] < VERSION_CHECK_SECONDS:
+        return checked[1]
+    target_table, sort_key = (daily_table, 'day_key') if STORAGE_LAYOUT == 'daily' else (table, 'rate_key')
+    try:
+        item = target_table.get_item(
+            Key={'spaceId': space_id, sort_key: VERSION_KEY},
+            ProjectionExpression='#v, scan_date',
+            ExpressionAttributeNames={'#v': 'version'}
+        ).get('Item') or {}
+    except Exception as e:
+        print(f"版数の取得エラー ({space_id}): {e}")
+        return None
+    version = (int(item.get('version', 0)), item.get('scan_date', ''))
+    _space_versions[space_id] = (time.monotonic(), version)
+    return version
+
+
+def _cache_get(cache_key, version):
+    """キャッシュ済みの (plans, 応答に含める mode 等) を返す（未登録・期限切れ・版数が変わった場合は None）"""
+    entry = _result_cache.get(cache_key)
+    if entry is None or version is None:
+        return None
+    stored_at, cached_version, plans = entry
+    if cached_version != version or time.monotonic() - stored_at > RESULT_CACHE_TTL_SECONDS:
+        del _result_cache[cache_key]
+        return None
+    _result_cache.move_to_end(cache_key)
+    return plans
+
+
+def _cache_put(cache_key, version, plans):
+    """(plans, 応答に含める mode 等) をキャッシュに保存し、上限を超えた分は古いものから捨てる"""
+    if RESULT_CACHE_SIZE <= 0 or version is None:
+        return
+    _result_cache[cache_key] = (time.monotonic(), version, plans)
+    _result_cache.move_to_end(cache_key)
+    while len(_result_cache) > RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+
+def _resolve_plan_stats(plan_ids, target_datetimes, prices_by_dt):
+    """取得済みの価格から {plan_id: (平均 or None, 件数)} を求める（NumPy があれば配列演算）"""
+    if np is not None and RESOLVE_MODE != 'python':
+        return _resolve_prices_vectorized(plan_ids, target_datetimes, prices_by_dt)
+    return _summarize_prices(_resolve_prices(plan_ids, target_datetimes, prices_by_dt))
+
+
+def _build_plan_results(plan_ids, plan_names, plan_stats):
+    """レスポンスの plans（planId ごとの平均単価）を作る"""
+    result = {}
+    for plan_id in plan_ids:
+        avg_price, samples_count = plan_stats.get(plan_id, (None, 0))
+        result[plan_id] = {
+            'planId': plan_id,
+            # 該当プランの表示名（最初に見つかったものを使う）
+            'planDisplayName': plan_names.get(plan_id, ''),
+            'average_price': avg_price,
+            'samples_count': samples_count
+        }
+    return result
+
+
 def _parse_event_body(event):
     """
     HTTP API 形式を想定し、event['body'] から JSON を取得するユーティリティ。
@@ -98,23 +406,46 @@ def _collect_all_plans_for_space(space_id):
     """
     指定した SpaceID について DynamoDB を Query し、現状登録されている planId と planDisplayName を収集する。
     DynamoDB のパーティションキーが 'spaceId'、ソートキーが 'rate_key' である前提。
+    カタログの取り込みが済んだスペース（スクレイパーが書く印の行がある）はカタログ行だけを読む。
+    済んでいなければ、カタログ行に加えて
     Query を使って、ProjectionExpression で planId と planDisplayName のみを取得し、重複を除去。
     """
     plan_ids = set()
     plan_names = {}
+    if PLAN_DISCOVERY_MODE != 'scan':
+        target_table, sort_key = (daily_table, 'day_key') if STORAGE_LAYOUT == 'daily' else (table, 'rate_key')
+        rows = _query_all(target_table, Key('spaceId').eq(space_id) & Key(sort_key).begins_with(CATALOG_MARKER_KEY),
+                          f'planId, planDisplayName, {sort_key}')
+        backfilled = False
+        for row in rows:
+            if row.get(sort_key) == CATALOG_MARKER_KEY:
+                backfilled = True
+            elif row.get('planId'):
+                plan_ids.add(row['planId'])
+                plan_names[row['planId']] = row.get('planDisplayName', '')
+        if backfilled:
+            return list(plan_ids), plan_names
+    if STORAGE_LAYOUT in ('daily', 'both'):
+        _collect_plans_from_table(daily_table, space_id, plan_ids, plan_names)
+    if STORAGE_LAYOUT in ('legacy', 'both'):
+        _collect_plans_from_table(table, space_id, plan_ids, plan_names)
+    return list(plan_ids), plan_names
+
 
+def _collect_plans_from_table(target_table, space_id, plan_ids, plan_names):
+    """指定テーブルから spaceId の planId と planDisplayName を収集し、plan_ids / plan_names に追加する"""
     # Query で全アイテムを取得する。必要に応じて FilterExpression を入れて絞り込み可。
     # ただし、Query のままだと期間指定がないので、全件取得 → for で planId を collect する実装
     exclusive_start_key = None
     while True:
         if exclusive_start_key:
-            resp = table.query(
+            resp = target_table.query(
                 KeyConditionExpression=Key('spaceId').eq(space_id),
                 ProjectionExpression='planId, planDisplayName, rate_key',
                 ExclusiveStartKey=exclusive_start_key
             )
         else:
-            resp = table.query(
+            resp = target_table.query(
                 KeyConditionExpression=Key('spaceId').eq(space_id),
                 ProjectionExpression='planId, planDisplayName, rate_key'
             )
@@ -131,8 +462,6 @@ def _collect_all_plans_for_space(space_id):
         if not exclusive_start_key:
             break
 
-    return list(plan_ids), plan_names
-
 
 def _generate_target_datetimes(start_date, end_date, start_hour, end_hour):
     """
@@ -150,10 +479,144 @@ def _generate_target_datetimes(start_date, end_date, start_hour, end_hour):
     return target_datetimes
 
 
-def _batch_fetch_prices_with_fallback(space_id, plan_ids, target_datetimes, day_type):
+def _summarize_prices(plan_prices):
+    """{plan_id: [price, ...]} を {plan_id: (平均 or None, 件数)} にする"""
+    return {
+        plan_id: (float(sum(prices) / len(prices)) if prices else None, len(prices))
+        for plan_id, prices in plan_prices.items()
+    }
+
+
+def _query_price_maps(space_id, start_date, end_date):
+    """
+    フォールバックで参照しうる期間の価格を Query で取得し、
+    {day_type: {日時 'YYYY-MM-DDThh:00': {planId: price}}} を返す。
+    """
+    range_start = start_date - timedelta(days=max(FALLBACK_WEEK_OFFSETS))
+    range_end = end_date + timedelta(days=max(FALLBACK_WEEK_OFFSETS))
+
+    # day_type -> 日時文字列 -> {planId: price}
+    price_maps = {}
+    if STORAGE_LAYOUT in ('legacy', 'both'):
+        # 'DIGEST#...' などの日時以外の rate_key は範囲外になる
+        items = _query_all(table, Key('spaceId').eq(space_id) & Key('rate_key').between(
+            f"{range_start.isoformat()}T00:00", f"{range_end.isoformat()}T~"
+        ), 'rate_key, price, day_type')
+        for item in items:
+            dt, plan_id = item['rate_key'].split('#', 1)
+            price_maps.setdefault(item.get('day_type'), {}).setdefault(dt, {})[plan_id] = item.get('price', 0)
+    if STORAGE_LAYOUT in ('daily', 'both'):
+        # 移行期間中は日別テーブルの値を優先する
+        rows = _query_all(daily_table, Key('spaceId').eq(space_id) & Key('day_key').between(
+            range_start.isoformat(), f"{range_end.isoformat()}#~"
+        ), 'day_key, prices, day_type')
+        for row in rows:
+            date, plan_id = row['day_key'].split('#', 1)
+            prices_by_dt = price_maps.setdefault(row.get('day_type'), {})
+            for hour, price in enumerate(row.get('prices') or []):
+                if price is not None:
+                    prices_by_dt.setdefault(f"{date}T{hour:02d}:00", {})[plan_id] = price
+    return price_maps
+
+
+def _resolve_prices(plan_ids, target_datetimes, prices_by_dt):
+    """フォールバックの優先順位で全プラン×全日時の価格を選び、{plan_id: [price, ...]} を返す"""
+    # 候補の日時は日時ごとに1回だけ計算し、全プランで共有する
+    plan_prices = {plan_id: [] for plan_id in plan_ids}
+    for target_dt in target_datetimes:
+        candidates = [prices_by_dt[dt] for dt in _fallback_datetimes(target_dt) if dt in prices_by_dt]
+        if not candidates:
+            continue
+        for plan_id in plan_ids:
+            for prices in candidates:
+                if plan_id in prices:
+                    plan_prices[plan_id].append(int(prices[plan_id]))
+                    break
+
+    return plan_prices
+
+
+def _resolve_prices_vectorized(plan_ids, target_datetimes, prices_by_dt):
+    """
+    _resolve_prices + _summarize_prices の NumPy 版。
+    価格を (プラン, 通算時間) の2次元配列に並べ、直接 → 週単位 → 時間遡及の順に
+    列をずらした配列で未解決のセルだけを埋め、プランごとの平均と件数をまとめて求める。
+    """
+    if not plan_ids or not target_datetimes:
+        return {plan_id: (None, 0) for plan_id in plan_ids}
+
+    plan_index = {plan_id: i for i, plan_id in enumerate(plan_ids)}
+    targets = np.array([_hour_index(dt) for dt in target_datetimes], dtype=np.int64)
+
+    # 配列の先頭は最も過去に参照しうる時間（-14日 / -24時間）、末尾は最も未来に参照しうる時間（+14日）
+    back = max(max(-d for d in FALLBACK_WEEK_OFFSETS) * 24, FALLBACK_HOURS)
+    ahead = max(FALLBACK_WEEK_OFFSETS) * 24
+    origin = int(targets.min()) - back
+    grid = np.full((len(plan_ids), int(targets.max()) + ahead - origin + 1), np.nan)
+
+    for dt, prices in prices_by_dt.items():
+        col = _hour_index(dt) - origin
+        if col < 0 or col >= grid.shape[1]:
+            continue
+        for plan_id, price in prices.items():
+            row = plan_index.get(plan_id)
+            if row is not None:
+                grid[row, col] = int(price)
+
+    # 優先順位の順に、まだ値がないセルだけを埋める
+    cols = targets - origin
+    offsets = [0] + [d * 24 for d in FALLBACK_WEEK_OFFSETS] + [-h for h in range(1, FALLBACK_HOURS + 1)]
+    resolved = grid[:, cols]
+    for offset in offsets[1:]:
+        missing = np.isnan(resolved)
+        if not missing.any():
+            break
+        resolved = np.where(missing, grid[:, cols + offset], resolved)
+
+    found = ~np.isnan(resolved)
+    counts = found.sum(axis=1)
+    sums = np.where(found, resolved, 0).sum(axis=1)
+    return {
+        plan_id: (float(sums[i] / counts[i]) if counts[i] else None, int(counts[i]))
+        for plan_id, i in plan_index.items()
+    }
+
+
+def _hour_index(dt):
+    """'YYYY-MM-DDThh:00' を通算時間（日付の序数 × 24 + 時）にする"""
+    return date.fromisoformat(dt[:10]).toordinal() * 24 + int(dt[11:13])
+
+
+def _fallback_datetimes(target_dt):
+    """target_dt の値として参照する日時を優先順に返す（直接 → 週単位 → 時間遡及）"""
+    base_dt = datetime.strptime(target_dt, '%Y-%m-%dT%H:%M')
+    candidates = [target_dt]
+    for week_offset in FALLBACK_WEEK_OFFSETS:
+        candidates.append((base_dt + timedelta(days=week_offset)).strftime('%Y-%m-%dT%H:00'))
+    for hour_offset in range(1, FALLBACK_HOURS + 1):
+        candidates.append((base_dt - timedelta(hours=hour_offset)).strftime('%Y-%m-%dT%H:00'))
+    return candidates
+
+
+def _query_all(target_table, key_condition, projection=None):
+    """Query をページングしながら全件取得する（projection を省略した場合は全属性）"""
+    items = []
+    kwargs = {'KeyConditionExpression': key_condition}
+    if projection:
+        kwargs['ProjectionExpression'] = projection
+    while True:
+        resp = target_table.query(**kwargs)
+        items.extend(resp.get('Items', []))
+        if not resp.get('LastEvaluatedKey'):
+            return items
+        kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def _batch_fetch_prices_with_fallback(space_id, plan_ids, target_datetimes, day_type, dropped=None):
     """
     全プラン×全日時の組み合わせについて、バッチ処理で価格を取得する。
     フォールバック処理も含めて一括で行い、プランごとの価格リストを返す。
+    取得できなかったキーは dropped（リスト）に追加する。
     
     Returns:
         dict: {plan_id: [price1, price2, ...], ...}
@@ -161,8 +624,8 @@ def _batch_fetch_prices_with_fallback(space_id, plan_ids, target_datetimes, day_
     # 1) 全候補キーを生成（直接取得 + 週単位フォールバック + 時間遡及フォールバック）
     all_keys = _generate_all_candidate_keys(plan_ids, target_datetimes)
     
-    # 2) バッチで一括取得
-    all_items = _batch_get_items_with_pagination(space_id, all_keys)
+    # 2) バッチで一括取得（日別レイアウトは時間別アイテムの形に展開する）
+    all_items = _batch_get_rate_items(space_id, all_keys, dropped)
     
     # 3) 取得結果を整理（rate_key -> item のマッピング）
     items_map = {}
@@ -213,9 +676,58 @@ def _generate_all_candidate_keys(plan_ids, target_datetimes):
     return all_keys
 
 
-def _batch_get_items_with_pagination(space_id, rate_keys):
+def _batch_get_rate_items(space_id, rate_keys, dropped=None):
+    """
+    STORAGE_LAYOUT に応じて、rate_key の一覧に対応する時間別アイテムを取得する。
+    日別テーブルのアイテムは {'rate_key', 'price', 'day_type', ...} の時間別アイテムに展開して返すため、
+    呼び出し側はどちらのレイアウトかを意識しなくてよい。
+    """
+    items = []
+    remaining = set(rate_keys)
+    if STORAGE_LAYOUT in ('daily', 'both'):
+        items = _batch_get_daily_items(space_id, remaining, dropped)
+        remaining -= {item['rate_key'] for item in items}
+    if STORAGE_LAYOUT in ('legacy', 'both') and remaining:
+        items.extend(_batch_get_items_with_pagination(space_id, remaining, dropped=dropped))
+    return items
+
+
+def _batch_get_daily_items(space_id, rate_keys, dropped=None):
+    """
+    rate_key（'YYYY-MM-DDThh:00#planId'）が属する日別アイテムを取得し、
+    要求された rate_key の時間別アイテムに展開する。
+    """
+    day_keys = {f"{rk[:10]}#{rk.split('#', 1)[1]}" for rk in rate_keys}
+    rows = _batch_get_items_with_pagination(
+        space_id, day_keys, table_name=DAILY_TABLE_NAME, sort_key='day_key', dropped=dropped
+    )
+
+    items = []
+    for row in rows:
+        date, plan_id = row['day_key'].split('#', 1)
+        for hour, price in enumerate(row.get('prices') or []):
+            if price is None:
+                continue
+            rate_key = f"{date}T{hour:02d}:00#{plan_id}"
+            if rate_key not in rate_keys:
+                continue
+            items.append({
+                'spaceId': space_id,
+                'rate_key': rate_key,
+                'datetime': rate_key.split('#', 1)[0],
+                'planId': plan_id,
+                'planDisplayName': row.get('planDisplayName', ''),
+                'price': price,
+                'day_type': row.get('day_type'),
+            })
+    return items
+
+
+def _batch_get_items_with_pagination(space_id, rate_keys, table_name=TABLE_NAME, sort_key='rate_key', dropped=None):
     """
     batch_get_itemの100件制限に対応した分割処理で、全アイテムを取得する。
+    100件ごとのチャンクは BATCH_GET_WORKERS スレッドで並行に取得する。
+    再試行しても取得できなかったキーはログに出力し、dropped（リスト）に追加する。
     
     Returns:
         list: 取得されたアイテムのリスト
@@ -224,38 +736,65 @@ def _batch_get_items_with_pagination(space_id, rate_keys):
     rate_keys_list = list(rate_keys)
     
     # 100件ずつに分割して処理
-    for i in range(0, len(rate_keys_list), 100):
-        batch_keys = rate_keys_list[i:i+100]
-        
-        # DynamoDB用のキー形式に変換
-        request_items = {
-            TABLE_NAME: {
-                'Keys': [
-                    {'spaceId': space_id, 'rate_key': rate_key}
-                    for rate_key in batch_keys
-                ]
-            }
-        }
-        
-        # UnprocessedKeysがある限り再試行
-        while request_items:
-            try:
-                response = dynamodb.batch_get_item(RequestItems=request_items)
-                
-                # 取得結果を追加
-                if TABLE_NAME in response.get('Responses', {}):
-                    all_items.extend(response['Responses'][TABLE_NAME])
-                
-                # 未処理のキーがあれば次回のリクエストに設定
-                request_items = response.get('UnprocessedKeys', {})
-                
-            except Exception as e:
-                print(f"batch_get_item error: {e}")
-                break  # エラーの場合は処理を中断
+    chunks = [rate_keys_list[i:i+100] for i in range(0, len(rate_keys_list), 100)]
+    if not chunks:
+        return all_items
+
+    missing = []
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_GET_WORKERS, len(chunks)))) as pool:
+        results = pool.map(lambda chunk: _batch_get_chunk(space_id, chunk, table_name, sort_key), chunks)
+        for items, chunk_missing in results:
+            all_items.extend(items)
+            missing.extend(chunk_missing)
+
+    if missing:
+        print(f"batch_get_item: {table_name} の{len(missing)}件のキーを取得できませんでした: {missing[:10]}")
+        if dropped is not None:
+            dropped.extend(missing)
     
     return all_items
 
 
+def _batch_get_chunk(space_id, batch_keys, table_name, sort_key):
+    """
+    100件以下のキーを batch_get_item で取得する。
+    UnprocessedKeys とエラー時は揺らぎ付きの指数バックオフで再試行する。
+    
+    Returns:
+        tuple: (取得されたアイテムのリスト, 取得できなかったキーのリスト)
+    """
+    items = []
+    # DynamoDB用のキー形式に変換
+    request_items = {
+        table_name: {
+            'Keys': [
+                {'spaceId': space_id, sort_key: rate_key}
+                for rate_key in batch_keys
+            ]
+        }
+    }
+
+    for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))))
+        try:
+            # リソースの client はスレッドセーフ（型変換もリソースと同じく行われる）
+            response = dynamodb.meta.client.batch_get_item(RequestItems=request_items)
+        except Exception as e:
+            print(f"batch_get_item error (再試行 {attempt + 1}/{BATCH_GET_MAX_RETRIES}): {e}")
+            continue
+
+        # 取得結果を追加
+        items.extend(response.get('Responses', {}).get(table_name, []))
+
+        # 未処理のキーがあれば次回のリクエストに設定
+        request_items = response.get('UnprocessedKeys') or {}
+        if not request_items:
+            return items, []
+
+    return items, [key[sort_key] for key in request_items[table_name]['Keys']]
+
+
 def _find_best_price_from_candidates(plan_id, target_dt, items_map):
     """
     指定されたプランと日時について、フォールバック優先順位に基づいて最適な価格を選択する。
@@ -2,54 +2,163 @@ import os
 import json
 import re
 import hashlib
-import time
+import asyncio
 from datetime import datetime, timedelta, timezone
-import boto3
-from playwright.sync_api import sync_playwright
-import urllib.request
 from urllib.parse import urlparse, parse_qs
+import browser_pool
+import async_runner
+import rate_writer
+import jp_holidays
+import calendar_nav
+import checkpoint
+import time_budget
+import job_planner
+import plan_catalog
 
 # DynamoDB テーブル名は環境変数から取得
 TABLE_NAME = os.environ.get('TABLE_NAME', 'SpaceRate')
 
-# 祝日データのキャッシュ（Lambda実行中は保持）
-_holidays_cache = None
-_holidays_cache_time = None
-HOLIDAYS_CACHE_DURATION = 3600  # 1時間
+# JST タイムゾーン
+JST = timezone(timedelta(hours=9))
 
-def get_japan_holidays():
-    """日本の祝日データを取得（キャッシュ付き）"""
-    global _holidays_cache, _holidays_cache_time
-    
-    now = time.time()
-    
-    # キャッシュが有効な場合はそれを返す
-    if _holidays_cache is not None and _holidays_cache_time is not None:
-        if now - _holidays_cache_time < HOLIDAYS_CACHE_DURATION:
-            return _holidays_cache
-    
+# URLの処理方法: 'sync' = 1件ずつ順番に処理、'async' = asyncio で複数URLを並行処理
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'sync')
+
+# 保存形式: 'legacy' = 1時間×1プラン1アイテム（TABLE_NAME）、
+#          'daily' = 1日×1プラン1アイテムの価格配列（DAILY_TABLE_NAME）、'both' = 移行期間中は両方に書き込む
+STORAGE_LAYOUT = os.environ.get('STORAGE_LAYOUT', 'legacy')
+DAILY_TABLE_NAME = os.environ.get('DAILY_TABLE_NAME', 'SpaceRateDaily')
+
+# 'on' = 前回スキャンから価格が変わった時間帯だけを書き込む、'off' = 毎回全件を書き込む
+SKIP_UNCHANGED_PRICES = os.environ.get('SKIP_UNCHANGED_PRICES', 'on')
+
+# 時間予算の見積もりの初期値（実績がない場合）: 'url' = ページを開いて最初の1日分まで、'date' = 2日目以降の1日分
+DEFAULT_COSTS_MS = {
+    'url': int(os.environ.get('DEFAULT_URL_COST_MS', '60000')),
+    'date': int(os.environ.get('DEFAULT_DATE_COST_MS', '40000')),
+}
+
+# 1URL内の日付を何タブに分けて処理するか（同じコンテキスト内で予約ページを複数開く）
+DATE_SCAN_TABS = int(os.environ.get('DATE_SCAN_TABS', '1'))
+
+# 画面更新待ちの設定（固定sleepではなく、通信完了とDOM変化を検知して待機する）
+WAIT_TIMEOUT_MS = int(os.environ.get('WAIT_TIMEOUT_MS', '10000'))  # 最大待機時間
+WAIT_QUIET_MS = int(os.environ.get('WAIT_QUIET_MS', '300'))        # 通信・DOM変化が止まってから安定とみなすまでの時間
+
+# fetch/XHR の実行中件数と最後の通信・DOM変化時刻をページ内に記録するフック
+WAIT_HOOK_SCRIPT = """
+(() => {
+  if (window.__smWait) return;
+  const state = window.__smWait = { pending: 0, last: performance.now() };
+  const touch = () => { state.last = performance.now(); };
+  const origFetch = window.fetch;
+  if (origFetch) {
+    window.fetch = function (...args) {
+      state.pending++; touch();
+      return origFetch.apply(this, args).finally(() => { state.pending--; touch(); });
+    };
+  }
+  const origSend = XMLHttpRequest.prototype.send;
+  XMLHttpRequest.prototype.send = function (...args) {
+    state.pending++; touch();
+    this.addEventListener('loadend', () => { state.pending--; touch(); }, { once: true });
+    return origSend.apply(this, args);
+  };
+  const observe = () => new MutationObserver(touch).observe(document.documentElement, {
+    subtree: true, childList: true, characterData: true,
+    attributes: true, attributeFilter: ['disabled', 'data-disabled', 'data-selected'],
+  });
+  if (document.documentElement) observe();
+  else document.addEventListener('DOMContentLoaded', observe);
+})();
+"""
+
+# プラン一覧と開始時刻ドロップダウンの状態を1つの文字列にまとめる（変化検知用）
+PAGE_SIGNATURE_JS = """
+() => {
+  const ul = document.querySelector('ul.css-n9qrp8');
+  const sel = document.querySelector('select[aria-label="開始時"]');
+  const opts = sel ? Array.from(sel.options).map(o => o.value + (o.disabled ? '-' : '+')).join(',') : '';
+  return (ul ? ul.innerText : '') + '|' + opts;
+}
+"""
+
+# 料金の取得方法: 'network' = ページ自身の通信レスポンスから取得（失敗時はDOM）、'dom' = DOMのみ
+# 'network' の場合もURLごとに最初の時間帯は DOM と照合し、一致しなければそのURLは DOM だけを使う
+RATE_CAPTURE_MODE = os.environ.get('RATE_CAPTURE_MODE', 'dom')
+
+# レスポンス中の価格フィールド（優先順位順、画面の価格表示の優先順位に合わせる）
+PRICE_KEYS = ('discountedPrice', 'discountPrice', 'totalPrice', 'price', 'amount')
+
+# プラン一覧の各行の名前と価格の文字列（価格は優先順位順に最初に見つかった要素）
+PLAN_ROWS_JS = """
+(els) => els.map(el => {
+  const n = el.querySelector('span.css-k6zetj');
+  const p = el.querySelector('.css-1y4ezd0') || el.querySelector('.css-d362cm') || el.querySelector('.css-1sq1blk');
+  return { name: (n || el).innerText, price: p ? p.innerText : '0' };
+})
+"""
+
+PAGE_SNAPSHOT_JS = "() => ({ sig: (" + PAGE_SIGNATURE_JS + ")(), t: performance.now() })"
+
+# 通信が完了し、かつ「内容が変化した」または「一定時間何も変化しない」状態を判定
+PAGE_READY_JS = """
+([prev, armedAt, quiet]) => {
+  const s = window.__smWait;
+  if (s && s.pending > 0) return false;
+  const sig = (""" + PAGE_SIGNATURE_JS + """)();
+  const last = Math.max(s ? s.last : 0, armedAt);
+  const elapsed = performance.now() - last;
+  if (prev !== null && sig !== prev) return elapsed >= Math.min(quiet, 100);
+  return elapsed >= quiet;
+}
+"""
+
+def get_day_type(date_obj):
+    """曜日種別を判定（土日または祝日は weekend）"""
+    if date_obj.weekday() >= 5 or jp_holidays.is_holiday(date_obj):
+        return 'weekend'
+    return 'weekday'
+
+
+def install_wait_hooks(page):
+    """画面更新待ち用のフックを登録（以降のページ遷移から有効）"""
+    page.add_init_script(WAIT_HOOK_SCRIPT)
+
+
+def snapshot_page(page):
+    """操作前のプラン一覧・時刻ドロップダウンの状態を取得（待機の基準点）"""
     try:
-        # 祝日APIからデータ取得
-        url = "https://holidays-jp.github.io/api/v1/date.json"
-        with urllib.request.urlopen(url, timeout=10) as response:
-            holidays_data = json.loads(response.read().decode('utf-8'))
-            _holidays_cache = holidays_data
-            _holidays_cache_time = now
-            return holidays_data
+        return page.evaluate(PAGE_SNAPSHOT_JS)
+    except Exception:
+        return {'sig': None, 't': 0}
+
+
+def wait_for_page_ready(page, snapshot=None, timeout_ms=None):
+    """
+    通信が完了し、プラン一覧（ul.css-n9qrp8）や価格表示が更新されるまで待機する。
+    内容が変化しない操作でも、通信・DOM変化が WAIT_QUIET_MS 止まった時点で完了とみなす。
+    タイムアウトした場合は False を返す（処理は続行）。
+    """
+    snapshot = snapshot or {'sig': None, 't': 0}
+    try:
+        page.wait_for_function(
+            PAGE_READY_JS,
+            arg=[snapshot.get('sig'), snapshot.get('t', 0), WAIT_QUIET_MS],
+            polling=50,
+            timeout=timeout_ms or WAIT_TIMEOUT_MS
+        )
+        return True
     except Exception as e:
-        print(f"祝日データ取得エラー: {e}")
-        # エラー時は空の辞書を返す（通常の曜日判定にフォールバック）
-        return {}
+        print(f"画面更新待ちタイムアウト: {e}")
+        return False
 
-def is_holiday(date_obj):
-    """指定された日付が祝日かどうかを判定"""
-    holidays = get_japan_holidays()
-    date_str = date_obj.strftime('%Y-%m-%d')
-    return date_str in holidays
 
 def lambda_handler(event, context):
     # SQSメッセージから URLs パラメータ取得
     all_urls = []
+    url_jobs = {}    # URL → チェックポイントのジョブID
+    url_records = {} # URL → SQS レコード（時間切れ時の再投入先・再投入回数の判定用）
     offset_days = 0  # デフォルトは今日から
     scan_days = 7    # デフォルトは7日間
     
@@ -59,10 +168,13 @@ def lambda_handler(event, context):
             try:
                 message_body = json.loads(record['body'])
                 urls = message_body.get('urls', [])
-                offset_days = message_body.get('offset_days', 0)
-                scan_days = message_body.get('scan_days', 7)
+                offset_days, scan_days = resolve_scan_window(message_body)
                 if urls and isinstance(urls, list):
                     all_urls.extend(urls)
+                    # 再配信時に処理済みの日付を飛ばすためのジョブID
+                    for url in urls:
+                        url_jobs[url] = checkpoint.job_id_for_record(record)
+                        url_records[url] = record
             except Exception as e:
                 print(f"SQSメッセージ解析エラー: {e}")
                 continue
@@ -70,51 +182,131 @@ def lambda_handler(event, context):
         # 既存のHTTPリクエスト処理（互換性維持）
         if 'body' in event:
             body = json.loads(event['body'] or '{}')
-            urls = body.get('urls')
-            offset_days = body.get('offset_days', 0)
-            scan_days = body.get('scan_days', 7)
         else:
-            urls = event.get('urls')
-            offset_days = event.get('offset_days', 0)
-            scan_days = event.get('scan_days', 7)
+            body = event
+        urls = body.get('urls')
+        offset_days, scan_days = resolve_scan_window(body)
         if urls and isinstance(urls, list):
             all_urls = urls
         elif event.get('url'):
             # 単一URL対応（既存の互換性）
             all_urls = [event.get('url')]
+        # 途中から再開するのは checkpoint_job / resume を指定した場合だけ（同じ内容の再実行は全日付を取り直す）
+        job_id = checkpoint.job_id_for_request(body)
+        url_jobs = {url: job_id for url in all_urls}
     
     if not all_urls:
         return {'statusCode': 400, 'body': json.dumps({'error': 'URL(s) is required'})}
 
-    all_items = []
     errors = []
-    
-    for url in all_urls:
-        try:
-            items = scrape_hourly_prices(url, days=scan_days, offset_days=offset_days)
-            if items:
-                write_items_to_dynamodb(items)
-                all_items.extend(items)
-        except Exception as e:
-            errors.append({
-                'url': url,
-                'error': str(e)
-            })
+    failed_urls = set()
+
+    # 処理済みの日付（前回の実行がタイムアウトした場合など）
+    done_dates = {url: checkpoint.load(url_jobs.get(url), url) for url in all_urls}
+    iso_dates = [d.strftime('%Y-%m-%d') for d in target_dates(scan_days, offset_days)]
+    if all(d in done_dates[url] for url in all_urls for d in iso_dates):
+        return nothing_to_do_response(all_urls)
+    # この実行で取得して書き込みまで成功した日付（時間切れ時に残りの日付を求める。書き込みに失敗した日付は含めない）
+    scanned_dates = {url: set() for url in all_urls}
+
+    # Lambda の残り時間から、次の URL・日付を始めるかを判断する
+    budget = time_budget.start(context, DEFAULT_COSTS_MS)
+
+    # URLごとの処理時間・営業時間・プラン数（投入側がジョブの大きさを決めるためにコスト表へ記録する）
+    measures = {}
+
+    # 書き込んだプラン（実行の最後にプランごとに1回だけカタログを更新する）
+    catalog = plan_catalog.start()
+
+    def start_url(url):
+        measures[url] = job_planner.start_measure()
+
+    def submit(url, iso_dates, items):
+        if url in measures:
+            job_planner.measure_step(measures[url], len(iso_dates),
+                                     len({item['datetime'] for item in items}), {item['planId'] for item in items})
+        def on_written():
+            # 書き込みが終わった時点でその日付を処理済みとして記録する（書き込みスレッドで呼ばれる）。
+            # 初めて見つかったプランは、処理済みと記録する前にカタログへ反映する
+            plan_catalog.add(catalog, items)
+            plan_catalog.flush(catalog, *meta_table(), new_only=True)
+            scanned_dates[url].update(iso_dates)
+            checkpoint.mark(url_jobs.get(url), url, iso_dates)
+
+        rate_writer.submit(writer, url, items, done=on_written)
+
+    # 取得したアイテムは1日分ずつ書き込みスレッドに渡し、ハンドラでは件数だけを保持する
+    writer = rate_writer.start_background_writer(write_items_to_dynamodb)
+    try:
+        if EXECUTION_MODE == 'async':
+            # 複数URLを1つのブラウザで並行処理
+            results = fetch_hourly_prices_concurrently(
+                all_urls, scan_days, offset_days, submit, done_dates,
+                should_stop=lambda: not time_budget.can_afford(budget, 'date'), on_start=start_url
+            )
+            for url, count, error in results:
+                if error is not None:
+                    failed_urls.add(url)
+                    errors.append({'url': url, 'error': str(error)})
+        else:
+            for url in all_urls:
+                if not time_budget.can_afford(budget, 'url'):
+                    break
+                started = time_budget.now()
+                start_url(url)
+                try:
+                    for n, (iso_date, date_items) in enumerate(fetch_hourly_prices(
+                            url, days=scan_days, offset_days=offset_days, done_dates=done_dates[url])):
+                        submit(url, [iso_date], date_items)
+                        time_budget.record('date' if n else 'url', started)
+                        started = time_budget.now()
+                        # 次の1日分が締め切りまでに終わらない場合は打ち切る（ブラウザはジェネレータの終了時に閉じる）
+                        if not time_budget.can_afford(budget, 'date'):
+                            break
+                except Exception as e:
+                    failed_urls.add(url)
+                    errors.append({
+                        'url': url,
+                        'error': str(e)
+                    })
+    finally:
+        # 書き込みキューが空になるまで待ち、まとめていたプランの件数をカタログに反映する
+        rate_writer.finish(writer)
+        plan_catalog.flush(catalog, *meta_table())
+
+    errors.extend(writer['errors'])
+    records = writer['records']
+
+    for url, measure in measures.items():
+        job_planner.save_measure('SpaceRate', url, measure)
+
+    # カタログ導入前のデータのプランを取り込む（スペースごとに初回だけ。時間切れで打ち切った場合は次回に回す）
+    if not budget['stopped']:
+        plan_catalog.backfill(catalog, *meta_table(), source_tables(), plan_of_item,
+                              projection='planId, planDisplayName')
+
+    # 時間切れで打ち切った場合・書き込みに失敗した日付がある場合は、未処理の日付をURLごとに新しいメッセージとして戻す
+    requeued = []
+    if budget['stopped'] or writer['errors']:
+        requeued = requeue_leftovers(all_urls, scan_days, offset_days, done_dates, scanned_dates,
+                                     failed_urls, url_jobs, url_records)
     
     # 部分的成功でも200を返す
-    if all_items:
+    if records or requeued:
         return {
             'statusCode': 200,
             'body': json.dumps({
-                'message': f'{len(all_items)}件保存完了',
-                'successful': len(all_items),
+                'message': f'{records}件保存完了',
+                'successful': records,
                 'failed': len(errors),
-                'records': len(all_items),
+                'records': records,
                 'errors': errors,
+                'write_stats': writer['stats'],
+                'requeued': requeued,
                 'scan_info': {
                     'offset_days': offset_days,
                     'scan_days': scan_days,
-                    'start_date': (datetime.now(timezone(timedelta(hours=9))) + timedelta(days=offset_days)).strftime('%Y-%m-%d')
+                    'start_date': (datetime.now(JST) + timedelta(days=offset_days)).strftime('%Y-%m-%d')
                 }
             }, ensure_ascii=False)
         }
@@ -129,114 +321,204 @@ def lambda_handler(event, context):
         }
 
 
-def scrape_hourly_prices(original_url, days=7, offset_days=0):
+def nothing_to_do_response(urls):
+    """全URLの全日付が処理済みの場合の応答（再配信・再実行で全て終わっている場合は成功扱い）"""
+    print(f"全URLの全日付が処理済みのため処理なし: {len(urls)}件")
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': '全日付が処理済みのため処理なし',
+            'status': 'nothing_to_do',
+            'successful': 0,
+            'failed': 0,
+            'records': 0,
+            'errors': [],
+            'requeued': [],
+        }, ensure_ascii=False)
+    }
+
+
+def resolve_scan_window(params):
+    """
+    メッセージの対象期間を (offset_days, scan_days) にする。
+    start_date / end_date（YYYY-MM-DD、時間切れの再投入で使う）があれば、実行した日の今日からの日数に直す
+    （日付をまたいで配信された場合も同じ日付を処理し、過ぎた日付は除く）。なければ offset_days / scan_days をそのまま使う。
+    """
+    if params.get('start_date') and params.get('end_date'):
+        today = datetime.now(JST).date()
+        start = max(datetime.strptime(params['start_date'], '%Y-%m-%d').date(), today)
+        end = datetime.strptime(params['end_date'], '%Y-%m-%d').date()
+        return (start - today).days, max(0, (end - start).days + 1)
+    return params.get('offset_days', 0), params.get('scan_days', 7)
+
+
+def requeue_leftovers(urls, days, offset_days, done_dates, scanned_dates, failed_urls, url_jobs, url_records):
+    """
+    時間切れで処理できなかった日付を、URLごとに残りの期間（start_date / end_date の絶対日付）の
+    メッセージとして再投入する。チェックポイントのジョブIDを引き継ぐため、期間内の処理済みの日付は次回も飛ばされる。
+    エラーになったURLは再投入しない。戻り値: 再投入したメッセージ本文のリスト
+    """
+    requeued = []
+    iso_dates = [d.strftime('%Y-%m-%d') for d in target_dates(days, offset_days)]
+    for url in urls:
+        if url in failed_urls:
+            continue
+        pending = [i for i, d in enumerate(iso_dates) if d not in done_dates[url] and d not in scanned_dates[url]]
+        if not pending:
+            continue
+        record = url_records.get(url)
+        previous = json.loads(record['body']) if record else {}
+        body = {
+            'urls': [url],
+            'start_date': iso_dates[pending[0]],
+            'end_date': iso_dates[pending[-1]],
+            'execution_time': datetime.now().isoformat(),
+            'checkpoint_job': url_jobs.get(url),
+            'requeue_count': previous.get('requeue_count', 0) + 1,
+        }
+        if time_budget.requeue(time_budget.queue_url_for_record(record), body):
+            requeued.append(body)
+    return requeued
+
+
+def fetch_hourly_prices(original_url, days=7, offset_days=0, done_dates=()):
+    """
+    料金を1日分ずつ (日付 YYYY-MM-DD, アイテムリスト) で返すジェネレータ。
+    done_dates に含まれる日付（チェックポイントで処理済み）は取得しない。
+    """
+    remaining = [d for d in target_dates(days, offset_days) if d.strftime('%Y-%m-%d') not in done_dates]
+    if not remaining:
+        print(f"全日付が処理済みのためスキップ ({original_url})")
+        return
+    if len(remaining) < days:
+        print(f"チェックポイントから再開 ({original_url}): 残り{len(remaining)}/{days}日")
+    yield from scrape_hourly_prices(original_url, days=days, offset_days=offset_days, done_dates=done_dates)
+
+
+def target_dates(days, offset_days):
+    """対象日付リスト（今日 + offset_days から days 日分）"""
+    base = datetime.now(JST) + timedelta(days=offset_days)
+    return [base + timedelta(days=i) for i in range(days)]
+
+
+def fetch_hourly_prices_concurrently(urls, days, offset_days, on_items, done_dates=None, should_stop=None,
+                                     on_start=None):
+    """
+    複数URLを asyncio で並行スクレイピングする。
+    取得したアイテムは on_items(url, [日付 YYYY-MM-DD, ...], items) に渡す（書き込みスレッドへの受け渡しを想定）。
+    done_dates: {url: 処理済みの日付の集合}
+    should_stop() が True を返した時点で、次のURL・日付を始めずに打ち切る。
+    on_start(url) は各URLの取得を始める直前に呼ぶ（処理時間の計測用）。
+    戻り値: [(url, 件数, 例外), ...]（入力順、打ち切ったURLは含まない）
+    """
+    done_dates = done_dates or {}
+    results = {}
+    browser_urls = []
+    for url in urls:
+        if should_stop and should_stop():
+            break
+        url_done = done_dates.get(url, set())
+        iso_dates = [d.strftime('%Y-%m-%d') for d in target_dates(days, offset_days)]
+        if all(d in url_done for d in iso_dates):
+            print(f"全日付が処理済みのためスキップ ({url})")
+            results[url] = (url, 0, None)
+            continue
+        browser_urls.append(url)
+
+    if browser_urls:
+        async def worker(context, url):
+            if should_stop and should_stop():
+                return 0
+            if on_start:
+                on_start(url)
+            started = time_budget.now()
+            kind = 'url'
+
+            async def on_date(iso_date, date_items):
+                nonlocal started, kind
+                # 最初の1日分はページを開く時間を含めて 'url'、以降は前の日付からの経過時間を 'date' として記録
+                time_budget.record(kind, started)
+                started, kind = time_budget.now(), 'date'
+                # 書き込みキューが満杯の場合に待機してもイベントループを止めないよう別スレッドで渡す
+                await asyncio.to_thread(on_items, url, [iso_date], date_items)
+            return await scrape_hourly_prices_async(context, url, days=days, offset_days=offset_days,
+                                                    on_date=on_date, done_dates=done_dates.get(url, set()),
+                                                    should_stop=should_stop)
+
+        for url, count, error in async_runner.run_urls(browser_urls, worker):
+            results[url] = (url, count, error)
+
+    return [results[url] for url in urls if url in results]
+
+
+def build_rate_item(space_id, space_name, original_url, current_date, hour,
+                    plan_id, plan_display_name, price, now_jst, offset_days):
+    """
+    DynamoDB 格納用のアイテムを作成する。
+    hour が24以上の場合は翌日の相当する時間として扱う。
+    """
+    target_date = current_date
+    target_hour = hour
+    if hour >= 24:
+        target_date = current_date + timedelta(days=1)
+        target_hour = hour - 24
+
+    dt_start = f"{target_date.strftime('%Y-%m-%d')}T{target_hour:02d}:00"
+    return {
+        'spaceId': space_id,
+        'rate_key': f"{dt_start}#{plan_id}",
+        'datetime': dt_start,
+        'name': space_name,
+        'url': original_url,
+        'planId': plan_id,
+        'planDisplayName': plan_display_name,
+        'price': price,
+        'day_type': get_day_type(target_date),
+        'created_at': now_jst.isoformat(),
+        'scan_date': now_jst.strftime('%Y-%m-%d'),  # スキャン実行日
+        'forecast_days': offset_days  # 何日先のデータか
+    }
+
+
+def scrape_hourly_prices(original_url, days=7, offset_days=0, tabs=None, done_dates=()):
     """
     指定 URL のスペースマーケット予約ページから
     指定日数分の1時間単位プラン価格情報を取得し、
-    DynamoDB 格納用のアイテムリストを返す
+    DynamoDB 格納用のアイテムリストを1日分ずつ (日付 YYYY-MM-DD, アイテムリスト) で返すジェネレータ。
+    done_dates に含まれる日付は処理しない。
+    tabs > 1 の場合は日付リストを複数タブに分割し、各タブの操作を交互に進めて待ち時間を重ねる
+    （その場合、日付は処理が終わった順に返る）。
     """
-    items = []
-    # JST タイムゾーン
-    JST = timezone(timedelta(hours=9))
+    item_count = 0
     now_jst = datetime.now(JST)
+    tabs = max(1, min(tabs or DATE_SCAN_TABS, days))
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=True,
-            args=[
-                "--single-process",
-                "--no-zygote",
-                "--no-sandbox",
-                "--disable-gpu",
-                "--disable-dev-shm-usage",
-                "--headless=new",
-                "--disable-http2",
-            ]
-        )
-        context = browser.new_context(
-            user_agent=(
-                'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) '
-                'AppleWebKit/537.36 (KHTML, like Gecko) '
-                'Chrome/112.0.0.0 Safari/537.36'
-            )
-        )
+    with browser_pool.browser_context(original_url) as context:
         page = context.new_page()
         
         try:
             # URL形式を判定して、roomUidとspaceIdを抽出
-            room_match = re.search(r'/p/([^/?]+)', original_url)
-            space_match_direct = re.search(r'/spaces/([^/?]+)', original_url)
-            
-            if room_match:
-                # 既存の /p/ 形式
-                room_uid = room_match.group(1)
-                
-                # 1) トップページにアクセス（リダイレクト後の URL を取得）
-                resp = page.goto(original_url, wait_until='networkidle', timeout=90000)
-                if not resp.ok:
-                    raise Exception(f"ページロードエラー: {resp.status} {resp.status_text}")
-                page.wait_for_load_state("networkidle")
-                time.sleep(2)
-
-                # 2) spaceId を抽出
-                redirected = page.url  # e.g. https://www.spacemarket.com/spaces/<spaceId>/?...
-                space_match = re.search(r'/spaces/([^/]+)/', redirected)
-                if not space_match:
-                    raise Exception('spaceId の抽出失敗')
-                space_id_from_url = space_match.group(1)
-                
-            elif space_match_direct:
-                # 新しい /spaces/ 形式
-                space_id_from_url = space_match_direct.group(1)
-                
-                # クエリパラメータからroom_uidを取得
-                parsed_url = urlparse(original_url)
-                query_params = parse_qs(parsed_url.query)
-                room_uid = query_params.get('room_uid', [None])[0]
-                
-                if not room_uid:
-                    raise Exception('room_uid パラメータが見つかりません')
-                
-                # ページにアクセス（リダイレクトの確認のため）
-                resp = page.goto(original_url, wait_until='networkidle', timeout=90000)
-                if not resp.ok:
-                    raise Exception(f"ページロードエラー: {resp.status} {resp.status_text}")
-                page.wait_for_load_state("networkidle")
-                time.sleep(2)
-                
-            else:
-                raise Exception('対応していないURL形式です')
+            room_uid, space_id_from_url = parse_room_url(original_url)
 
-            # 3) 予約ページ URL を組み立てて遷移
-            reservation_url = (
-                f"https://www.spacemarket.com/spaces/{space_id_from_url}"
-                f"/rooms/{room_uid}/reservations/new/"
-                "?from=room_reservation_button&price_type=HOURLY&promotion_ids=4808&rent_type=1"
-            )
-            resp2 = page.goto(reservation_url, wait_until='networkidle', timeout=90000)
-            if not resp2.ok:
-                raise Exception(f"予約ページロードエラー: {resp2.status} {resp2.status_text}")
-            page.wait_for_load_state("networkidle")
-            time.sleep(3)
-
-            # JSONデータを取得
-            json_data = None
-            space_id = ''
-            plans_data = []
+            # 1) トップページにアクセス（/p/ 形式はリダイレクト後の URL から spaceId を取得）
+            resp = page.goto(original_url, wait_until='networkidle', timeout=90000)
+            if not resp.ok:
+                raise Exception(f"ページロードエラー: {resp.status} {resp.status_text}")
+            if space_id_from_url is None:
+                space_id_from_url = extract_space_id_from_redirect(page.url)
+
+            # 2) 予約ページ URL を組み立てて遷移
+            reservation_url = build_reservation_url(space_id_from_url, room_uid)
+            open_reservation_page(page, reservation_url)
+
+            # JSONデータを取得（spaceId とプラン情報）
             try:
                 script_el = page.query_selector('script#__NEXT_DATA__')
-                if script_el:
-                    json_str = script_el.inner_text()
-                    json_data = json.loads(json_str)
-                    # spaceIdを取得（roomFragment.id）
-                    room_fragment = json_data.get('props', {}).get('pageProps', {}).get('roomFragment', {})
-                    space_id = room_fragment.get('id', '')
-                    # プラン情報を取得
-                    plans_data = room_fragment.get('plans', {}).get('results', [])
+                space_id, plan_map = parse_next_data(script_el.inner_text() if script_el else None)
             except Exception as e:
                 print(f"JSON取得エラー: {e}")
                 # フォールバック：URLから取得したspaceIdを使用
-                space_id = space_id_from_url
+                space_id, plan_map = space_id_from_url, {}
 
             # スペース名を取得
             space_name = ''
@@ -246,141 +528,353 @@ def scrape_hourly_prices(original_url, days=7, offset_days=0):
             except:
                 space_name = ''
 
-            # 対象日付リスト
-            base = datetime.now(JST) + timedelta(days=offset_days)
-            dates = [base + timedelta(days=i) for i in range(days)]
-            print(f"処理対象日付 (offset={offset_days}日): {[d.strftime('%Y-%m-%d') for d in dates]}")
-
-            # プラン情報取得（JSONデータから）
-            plan_map = {}  # プランindexとデータの対応
-            for i, plan_data in enumerate(plans_data):
-                plan_map[i] = {
-                    'id': plan_data.get('id', ''),
-                    'name': plan_data.get('name', '')
-                }
+            # 対象日付リスト（日付の添字は処理済みの日付を除いても元の位置のまま使う）
+            dates = target_dates(days, offset_days)
+            indices = pending_date_indices(dates, done_dates, offset_days)
+            scan = new_scan(space_id, space_name, plan_map, original_url, now_jst, offset_days)
 
-            for date_index, current_date in enumerate(dates):
-                # 日付ラベル
-                date_label = f"{current_date.year}年{current_date.month}月{current_date.day}日"
-                iso_date = current_date.strftime('%Y-%m-%d')
-                print(f"処理中の日付: {iso_date}")
-                # 曜日種別（祝日判定を追加）
-                dow = current_date.weekday()
-                if dow >= 5 or is_holiday(current_date):  # 土日または祝日
-                    day_type = 'weekend'
-                else:
-                    day_type = 'weekday'
-
-                # 日付選択
-                btn = page.locator(f'button[aria-label="{date_label}"]')
-                try:
-                    # ボタンが見つからない場合は次の月に移動
-                    if btn.count() == 0:
-                        # 次の月ボタンをクリック
-                        next_month_btn = page.locator('button[aria-label="次の月"]')
-                        if next_month_btn.count() > 0:
-                            next_month_btn.click()
-                            time.sleep(1)
-                            # 再度日付ボタンを探す
-                            btn = page.locator(f'button[aria-label="{date_label}"]')
-                    
-                    if btn.count() == 0:
-                        print(f"日付ボタンが見つかりません: {date_label}")
-                        continue
-                    
-                    btn.click()
-                    time.sleep(2)
-                except Exception as e:
-                    print(f"日付選択エラー: {date_label} - {e}")
-                    continue
-
-                # 利用可能時間帯取得
-                hours = get_available_hours(page)
-                hours.sort()
-                
-                # 2日目以降は0-11時をスキップ（前日の24-35時として既に処理済み）
-                if date_index > 0:
-                    hours = [h for h in hours if h >= 12]
-                    print(f"  利用可能時間帯 ({iso_date}) ※12時以降のみ処理: {hours}")
-                else:
-                    print(f"  利用可能時間帯 ({iso_date}): {hours}")
-
-                for hour in hours:
-                    # 24時以上は翌日の時間として処理
-                    target_date = current_date
-                    target_hour = hour
-                    
-                    if hour >= 24:
-                        # 24時以上の場合は翌日の相当する時間に変換
-                        target_date = current_date + timedelta(days=1)
-                        target_hour = hour - 24
-                        # 翌日の曜日種別を再計算（祝日判定を追加）
-                        dow = target_date.weekday()
-                        if dow >= 5 or is_holiday(target_date):  # 土日または祝日
-                            day_type = 'weekend'
-                        else:
-                            day_type = 'weekday'
-                    
-                    # 日付をISO形式で生成
-                    target_iso_date = target_date.strftime('%Y-%m-%d')
-                    
-                    # 1時間後
-                    start = target_hour
-                    end = target_hour + 1
-                    # 時刻レンジ設定（元のhourを使用）
-                    if not set_time_range(page, hour, 0, hour + 1, 0):
-                        continue
-                    # プラン取得（価格優先順位付き）
-                    plans = get_available_plans_with_priority(page)
-                    for idx, plan in enumerate(plans):
-                        # JSONデータからplanIdとplanDisplayNameを取得
-                        if idx in plan_map:
-                            plan_id = plan_map[idx]['id']
-                            plan_display_name = plan_map[idx]['name']
-                        else:
-                            # フォールバック（既存のロジック）
-                            plan_display_name = plan['name']
-                            plan_id = 'plan_' + hashlib.md5(plan_display_name.encode()).hexdigest()[:8]
-                        
-                        # price は数値
-                        price = plan.get('value') or 0
-                        # rate_key
-                        dt_start = f"{target_iso_date}T{start:02d}:00"
-                        rate_key = f"{dt_start}#{plan_id}"
-
-                        item = {
-                            'spaceId': space_id,
-                            'rate_key': rate_key,
-                            'datetime': dt_start,
-                            'name': space_name,
-                            'url': original_url,
-                            'planId': plan_id,
-                            'planDisplayName': plan_display_name,
-                            'price': price,
-                            'day_type': day_type,
-                            'created_at': now_jst.isoformat(),
-                            'scan_date': now_jst.strftime('%Y-%m-%d'),  # スキャン実行日
-                            'forecast_days': offset_days  # 何日先のデータか
-                        }
-                        items.append(item)
+            # 日付リストをタブ数で連続区間に分割（各タブはカレンダーを先へ進むだけになる）
+            chunks = split_date_indices(indices, tabs)
+            pages = [page]
+            for _ in chunks[1:]:
+                extra_page = context.new_page()
+                open_reservation_page(extra_page, reservation_url)
+                pages.append(extra_page)
+            if len(pages) > 1:
+                print(f"  {len(pages)}タブで並行処理: {[len(c) for c in chunks]}日ずつ")
+
+            # 1日分ずつ呼び出し側に渡す（24-35時の翌日扱いは各日付の結果に含まれている）
+            workers = [scan_dates(p, dates, indices, scan) for p, indices in zip(pages, chunks)]
+            for date_index, date_items in run_interleaved(workers):
+                item_count += len(date_items)
+                yield dates[date_index].strftime('%Y-%m-%d'), date_items
             
-            print(f"スクレイピング完了 ({original_url}): {len(items)}件のデータを取得")
+            print_scan_summary(scan, item_count)
 
         except Exception as e:
             print(f"スクレイピングエラー ({original_url}): {e}")
             raise e
-        finally:
-            browser.close()
-    
-    return items
+
+
+def pending_date_indices(dates, done_dates, offset_days):
+    """対象日付のうち処理済みでないものの添字（同期版・非同期版で共用）"""
+    indices = [i for i, d in enumerate(dates) if d.strftime('%Y-%m-%d') not in done_dates]
+    print(f"処理対象日付 (offset={offset_days}日): {[dates[i].strftime('%Y-%m-%d') for i in indices]}")
+    return indices
+
+
+def new_scan(space_id, space_name, plan_map, original_url, now_jst, offset_days):
+    """1URL分のスクレイピングの状態（全タブで共有する）"""
+    return {
+        'space_id': space_id,
+        'space_name': space_name,
+        'plan_map': plan_map,
+        'original_url': original_url,
+        'now_jst': now_jst,
+        'offset_days': offset_days,
+        'capture_stats': {'network': 0, 'dom': 0},
+        # 通信レスポンスの価格を DOM と照合した結果（None = 未照合）
+        'network_verified': None,
+    }
+
+
+def print_scan_summary(scan, item_count):
+    print(f"スクレイピング完了 ({scan['original_url']}): {item_count}件のデータを取得 "
+          f"(通信レスポンス: {scan['capture_stats']['network']}回, DOM: {scan['capture_stats']['dom']}回)")
+
+
+def open_reservation_page(page, reservation_url):
+    """予約ページを開き、時刻ドロップダウンが表示されて画面が落ち着くまで待つ"""
+    install_wait_hooks(page)
+    resp = page.goto(reservation_url, wait_until='networkidle', timeout=90000)
+    if not resp.ok:
+        raise Exception(f"予約ページロードエラー: {resp.status} {resp.status_text}")
+    try:
+        page.wait_for_selector('select[aria-label="開始時"]', timeout=WAIT_TIMEOUT_MS)
+    except Exception as e:
+        print(f"時刻ドロップダウン待機エラー: {e}")
+    wait_for_page_ready(page)
+
+
+def split_date_indices(indices, parts):
+    """日付の添字リストを parts 個の連続区間に分割する（前の区間ほど1件多い）"""
+    count = len(indices)
+    parts = max(1, min(parts, count)) if count else 1
+    size, extra = divmod(count, parts)
+    chunks = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(list(indices[start:end]))
+        start = end
+    return chunks
+
+
+def run_interleaved(workers):
+    """
+    scan_dates のジェネレータを順番に1ステップずつ進める。
+    各タブで操作を発行してから待機するため、あるタブの待機中に他のタブの読み込みが進む。
+    1日分が終わるたびに (date_index, [item, ...]) を返すジェネレータ。
+    """
+    active = list(workers)
+    while active:
+        for worker in list(active):
+            try:
+                step = next(worker)
+            except StopIteration:
+                active.remove(worker)
+                continue
+            if step is not None:
+                yield step
+
+
+def scan_dates(page, dates, date_indices, scan):
+    """
+    1タブ分の日付を処理するジェネレータ（scan_steps の手順を同期 API で実行する）。
+    操作を発行した直後に None を yield し（他タブに順番を譲る）、
+    1日分が終わるたびに (date_index, items) を yield する。
+    """
+    captured = start_response_capture(page) if RATE_CAPTURE_MODE == 'network' and scan['plan_map'] else None
+    steps = scan_steps(dates, date_indices, scan, captured is not None)
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration:
+            return
+        result = None
+        if step[0] == 'date':
+            yield step[1], step[2]
+        elif step[0] == 'wait':
+            yield None
+            wait_for_page_ready(page, step[1])
+        else:
+            result = run_step(page, step, captured, scan['plan_map'])
+
+
+def scan_steps(dates, date_indices, scan, capture, should_stop=None):
+    """
+    1タブ分の日付・時間帯の処理手順（同期版 scan_dates と非同期版 scan_dates_async で共用）。
+    ページ操作を (操作名, 引数...) として yield し、実行結果を send で受け取る。
+      ('click_date', nav, date) → 操作前の画面状態（失敗時は None）、('wait', 画面状態) → 画面更新を待つ、
+      ('hours',) → 開始可能な時の一覧、('select_time', hour) → 操作前の画面状態（失敗時は None）、
+      ('network_plans',) / ('dom_plans',) → プランのリスト
+    1日分が終わるたびに ('date', date_index, items) を yield する。
+    capture: 通信レスポンスを記録しているか。should_stop() が True を返した時点で、次の日付を始めずに終了する。
+    """
+    plan_map = scan['plan_map']
+    capture_stats = scan['capture_stats']
+    # 表示中のカレンダーの月（タブごとに保持）
+    nav = {}
+
+    for date_index in date_indices:
+        if should_stop and should_stop():
+            return
+        current_date = dates[date_index]
+        iso_date = current_date.strftime('%Y-%m-%d')
+        print(f"処理中の日付: {iso_date}")
+
+        # 日付選択（表示中の月から必要な回数だけ月移動し、日付ボタンを1回クリック）
+        snapshot = yield ('click_date', nav, current_date)
+        if snapshot is None:
+            continue
+        yield ('wait', snapshot)
+
+        # 利用可能時間帯取得
+        hours = filter_hours_for_date((yield ('hours',)), date_index, iso_date)
+
+        date_items = []
+        for hour in hours:
+            # 時刻レンジ設定（元のhourを使用、24時以上は build_rate_item で翌日扱い）
+            snapshot = yield ('select_time', hour)
+            if snapshot is None:
+                continue
+            yield ('wait', snapshot)
+            # プラン取得（通信レスポンス優先、取れなければDOMから価格優先順位付きで取得）
+            plans = []
+            if capture and scan['network_verified'] is not False:
+                plans = yield ('network_plans',)
+                if plans and scan['network_verified'] is None:
+                    # URLの最初の時間帯は DOM の価格と照合し、違えば以降は DOM だけを使う
+                    if not verify_network_plans(scan, plans, (yield ('dom_plans',))):
+                        plans = []
+            if plans:
+                capture_stats['network'] += 1
+            else:
+                capture_stats['dom'] += 1
+                plans = yield ('dom_plans',)
+            for idx, plan in enumerate(plans):
+                plan_id, plan_display_name = resolve_plan(idx, plan, plan_map)
+                # price は数値
+                price = plan.get('value') or 0
+                date_items.append(build_rate_item(
+                    scan['space_id'], scan['space_name'], scan['original_url'], current_date, hour,
+                    plan_id, plan_display_name, price, scan['now_jst'], scan['offset_days']
+                ))
+        yield ('date', date_index, date_items)
+
+
+def run_step(page, step, captured, plan_map):
+    """scan_steps のページ操作を同期 API で実行する"""
+    op = step[0]
+    if op == 'click_date':
+        try:
+            return calendar_nav.click_date(page, step[1], step[2], snapshot_page, wait_for_page_ready)
+        except Exception as e:
+            print(f"日付選択エラー: {calendar_nav.date_label(step[2])} - {e}")
+            return None
+    if op == 'hours':
+        return get_available_hours(page)
+    if op == 'select_time':
+        # 時刻変更後の通信レスポンスだけを使うため、記録を空にしてから操作する
+        if captured is not None:
+            captured.clear()
+        return select_time_range(page, step[1], 0, step[1] + 1, 0)
+    if op == 'network_plans':
+        return get_plans_from_responses(captured, plan_map)
+    if op == 'dom_plans':
+        return get_available_plans_with_priority(page)
+    raise ValueError(f"不明な操作: {op}")
+
+
+def parse_room_url(original_url):
+    """
+    URL形式を判定して (room_uid, space_id_from_url) を返す。
+    /p/ 形式の場合、spaceId はリダイレクト後の URL から取得するため None を返す。
+    """
+    room_match = re.search(r'/p/([^/?]+)', original_url)
+    space_match_direct = re.search(r'/spaces/([^/?]+)', original_url)
+
+    if room_match:
+        # 既存の /p/ 形式
+        return room_match.group(1), None
+    if space_match_direct:
+        # 新しい /spaces/ 形式（クエリパラメータからroom_uidを取得）
+        query_params = parse_qs(urlparse(original_url).query)
+        room_uid = query_params.get('room_uid', [None])[0]
+        if not room_uid:
+            raise Exception('room_uid パラメータが見つかりません')
+        return room_uid, space_match_direct.group(1)
+    raise Exception('対応していないURL形式です')
+
+
+def extract_space_id_from_redirect(redirected):
+    """リダイレクト後の URL（https://www.spacemarket.com/spaces/<spaceId>/?...）から spaceId を抽出"""
+    space_match = re.search(r'/spaces/([^/]+)/', redirected)
+    if not space_match:
+        raise Exception('spaceId の抽出失敗')
+    return space_match.group(1)
+
+
+def build_reservation_url(space_id_from_url, room_uid):
+    """予約ページ URL を組み立てる"""
+    return (
+        f"https://www.spacemarket.com/spaces/{space_id_from_url}"
+        f"/rooms/{room_uid}/reservations/new/"
+        "?from=room_reservation_button&price_type=HOURLY&promotion_ids=4808&rent_type=1"
+    )
+
+
+def parse_next_data(json_str):
+    """__NEXT_DATA__ から spaceId（roomFragment.id）とプラン情報（index -> {id, name}）を取得"""
+    if not json_str:
+        return '', {}
+    json_data = json.loads(json_str)
+    room_fragment = json_data.get('props', {}).get('pageProps', {}).get('roomFragment', {})
+    plans_data = room_fragment.get('plans', {}).get('results', [])
+    plan_map = {}  # プランindexとデータの対応
+    for i, plan_data in enumerate(plans_data):
+        plan_map[i] = {
+            'id': plan_data.get('id', ''),
+            'name': plan_data.get('name', '')
+        }
+    return room_fragment.get('id', ''), plan_map
+
+
+def filter_hours_for_date(hours, date_index, iso_date):
+    """2日目以降は0-11時をスキップ（前日の24-35時として既に処理済み）"""
+    hours = sorted(hours)
+    if date_index > 0:
+        hours = [h for h in hours if h >= 12]
+        print(f"  利用可能時間帯 ({iso_date}) ※12時以降のみ処理: {hours}")
+    else:
+        print(f"  利用可能時間帯 ({iso_date}): {hours}")
+    return hours
+
+
+def verify_network_plans(scan, network_plans, dom_plans):
+    """
+    通信レスポンスから取得したプランと価格が DOM と一致するかを確認し、結果を scan['network_verified'] に記録する。
+    一致しない場合、そのURLの残りの時間帯は DOM だけから取得する。戻り値: 一致すれば True
+    """
+    plan_map = scan['plan_map']
+    network = {resolve_plan(idx, plan, plan_map)[0]: plan.get('value') or 0 for idx, plan in enumerate(network_plans)}
+    dom = {resolve_plan(idx, plan, plan_map)[0]: plan.get('value') or 0 for idx, plan in enumerate(dom_plans)}
+    scan['network_verified'] = network == dom
+    if not scan['network_verified']:
+        print(f"通信レスポンスの価格がDOMと一致しないためDOMで取得します ({scan['original_url']}): "
+              f"通信={network} DOM={dom}")
+    return scan['network_verified']
+
+
+def resolve_plan(idx, plan, plan_map):
+    """プランの planId と planDisplayName を決定する"""
+    if plan.get('id'):
+        # 通信レスポンスから取得した場合はIDが確定している
+        return plan['id'], plan['name']
+    if idx in plan_map:
+        # JSONデータからplanIdとplanDisplayNameを取得
+        return plan_map[idx]['id'], plan_map[idx]['name']
+    # フォールバック（既存のロジック）
+    plan_display_name = plan['name']
+    return 'plan_' + hashlib.md5(plan_display_name.encode()).hexdigest()[:8], plan_display_name
 
 
 def write_items_to_dynamodb(items):
-    """DynamoDB へ複数アイテムを個別に put"""
-    dynamo = boto3.resource('dynamodb')
-    table = dynamo.Table(TABLE_NAME)
-    for item in items:
-        table.put_item(Item=item)
+    """DynamoDB へ複数アイテムをバッチで書き込み、書き込み件数・所要時間を返す"""
+    stats = {}
+    if STORAGE_LAYOUT in ('legacy', 'both'):
+        if SKIP_UNCHANGED_PRICES == 'on':
+            # 前回から価格が変わった時間帯だけを書き込む
+            add_write_stats(stats, rate_writer.write_changed_items(items, TABLE_NAME))
+        else:
+            add_write_stats(stats, rate_writer.write_items(items, TABLE_NAME))
+    if STORAGE_LAYOUT in ('daily', 'both'):
+        daily_stats = rate_writer.write_daily_items(items, DAILY_TABLE_NAME)
+        add_write_stats(stats, {f"daily_{k}": v for k, v in daily_stats.items()})
+    if stats.get('written') or stats.get('daily_written'):
+        # 価格が変わったスペースの版数を進め、Get_spacerate のキャッシュを無効にする
+        space_ids = {item['spaceId'] for item in items}
+        rate_writer.bump_versions(space_ids, items[0].get('scan_date', ''), *meta_table())
+    return stats
+
+
+def meta_table():
+    """版数・プランカタログを置くテーブルとソートキー名（読み込み元のテーブル、日別レイアウトのみの場合は日別テーブル）"""
+    return (DAILY_TABLE_NAME, 'day_key') if STORAGE_LAYOUT == 'daily' else (TABLE_NAME, 'rate_key')
+
+
+def source_tables():
+    """価格の行を置くテーブル（プランカタログの取り込みで全件 Query する）"""
+    tables = []
+    if STORAGE_LAYOUT in ('legacy', 'both'):
+        tables.append(TABLE_NAME)
+    if STORAGE_LAYOUT in ('daily', 'both'):
+        tables.append(DAILY_TABLE_NAME)
+    return tables
+
+
+def plan_of_item(item):
+    """価格の行の (planId, 表示名, ttl)。ダイジェスト・版数・カタログの行は planId がないため None"""
+    if not item.get('planId'):
+        return None
+    return item['planId'], item.get('planDisplayName', ''), None
+
+
+def add_write_stats(total, stats):
+    """URLごとの書き込み統計を合算する"""
+    for key, value in stats.items():
+        total[key] = total.get(key, 0) + value
 
 
 def get_available_hours(page):
@@ -396,44 +890,351 @@ def get_available_hours(page):
 
 def set_time_range(page, sh, sm, eh, em):
     """開始/終了の時刻を選択して料金更新を待機"""
+    snapshot = select_time_range(page, sh, sm, eh, em)
+    if snapshot is None:
+        return False
+    wait_for_page_ready(page, snapshot)
+    return True
+
+
+def select_time_range(page, sh, sm, eh, em):
+    """開始/終了の時刻を選択する（待機はしない）。選択前の画面状態を返し、失敗時は None"""
     try:
+        snapshot = snapshot_page(page)
         page.locator('select[aria-label="開始時"]').select_option(value=str(sh))
         page.locator('select[aria-label="開始分"]').select_option(value=f"{sm:02d}")
         page.locator('select[aria-label="終了時"]').select_option(value=str(eh))
         page.locator('select[aria-label="終了分"]').select_option(value=f"{em:02d}")
-        time.sleep(1.5)
-        return True
+        return snapshot
     except:
-        return False
+        return None
+
+
+def start_response_capture(page):
+    """
+    ページが発行する fetch/XHR の JSON レスポンスを記録するリストを返す。
+    レスポンス本文の取得はイベント内では行わず、料金更新後にまとめて行う。
+    """
+    captured = []
+
+    def on_response(response):
+        try:
+            if response.request.resource_type not in ('fetch', 'xhr'):
+                return
+            if 'json' not in response.headers.get('content-type', ''):
+                return
+            captured.append(response)
+        except Exception:
+            pass
+
+    page.on('response', on_response)
+    return captured
+
+
+def get_plans_from_responses(captured, plan_map):
+    """
+    記録したレスポンス（JSON/GraphQL）からプランごとの価格を取り出す。
+    既知のプランIDが1件も見つからない場合は空リストを返す（DOMにフォールバック）。
+    """
+    if not captured or not plan_map:
+        return []
+    payloads = []
+    # 新しいレスポンスの値を優先
+    for response in reversed(captured):
+        try:
+            payloads.append(response.json())
+        except Exception:
+            continue
+    return plans_from_payloads(payloads, plan_map)
+
+
+def plans_from_payloads(payloads, plan_map):
+    """レスポンス本文（新しい順）からプランごとの価格を取り出す（同期版・非同期版で共用）"""
+    plan_ids = {str(p['id']) for p in plan_map.values() if p.get('id')}
+    if not plan_ids:
+        return []
+
+    prices = {}
+    for payload in payloads:
+        for pid, price in extract_plan_prices(payload, plan_ids).items():
+            prices.setdefault(pid, price)
+
+    plans = []
+    for plan in plan_map.values():
+        pid = str(plan.get('id', ''))
+        if pid in prices:
+            plans.append({'id': plan['id'], 'name': plan['name'], 'value': prices[pid]})
+    return plans
+
+
+def extract_plan_prices(payload, plan_ids):
+    """
+    JSON（ページの通信レスポンス）を走査し、既知のプランIDを持つオブジェクトから価格を抽出する。
+    同じプランに異なる価格が見つかった場合は、どれが正しいか判断できないため空の dict を返す。
+    """
+    found = {}
+    for node in _iter_dicts(payload):
+        plan_ref = node.get('plan')
+        pid = node.get('planId') or (plan_ref.get('id') if isinstance(plan_ref, dict) else None) or node.get('id')
+        if pid is None or str(pid) not in plan_ids:
+            continue
+        price = _find_price(node)
+        if price is None:
+            continue
+        if found.get(str(pid), price) != price:
+            return {}
+        found[str(pid)] = price
+    return found
+
+
+def _iter_dicts(payload):
+    """JSON 内の全オブジェクトを順に返す"""
+    stack = [payload]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            yield node
+            stack.extend(reversed(list(node.values())))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+
+
+def _find_price(node):
+    """価格フィールドを優先順位に従って数値化する（{amount: ...} 形式にも対応）"""
+    for key in PRICE_KEYS:
+        value = node.get(key)
+        if isinstance(value, dict):
+            value = value.get('amount', value.get('value'))
+        if isinstance(value, bool) or value is None:
+            continue
+        if isinstance(value, (int, float)):
+            return int(value)
+        if isinstance(value, str):
+            digits = ''.join(filter(str.isdigit, value))
+            if digits:
+                return int(digits)
+    return None
 
 
 def get_available_plans_with_priority(page):
     """プラン要素から名前と価格を抽出（価格の優先順位付き）"""
+    try:
+        rows = page.eval_on_selector_all('ul.css-n9qrp8 > li', PLAN_ROWS_JS)
+    except Exception:
+        return []
+    return parse_plan_rows(rows)
+
+
+def parse_plan_rows(rows):
+    """PLAN_ROWS_JS の結果をプランのリストにする（価格を数値に変換、数値にできない行は除く）"""
     plans = []
-    els = page.query_selector_all('ul.css-n9qrp8 > li')
-    for el in els:
+    for row in rows:
+        price = row.get('price') or '0'
+        digits = ''.join(filter(str.isdigit, price))
+        if not digits:
+            continue
+        plans.append({'name': row.get('name', ''), 'value': int(digits)})
+    return plans
+
+
+
+# ===== asyncio 実行モード（EXECUTION_MODE=async）=====
+# 同期版と同じ処理を playwright.async_api で行う。ページ操作以外の判定・整形は同期版の関数を共用する。
+
+async def scrape_hourly_prices_async(context, original_url, days=7, offset_days=0, tabs=None, on_date=None,
+                                     done_dates=(), should_stop=None):
+    """
+    scrape_hourly_prices の非同期版（context は呼び出し側で用意・破棄する）。
+    1日分のアイテムを取得するたびに await on_date(日付 YYYY-MM-DD, items) を呼び、取得件数を返す。
+    should_stop() が True を返した時点で、次の日付を始めずに打ち切る。
+    """
+    now_jst = datetime.now(JST)
+    tabs = max(1, min(tabs or DATE_SCAN_TABS, days))
+    page = await context.new_page()
+
+    try:
+        # URL形式を判定して、roomUidとspaceIdを抽出
+        room_uid, space_id_from_url = parse_room_url(original_url)
+
+        # 1) トップページにアクセス（/p/ 形式はリダイレクト後の URL から spaceId を取得）
+        resp = await page.goto(original_url, wait_until='networkidle', timeout=90000)
+        if not resp.ok:
+            raise Exception(f"ページロードエラー: {resp.status} {resp.status_text}")
+        if space_id_from_url is None:
+            space_id_from_url = extract_space_id_from_redirect(page.url)
+
+        # 2) 予約ページ URL を組み立てて遷移
+        reservation_url = build_reservation_url(space_id_from_url, room_uid)
+        await open_reservation_page_async(page, reservation_url)
+
+        # JSONデータを取得（spaceId とプラン情報）
         try:
-            # プラン名
-            n_el = el.query_selector('span.css-k6zetj')
-            name = n_el.inner_text() if n_el else el.inner_text()
-            
-            # 価格取得（優先順位に従って取得）
-            price = "0"
-            price_el = el.query_selector(".css-1y4ezd0")
-            if price_el:
-                price = price_el.inner_text()
-            else:
-                price_el = el.query_selector(".css-d362cm")
-                if price_el:
-                    price = price_el.inner_text()
-                else:
-                    price_el = el.query_selector(".css-1sq1blk")
-                    if price_el:
-                        price = price_el.inner_text()
-            
-            # 価格を数値に変換
-            val = int(''.join(filter(str.isdigit, price))) if price else 0
-            plans.append({'name': name, 'value': val})
+            script_el = await page.query_selector('script#__NEXT_DATA__')
+            space_id, plan_map = parse_next_data(await script_el.inner_text() if script_el else None)
+        except Exception as e:
+            print(f"JSON取得エラー: {e}")
+            space_id, plan_map = space_id_from_url, {}
+
+        # スペース名を取得
+        space_name = ''
+        try:
+            name_el = await page.query_selector('p.css-4mpmt5')
+            space_name = await name_el.inner_text() if name_el else ''
         except:
+            space_name = ''
+
+        # 対象日付リスト（処理済みの日付を除く）
+        dates = target_dates(days, offset_days)
+        indices = pending_date_indices(dates, done_dates, offset_days)
+        scan = new_scan(space_id, space_name, plan_map, original_url, now_jst, offset_days)
+
+        # 日付リストを連続区間に分割し、追加タブも予約ページで初期化してから並行処理
+        chunks = split_date_indices(indices, tabs)
+        extra_pages = [await context.new_page() for _ in chunks[1:]]
+        await asyncio.gather(*(open_reservation_page_async(p, reservation_url) for p in extra_pages))
+        counts = await asyncio.gather(*(
+            scan_dates_async(p, dates, indices, scan, on_date, should_stop)
+            for p, indices in zip([page] + extra_pages, chunks)
+        ))
+        item_count = sum(counts)
+
+        print_scan_summary(scan, item_count)
+
+    except Exception as e:
+        print(f"スクレイピングエラー ({original_url}): {e}")
+        raise e
+
+    return item_count
+
+
+async def open_reservation_page_async(page, reservation_url):
+    """open_reservation_page の非同期版"""
+    await page.add_init_script(WAIT_HOOK_SCRIPT)
+    resp = await page.goto(reservation_url, wait_until='networkidle', timeout=90000)
+    if not resp.ok:
+        raise Exception(f"予約ページロードエラー: {resp.status} {resp.status_text}")
+    try:
+        await page.wait_for_selector('select[aria-label="開始時"]', timeout=WAIT_TIMEOUT_MS)
+    except Exception as e:
+        print(f"時刻ドロップダウン待機エラー: {e}")
+    await wait_for_page_ready_async(page)
+
+
+async def scan_dates_async(page, dates, date_indices, scan, on_date=None, should_stop=None):
+    """
+    scan_dates の非同期版（scan_steps の手順を非同期 API で実行する）。
+    1日分ごとに await on_date(日付, items) を呼び、取得件数を返す。
+    should_stop() が True を返した場合は残りの日付を処理しない。
+    """
+    captured = start_response_capture(page) if RATE_CAPTURE_MODE == 'network' and scan['plan_map'] else None
+    steps = scan_steps(dates, date_indices, scan, captured is not None, should_stop)
+    item_count = 0
+    result = None
+    while True:
+        try:
+            step = steps.send(result)
+        except StopIteration:
+            return item_count
+        result = None
+        if step[0] == 'date':
+            item_count += len(step[2])
+            if on_date:
+                await on_date(dates[step[1]].strftime('%Y-%m-%d'), step[2])
+        elif step[0] == 'wait':
+            await wait_for_page_ready_async(page, step[1])
+        else:
+            result = await run_step_async(page, step, captured, scan['plan_map'])
+
+
+async def run_step_async(page, step, captured, plan_map):
+    """run_step の非同期版"""
+    op = step[0]
+    if op == 'click_date':
+        try:
+            return await calendar_nav.click_date_async(
+                page, step[1], step[2], snapshot_page_async, wait_for_page_ready_async
+            )
+        except Exception as e:
+            print(f"日付選択エラー: {calendar_nav.date_label(step[2])} - {e}")
+            return None
+    if op == 'hours':
+        return await get_available_hours_async(page)
+    if op == 'select_time':
+        if captured is not None:
+            captured.clear()
+        return await select_time_range_async(page, step[1], 0, step[1] + 1, 0)
+    if op == 'network_plans':
+        return await get_plans_from_responses_async(captured, plan_map)
+    if op == 'dom_plans':
+        return await get_available_plans_with_priority_async(page)
+    raise ValueError(f"不明な操作: {op}")
+
+
+async def snapshot_page_async(page):
+    """snapshot_page の非同期版"""
+    try:
+        return await page.evaluate(PAGE_SNAPSHOT_JS)
+    except Exception:
+        return {'sig': None, 't': 0}
+
+
+async def wait_for_page_ready_async(page, snapshot=None, timeout_ms=None):
+    """wait_for_page_ready の非同期版"""
+    snapshot = snapshot or {'sig': None, 't': 0}
+    try:
+        await page.wait_for_function(
+            PAGE_READY_JS,
+            arg=[snapshot.get('sig'), snapshot.get('t', 0), WAIT_QUIET_MS],
+            polling=50,
+            timeout=timeout_ms or WAIT_TIMEOUT_MS
+        )
+        return True
+    except Exception as e:
+        print(f"画面更新待ちタイムアウト: {e}")
+        return False
+
+
+async def get_available_hours_async(page):
+    """get_available_hours の非同期版"""
+    try:
+        opts = await page.locator('select[aria-label="開始時"]').evaluate(
+            '(el) => Array.from(el.options).map(o=>({v:parseInt(o.value), d:o.disabled}))'
+        )
+        return [o['v'] for o in opts if not o['d']]
+    except:
+        return []
+
+
+async def select_time_range_async(page, sh, sm, eh, em):
+    """select_time_range の非同期版"""
+    try:
+        snapshot = await snapshot_page_async(page)
+        await page.locator('select[aria-label="開始時"]').select_option(value=str(sh))
+        await page.locator('select[aria-label="開始分"]').select_option(value=f"{sm:02d}")
+        await page.locator('select[aria-label="終了時"]').select_option(value=str(eh))
+        await page.locator('select[aria-label="終了分"]').select_option(value=f"{em:02d}")
+        return snapshot
+    except:
+        return None
+
+
+async def get_plans_from_responses_async(captured, plan_map):
+    """get_plans_from_responses の非同期版"""
+    if not captured or not plan_map:
+        return []
+    payloads = []
+    for response in reversed(captured):
+        try:
+            payloads.append(await response.json())
+        except Exception:
             continue
-    return plans
+    return plans_from_payloads(payloads, plan_map)
+
+
+async def get_available_plans_with_priority_async(page):
+    """get_available_plans_with_priority の非同期版"""
+    try:
+        rows = await page.eval_on_selector_all('ul.css-n9qrp8 > li', PLAN_ROWS_JS)
+    except Exception:
+        return []
+    return parse_plan_rows(rows)
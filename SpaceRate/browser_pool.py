@@ -0,0 +1,119 @@
+import os
+from contextlib import contextmanager
+from playwright.sync_api import sync_playwright
+import resource_blocker
+
+# Chromium をモジュール単位で保持し、URL間・ウォームスタート間で使い回すためのブラウザ管理。
+# URLごとに新しい BrowserContext を払い出し、一定ページ数またはメモリ使用量を超えたらブラウザを再起動する。
+# 起動オプション・再起動の条件は async_runner（EXECUTION_MODE=async のブラウザ管理）と共用する。
+
+LAUNCH_ARGS = [
+    "--single-process",
+    "--no-zygote",
+    "--no-sandbox",
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--headless=new",
+    "--disable-http2",
+]
+
+USER_AGENT = (
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) '
+    'AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/112.0.0.0 Safari/537.36'
+)
+
+# このページ数を開いたらブラウザを再起動（メモリリーク対策）
+MAX_PAGES_PER_BROWSER = int(os.environ.get('BROWSER_MAX_PAGES', '50'))
+
+# プロセス全体のメモリ使用量(MB)がこれを超えたら再起動。未指定時は Lambda のメモリ設定の70%
+_lambda_memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '0'))
+MAX_MEMORY_MB = int(os.environ.get('BROWSER_MAX_MEMORY_MB', str(int(_lambda_memory_mb * 0.7))))
+
+_playwright = None
+_browser = None
+_pages_opened = 0
+
+
+def get_browser():
+    """起動済みのブラウザを返す（未起動・切断・再起動条件に該当する場合は起動し直す）"""
+    global _playwright, _browser, _pages_opened
+
+    if _browser is not None:
+        reason = restart_reason(_browser, _pages_opened)
+        if reason:
+            print(reason)
+            close_browser()
+
+    if _browser is None:
+        if _playwright is None:
+            _playwright = sync_playwright().start()
+        _browser = _playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        _pages_opened = 0
+    return _browser
+
+
+def restart_reason(browser, pages_opened):
+    """ブラウザを再起動すべき理由（切断・使用ページ数・メモリ使用量）を返す。再起動が不要なら None"""
+    if not browser.is_connected():
+        return "ブラウザが切断されているため再起動します"
+    if pages_opened >= MAX_PAGES_PER_BROWSER:
+        return f"ブラウザ再起動: {pages_opened}ページ使用"
+    if MAX_MEMORY_MB and _process_memory_mb() >= MAX_MEMORY_MB:
+        return f"ブラウザ再起動: メモリ使用量が{MAX_MEMORY_MB}MBを超過"
+    return None
+
+
+@contextmanager
+def browser_context(label='', **kwargs):
+    """URL 1件分の新しい BrowserContext を払い出し、使用後に閉じる（不要なリソースはブロックする）"""
+    kwargs.setdefault('user_agent', USER_AGENT)
+    context = get_browser().new_context(**kwargs)
+    context.on('page', _count_page)
+    block_stats = resource_blocker.install(context)
+    try:
+        yield context
+    finally:
+        resource_blocker.report(block_stats, label)
+        try:
+            context.close()
+        except Exception as e:
+            # コンテキストが閉じられない場合はブラウザごと作り直す
+            print(f"コンテキストのクローズに失敗: {e}")
+            close_browser()
+
+
+def close_browser():
+    """ブラウザを終了する（Playwright 本体は次回の起動に使い回す）"""
+    global _browser
+    if _browser is not None:
+        try:
+            _browser.close()
+        except Exception:
+            pass
+        _browser = None
+
+
+def _count_page(page):
+    global _pages_opened
+    _pages_opened += 1
+
+
+def _process_memory_mb():
+    """コンテナ内の全プロセスの常駐メモリ(MB)を合計（Chromium 子プロセスを含む）"""
+    total_kb = 0
+    try:
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total_kb += int(line.split()[1])
+                            break
+            except (OSError, ValueError):
+                continue
+    except OSError:
+        return 0
+    return total_kb // 1024
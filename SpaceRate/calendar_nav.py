@@ -0,0 +1,124 @@
+import os
+
+# 予約ページのカレンダーで目的の日付を選択するためのナビゲーション。
+# 表示中の月をページごとの nav（dict）に保持し、目的の月までの「次の月」「前の月」クリック回数を計算して移動する。
+# 日付ごとにボタンの有無を問い合わせず、日付ボタンを1回クリックするだけで選択できる。
+
+NEXT_MONTH_SELECTOR = 'button[aria-label="次の月"]'
+PREV_MONTH_SELECTOR = 'button[aria-label="前の月"]'
+
+# 日付ボタン・月移動ボタンのクリック待ちの上限（無効な日付で長く待たないように短めにする）
+CLICK_TIMEOUT_MS = int(os.environ.get('CALENDAR_CLICK_TIMEOUT_MS', '3000'))
+
+# この数以上の日付ボタンがある月を「表示中」とみなす（前後の月の埋め草の日付を除くため）
+MIN_BUTTONS_PER_MONTH = 20
+
+# 表示中の月の一覧を ["YYYY-M", ...] で返す
+DISPLAYED_MONTHS_JS = """
+(minButtons) => {
+  const counts = {};
+  for (const b of document.querySelectorAll('button[aria-label]')) {
+    const m = b.getAttribute('aria-label').match(/^(\\d{4})年(\\d{1,2})月(\\d{1,2})日$/);
+    if (m) {
+      const key = m[1] + '-' + m[2];
+      counts[key] = (counts[key] || 0) + 1;
+    }
+  }
+  return Object.keys(counts).filter(k => counts[k] >= minButtons);
+}
+"""
+
+
+def date_label(date_obj):
+    """日付ボタンの aria-label（例: 2025年6月1日）"""
+    return f"{date_obj.year}年{date_obj.month}月{date_obj.day}日"
+
+
+def reset(nav):
+    """表示中の月のキャッシュを破棄する（次回は画面から読み直す）"""
+    nav.clear()
+
+
+def click_date(page, nav, target_date, before=None, after=None):
+    """
+    target_date の月まで移動して日付ボタンを1回クリックする。
+    before(page) は各クリックの直前、after(page, before の戻り値) は月移動クリックの直後に呼ぶ。
+    日付ボタンのクリック直前の before の戻り値を返す（日付クリック後の待機は呼び出し側で行う）。
+    失敗した場合は表示中の月を読み直して1回だけやり直し、それでも失敗したら例外を送出する。
+    """
+    for attempt in range(2):
+        try:
+            if 'months' not in nav:
+                nav['months'] = _parse_months(page.evaluate(DISPLAYED_MONTHS_JS, MIN_BUTTONS_PER_MONTH))
+            # 表示中の月が読み取れない場合は、やり直し時に「次の月」を1回だけ試す
+            steps = month_steps(nav, target_date) if nav['months'] or not attempt else 1
+            selector = NEXT_MONTH_SELECTOR if steps > 0 else PREV_MONTH_SELECTOR
+            for _ in range(abs(steps)):
+                state = before(page) if before else None
+                page.locator(selector).click(timeout=CLICK_TIMEOUT_MS)
+                if after:
+                    after(page, state)
+            _shift(nav, steps)
+
+            state = before(page) if before else None
+            page.locator(f'button[aria-label="{date_label(target_date)}"]').click(timeout=CLICK_TIMEOUT_MS)
+            return state
+        except Exception:
+            reset(nav)
+            if attempt:
+                raise
+
+
+async def click_date_async(page, nav, target_date, before=None, after=None):
+    """click_date の非同期版（before / after はコルーチン関数）"""
+    for attempt in range(2):
+        try:
+            if 'months' not in nav:
+                nav['months'] = _parse_months(await page.evaluate(DISPLAYED_MONTHS_JS, MIN_BUTTONS_PER_MONTH))
+            # 表示中の月が読み取れない場合は、やり直し時に「次の月」を1回だけ試す
+            steps = month_steps(nav, target_date) if nav['months'] or not attempt else 1
+            selector = NEXT_MONTH_SELECTOR if steps > 0 else PREV_MONTH_SELECTOR
+            for _ in range(abs(steps)):
+                state = await before(page) if before else None
+                await page.locator(selector).click(timeout=CLICK_TIMEOUT_MS)
+                if after:
+                    await after(page, state)
+            _shift(nav, steps)
+
+            state = await before(page) if before else None
+            await page.locator(f'button[aria-label="{date_label(target_date)}"]').click(timeout=CLICK_TIMEOUT_MS)
+            return state
+        except Exception:
+            reset(nav)
+            if attempt:
+                raise
+
+
+def month_steps(nav, target_date):
+    """
+    表示中の月から target_date の月までの移動回数（正: 次の月、負: 前の月、0: 表示中）。
+    表示中の月が分からない場合は 0（まず日付ボタンのクリックを試す）。
+    """
+    months = nav.get('months') or []
+    if not months:
+        return 0
+    target = target_date.year * 12 + target_date.month - 1
+    if target < months[0]:
+        return target - months[0]
+    if target > months[-1]:
+        return target - months[-1]
+    return 0
+
+
+def _shift(nav, steps):
+    if steps and nav.get('months'):
+        nav['months'] = [m + steps for m in nav['months']]
+
+
+def _parse_months(keys):
+    """["YYYY-M", ...] を年×12+月-1 の昇順リストにする"""
+    months = []
+    for key in keys or []:
+        year, month = key.split('-')
+        months.append(int(year) * 12 + int(month) - 1)
+    return sorted(months)
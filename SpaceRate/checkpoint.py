@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+import boto3
+
+# 長時間ジョブの途中経過（URLごとの処理済み日付）を記録するチェックポイント。
+# SQS の再配信時に処理済みの日付を飛ばして、残りの日付だけを処理する。
+# CHECKPOINT_TABLE を指定した場合は DynamoDB（パーティションキー checkpoint_id、TTL 属性 expire_at）、
+# 未指定の場合は /tmp の JSON ファイル（同じコンテナへの再配信のみ有効なローカル代替）に保存する。
+
+JST = timezone(timedelta(hours=9))
+
+# 'on' = チェックポイントを使う、'off' = 使わない
+CHECKPOINT_MODE = os.environ.get('CHECKPOINT_MODE', 'on')
+CHECKPOINT_TABLE = os.environ.get('CHECKPOINT_TABLE', '')
+CHECKPOINT_FILE = os.environ.get('CHECKPOINT_FILE', '/tmp/checkpoints.json')
+
+# チェックポイントの保持期間（SQS の再配信期間より長ければよい）
+CHECKPOINT_TTL_SECONDS = int(os.environ.get('CHECKPOINT_TTL_SECONDS', str(2 * 24 * 3600)))
+
+# DynamoDB クライアント（書き込みスレッドからも使うため、スレッドセーフなクライアントを使用）
+_client = None
+_file_lock = threading.Lock()
+
+
+def is_enabled():
+    return CHECKPOINT_MODE != 'off'
+
+
+def job_id_for_record(record):
+    """
+    SQS レコードのジョブID（再配信でも変わらない messageId を使う）。
+    時間切れで再投入されたメッセージは、本文の checkpoint_job（元のジョブID）を引き継ぐ。
+    """
+    try:
+        body = json.loads(record.get('body') or '{}')
+    except ValueError:
+        body = {}
+    if isinstance(body, dict) and body.get('checkpoint_job'):
+        return body['checkpoint_job']
+    if record.get('messageId'):
+        return record['messageId']
+    return job_id_for_body(record.get('body', ''))
+
+
+def job_id_for_request(params):
+    """
+    SQS 以外の呼び出しのジョブID。呼び出し側が checkpoint_job を指定した場合はそれを使い、
+    resume: true の場合は同じ内容の同日中の呼び出しを同じジョブとみなす。
+    どちらもなければ None（チェックポイントを使わず、毎回全日付を処理する）
+    """
+    if params.get('checkpoint_job'):
+        return params['checkpoint_job']
+    if params.get('resume') is True:
+        return job_id_for_body(params)
+    return None
+
+
+def job_id_for_body(body):
+    """本文から求めるジョブID（同じ内容の同日中の再実行を同じジョブとみなす）"""
+    text = body if isinstance(body, str) else json.dumps(body, sort_keys=True, ensure_ascii=False)
+    today = datetime.now(JST).strftime('%Y-%m-%d')
+    return hashlib.sha1(f"{today}#{text}".encode('utf-8')).hexdigest()[:16]
+
+
+def load(job_id, url):
+    """処理済みの日付（YYYY-MM-DD）の集合を返す（無効時・取得失敗時は空）"""
+    if not is_enabled() or not job_id:
+        return set()
+    checkpoint_id = _checkpoint_id(job_id, url)
+    try:
+        if CHECKPOINT_TABLE:
+            resp = _get_client().get_item(
+                TableName=CHECKPOINT_TABLE,
+                Key={'checkpoint_id': {'S': checkpoint_id}},
+                ConsistentRead=True
+            )
+            return set(resp.get('Item', {}).get('dates', {}).get('SS', []))
+        with _file_lock:
+            entry = _read_file().get(checkpoint_id) or {}
+        return set(entry.get('dates', []))
+    except Exception as e:
+        print(f"チェックポイント取得エラー ({url}): {e}")
+        return set()
+
+
+def mark(job_id, url, dates):
+    """日付（YYYY-MM-DD）を処理済みとして記録する"""
+    dates = [d for d in dates if d]
+    if not is_enabled() or not job_id or not dates:
+        return
+    checkpoint_id = _checkpoint_id(job_id, url)
+    expire_at = int(time.time()) + CHECKPOINT_TTL_SECONDS
+    try:
+        if CHECKPOINT_TABLE:
+            _get_client().update_item(
+                TableName=CHECKPOINT_TABLE,
+                Key={'checkpoint_id': {'S': checkpoint_id}},
+                UpdateExpression='ADD dates :d SET expire_at = :e, #u = :u',
+                ExpressionAttributeNames={'#u': 'url'},
+                ExpressionAttributeValues={
+                    ':d': {'SS': sorted(set(dates))},
+                    ':e': {'N': str(expire_at)},
+                    ':u': {'S': url},
+                }
+            )
+            return
+        with _file_lock:
+            data = _read_file()
+            now = int(time.time())
+            # 期限切れのエントリを削除
+            data = {k: v for k, v in data.items() if v.get('expire_at', 0) > now}
+            entry = data.setdefault(checkpoint_id, {'dates': []})
+            entry['dates'] = sorted(set(entry['dates']) | set(dates))
+            entry['expire_at'] = expire_at
+            with open(CHECKPOINT_FILE, 'w') as f:
+                json.dump(data, f)
+    except Exception as e:
+        print(f"チェックポイント記録エラー ({url}): {e}")
+
+
+def _checkpoint_id(job_id, url):
+    return f"{job_id}#{url}"
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = boto3.client('dynamodb')
+    return _client
+
+
+def _read_file():
+    try:
+        with open(CHECKPOINT_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
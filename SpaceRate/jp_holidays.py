@@ -0,0 +1,170 @@
+from datetime import date, timedelta
+
+# 「国民の祝日に関する法律」に基づく日本の祝日・振替休日・国民の休日の計算（外部APIを使わない）。
+# 年単位で計算した結果を日付の序数（date.toordinal()）を添字とするビット列に展開し、
+# is_holiday は文字列変換なしの O(1) で判定する。
+# 春分日・秋分日は天文計算の近似式（1900〜2150年）で求めるため、官報告示前の将来年は予測値となる。
+
+# 法律施行後の最初の年
+FIRST_YEAR = 1949
+
+# 皇室行事・改元などによる1回限りの休日
+SPECIAL_HOLIDAYS = (
+    date(1959, 4, 10),   # 皇太子明仁親王の結婚の儀
+    date(1989, 2, 24),   # 昭和天皇の大喪の礼
+    date(1990, 11, 12),  # 即位礼正殿の儀
+    date(1993, 6, 9),    # 皇太子徳仁親王の結婚の儀
+    date(2019, 4, 30),   # 国民の休日（天皇の即位の日の前日）
+    date(2019, 5, 1),    # 天皇の即位の日
+    date(2019, 5, 2),    # 国民の休日（天皇の即位の日の翌日）
+    date(2019, 10, 22),  # 即位礼正殿の儀
+)
+
+# 計算済みの範囲（年）とビット列
+_base_ordinal = None
+_first_year = None
+_last_year = None
+_bits = bytearray()
+
+
+def is_holiday(date_obj):
+    """祝日・振替休日・国民の休日なら True（date / datetime どちらでも可）"""
+    offset = date_obj.toordinal() - _base_ordinal if _base_ordinal is not None else -1
+    if offset < 0 or offset >= len(_bits) * 8:
+        _ensure_year(date_obj.year)
+        offset = date_obj.toordinal() - _base_ordinal
+    return (_bits[offset >> 3] >> (offset & 7)) & 1 == 1
+
+
+def holidays_for_year(year):
+    """指定年の休日（date）の集合を返す"""
+    if year < FIRST_YEAR:
+        return set()
+    named = _named_holidays(year)
+    days = set(named)
+
+    # 国民の休日: 前日と翌日が祝日の平日（1985年12月27日施行）
+    for d in sorted(named):
+        between = d + timedelta(days=1)
+        if (between + timedelta(days=1)) in named and between not in named and between >= date(1985, 12, 27):
+            # 2006年までは日曜日を除く
+            if year >= 2007 or between.weekday() != 6:
+                days.add(between)
+
+    # 振替休日（1973年4月12日施行）
+    for d in sorted(named):
+        if d.weekday() != 6 or d < date(1973, 4, 12):
+            continue
+        substitute = d + timedelta(days=1)
+        if year >= 2007:
+            # 祝日でない最も近い日
+            while substitute in named:
+                substitute += timedelta(days=1)
+            days.add(substitute)
+        elif substitute not in named:
+            days.add(substitute)
+
+    days.update(d for d in SPECIAL_HOLIDAYS if d.year == year)
+    return days
+
+
+def _named_holidays(year):
+    """指定年の「国民の祝日」（振替休日・国民の休日を除く）"""
+    days = {date(year, 1, 1), date(year, 5, 3), date(year, 5, 5), date(year, 11, 3), date(year, 11, 23)}
+
+    # 成人の日
+    days.add(_nth_monday(year, 1, 2) if year >= 2000 else date(year, 1, 15))
+    # 建国記念の日
+    if year >= 1967:
+        days.add(date(year, 2, 11))
+    # 天皇誕生日
+    if year <= 1988:
+        days.add(date(year, 4, 29))
+    elif year <= 2018:
+        days.add(date(year, 12, 23))
+    elif year >= 2020:
+        days.add(date(year, 2, 23))
+    # 春分の日・秋分の日
+    days.add(date(year, 3, _vernal_equinox_day(year)))
+    days.add(date(year, 9, _autumnal_equinox_day(year)))
+    # みどりの日・昭和の日
+    if 1989 <= year <= 2006:
+        days.add(date(year, 4, 29))
+    elif year >= 2007:
+        days.add(date(year, 4, 29))
+        days.add(date(year, 5, 4))
+    # 海の日
+    if year == 2020:
+        days.add(date(2020, 7, 23))
+    elif year == 2021:
+        days.add(date(2021, 7, 22))
+    elif year >= 2003:
+        days.add(_nth_monday(year, 7, 3))
+    elif year >= 1996:
+        days.add(date(year, 7, 20))
+    # 山の日
+    if year == 2020:
+        days.add(date(2020, 8, 10))
+    elif year == 2021:
+        days.add(date(2021, 8, 8))
+    elif year >= 2016:
+        days.add(date(year, 8, 11))
+    # 敬老の日
+    if year >= 2003:
+        days.add(_nth_monday(year, 9, 3))
+    elif year >= 1966:
+        days.add(date(year, 9, 15))
+    # 体育の日・スポーツの日
+    if year == 2020:
+        days.add(date(2020, 7, 24))
+    elif year == 2021:
+        days.add(date(2021, 7, 23))
+    elif year >= 2000:
+        days.add(_nth_monday(year, 10, 2))
+    elif year >= 1966:
+        days.add(date(year, 10, 10))
+    return days
+
+
+def _nth_monday(year, month, n):
+    first = date(year, month, 1)
+    return first + timedelta(days=(7 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _vernal_equinox_day(year):
+    if year <= 1979:
+        return int(20.8357 + 0.242194 * (year - 1980) - int((year - 1983) / 4))
+    if year <= 2099:
+        return int(20.8431 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+    return int(21.8510 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+
+
+def _autumnal_equinox_day(year):
+    if year <= 1979:
+        return int(23.2588 + 0.242194 * (year - 1980) - int((year - 1983) / 4))
+    if year <= 2099:
+        return int(23.2488 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+    return int(24.2488 + 0.242194 * (year - 1980) - int((year - 1980) / 4))
+
+
+def _ensure_year(year):
+    """year を含むようにビット列の範囲を広げて再計算する"""
+    global _base_ordinal, _first_year, _last_year, _bits
+    first = year if _first_year is None else min(_first_year, year)
+    last = year if _last_year is None else max(_last_year, year)
+    # 前後1年を含めて計算（年末年始をまたぐ日付の再計算を減らす）
+    first, last = first - 1, last + 1
+
+    base = date(first, 1, 1).toordinal()
+    bits = bytearray((date(last + 1, 1, 1).toordinal() - base + 7) // 8)
+    for y in range(first, last + 1):
+        for d in holidays_for_year(y):
+            offset = d.toordinal() - base
+            bits[offset >> 3] |= 1 << (offset & 7)
+
+    _base_ordinal, _first_year, _last_year, _bits = base, first, last, bits
+
+
+# 現在前後の年を読み込み時に計算しておく（通常のスキャン範囲では再計算が起きない）
+_ensure_year(date.today().year)
+_ensure_year(date.today().year + 2)
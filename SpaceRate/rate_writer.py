@@ -0,0 +1,501 @@
+import os
+import time
+import random
+import json
+import hashlib
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
+import boto3
+
+# SpaceRate テーブルへの書き込みをまとめて行うライター。
+# 25件単位の BatchWriteItem で書き込み、同一キー（spaceId, rate_key）は後勝ちで1件にまとめる。
+# 未処理分（UnprocessedItems）は指数バックオフで再送する。
+
+TABLE_NAME = os.environ.get('TABLE_NAME', 'SpaceRate')
+
+# BatchWriteItem の1回あたりの上限件数
+BATCH_SIZE = 25
+
+# UnprocessedItems の再送回数とバックオフの基準秒数
+MAX_RETRIES = int(os.environ.get('WRITE_MAX_RETRIES', '8'))
+BACKOFF_BASE_SECONDS = float(os.environ.get('WRITE_BACKOFF_BASE', '0.05'))
+BACKOFF_MAX_SECONDS = 5.0
+
+# 日付×プランごとの価格ダイジェスト行の rate_key 接頭辞（時間別アイテムと同じテーブルに保存）
+DIGEST_PREFIX = 'DIGEST#'
+
+# 変更の判定に含めない（スキャンのたびに変わる）属性
+VOLATILE_ITEM_KEYS = ('created_at', 'scan_date', 'forecast_days')
+
+# スペースごとのデータ版数の行（ソートキーの値）。価格を書き込むたびに版数を進め、読み取り側のキャッシュ無効化に使う
+VERSION_KEY = 'VERSION'
+
+# 日別レイアウトのテーブル（1アイテム = spaceId × 日付 × プラン、24時間分の価格配列）
+DAILY_TABLE_NAME = os.environ.get('DAILY_TABLE_NAME', 'SpaceRateDaily')
+DAILY_SLOTS = 24
+
+# 日別アイテムに時間別アイテムから引き継ぐ属性
+DAILY_META_KEYS = ('planDisplayName', 'name', 'url', 'day_type', 'created_at', 'scan_date', 'forecast_days')
+
+# 集計テーブル（1アイテム = spaceId × 週 × day_type × プラン、時間ごとの価格の合計 hXX_sum と件数 hXX_cnt）
+# 'on' の場合、write_changed_items がダイジェストの前回価格との差分を集計テーブルに ADD する
+# （ダイジェストを使うため STORAGE_LAYOUT が legacy / both かつ SKIP_UNCHANGED_PRICES=on のときだけ更新される）
+AGG_TABLE_NAME = os.environ.get('AGG_TABLE_NAME', 'SpaceRateAgg')
+AGGREGATE_MODE = os.environ.get('AGGREGATE_MODE', 'off')
+
+# BatchGetItem の1回あたりの上限件数
+GET_BATCH_SIZE = 100
+
+# バックグラウンド書き込みのキューに溜められる件数（1件 = 1日分のアイテム）。満杯ならスクレイピング側が待つ
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', '4'))
+
+# DynamoDB リソース（Lambda のウォームスタート間で再利用）
+_dynamodb = None
+
+
+def get_dynamodb():
+    """DynamoDB リソースを取得（モジュール内で使い回す）"""
+    global _dynamodb
+    if _dynamodb is None:
+        _dynamodb = boto3.resource('dynamodb')
+    return _dynamodb
+
+
+def dedupe_items(items, key_names=('spaceId', 'rate_key')):
+    """同一キーのアイテムを後勝ちで1件にまとめる（出現順は最初の位置を維持）"""
+    unique = {}
+    for item in items:
+        unique[tuple(item.get(k) for k in key_names)] = item
+    return list(unique.values())
+
+
+def write_items(items, table_name=None):
+    """
+    アイテムを BatchWriteItem で書き込む。
+    戻り値: {'items', 'written', 'duplicates', 'batches', 'retries', 'elapsed_ms'}
+    再送上限を超えて未処理が残った場合は例外を送出する。
+    """
+    table_name = table_name or TABLE_NAME
+    started = time.monotonic()
+    unique_items = dedupe_items(items)
+    stats = {
+        'items': len(items),
+        'written': 0,
+        'duplicates': len(items) - len(unique_items),
+        'batches': 0,
+        'retries': 0,
+        'elapsed_ms': 0,
+    }
+
+    dynamodb = get_dynamodb()
+    for i in range(0, len(unique_items), BATCH_SIZE):
+        requests = [{'PutRequest': {'Item': item}} for item in unique_items[i:i + BATCH_SIZE]]
+        attempt = 0
+        while requests:
+            stats['batches'] += 1
+            resp = dynamodb.batch_write_item(RequestItems={table_name: requests})
+            unprocessed = resp.get('UnprocessedItems', {}).get(table_name, [])
+            stats['written'] += len(requests) - len(unprocessed)
+            requests = unprocessed
+            if not requests:
+                break
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                stats['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+                raise Exception(f"DynamoDB 書き込み未処理: {len(requests)}件 (stats={stats})")
+            stats['retries'] += 1
+            # 指数バックオフ（ジッター付き）
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+            time.sleep(random.uniform(delay / 2, delay))
+
+    stats['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+    print(f"DynamoDB 書き込み: {stats['written']}/{stats['items']}件 "
+          f"(重複除外 {stats['duplicates']}件, {stats['batches']}リクエスト, "
+          f"再送 {stats['retries']}回, {stats['elapsed_ms']}ms)")
+    return stats
+
+
+def write_changed_items(items, table_name=None):
+    """
+    前回スキャンから価格が変わった時間帯のアイテムだけを書き込む。
+    (spaceId, 日付, planId) ごとにダイジェスト行（時間→価格のマップと、時間→アイテムのハッシュのマップ）を保持し、
+    価格・day_type・表示名など VOLATILE_ITEM_KEYS 以外の属性が全て同じ時間帯は書き込まず、
+    ダイジェスト行の last_verified だけを更新する。
+    ダイジェスト行は更新回数 rev を条件に1行ずつ書き込み、読んだ後に他のジョブ（境界の日付・再投入された日付を
+    同時に処理したジョブ）が更新していた場合は、読み直してから判定・書き込みをやり直す。
+    戻り値: write_items の統計 + {'digests': 更新したダイジェスト数, 'unchanged': 書き込みを省略した件数, 'conflicts': やり直した回数}
+    """
+    table_name = table_name or TABLE_NAME
+    aggregate = AGGREGATE_MODE == 'on'
+    groups = group_items_by_day(items)
+    stored = get_digests(list(groups), table_name)
+    table = get_dynamodb().Table(table_name)
+
+    stats = {'items': len(items), 'written': 0, 'duplicates': 0, 'batches': 0, 'retries': 0, 'elapsed_ms': 0,
+             'digests': 0, 'unchanged': 0, 'conflicts': 0}
+    agg_deltas = {}
+    pending = list(groups)
+    attempt = 0
+    while pending:
+        changed_items = []
+        plans = []
+        for group in pending:
+            space_id, date, plan_id = group
+            hourly = groups[group]
+            digest = stored.get((space_id, digest_key(date, plan_id)), {})
+            old_prices = digest.get('prices', {})
+            old_hashes = digest.get('items', {})
+            prices = dict(old_prices)
+            hashes = dict(old_hashes)
+            unchanged = 0
+            for hh, item in hourly.items():
+                # ハッシュのないダイジェスト（価格だけで比較していた頃のもの）は一度全て書き直す
+                item_hash = item_digest(item)
+                if old_hashes.get(hh) == item_hash:
+                    unchanged += 1
+                else:
+                    changed_items.append(item)
+                prices[hh] = item['price']
+                hashes[hh] = item_hash
+            row = {
+                'spaceId': space_id,
+                'rate_key': digest_key(date, plan_id),
+                'prices': prices,
+                'items': hashes,
+                'rev': int(digest.get('rev', 0)) + 1,
+                'last_verified': max(item.get('created_at', '') for item in hourly.values()),
+            }
+            if aggregate:
+                row['aggregated'] = True
+            plans.append((group, digest, row, unchanged))
+
+        # 時間別アイテムを先に書き込み、成功してからダイジェストを更新する
+        written = write_items(changed_items, table_name)
+        for key in ('written', 'duplicates', 'batches', 'retries', 'elapsed_ms'):
+            stats[key] += written[key]
+
+        conflicts = []
+        for group, digest, row, unchanged in plans:
+            result = put_digest(table, row, digest.get('rev'))
+            stats['batches'] += 1
+            if result is None:
+                conflicts.append(group)
+                continue
+            if not result:
+                # ダイジェストが更新されなかった日は次回のスキャンで同じ差分が出るため、ここでは集計しない
+                continue
+            stats['digests'] += 1
+            stats['unchanged'] += unchanged
+            if aggregate:
+                # 集計済みでないダイジェスト（集計導入前）は、このバッチ以外の時間も含めて
+                # 保存した価格の全時間を新規として数える（ダイジェストは全時間が集計済みとして保存されるため）
+                old_prices = digest.get('prices', {}) if digest.get('aggregated') else {}
+                add_price_deltas(agg_deltas, group[0], group[1], group[2], row['prices'], old_prices,
+                                 next(iter(groups[group].values())))
+
+        pending = conflicts
+        if pending:
+            stats['conflicts'] += 1
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                print(f"ダイジェストの更新が他のジョブと競合し続けたため省略: {len(pending)}件")
+                break
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+            time.sleep(random.uniform(delay / 2, delay))
+            stored.update(get_digests(pending, table_name))
+
+    if agg_deltas:
+        stats['aggregates'] = update_aggregates(agg_deltas)
+    print(f"価格変更なしで書き込み省略: {stats['unchanged']}件 / ダイジェスト更新: {stats['digests']}件"
+          f" (競合による読み直し{stats['conflicts']}回)")
+    return stats
+
+
+def put_digest(table, row, expected_rev):
+    """
+    ダイジェスト行を、読んだ時点の rev のまま（読んだ時点で行がなければ rev がないまま）の場合だけ書き込む。
+    戻り値: 書き込めたら True、他のジョブが先に更新していたら None、その他のエラーは False
+    """
+    try:
+        if expected_rev is None:
+            table.put_item(Item=row, ConditionExpression='attribute_not_exists(rev)')
+        else:
+            table.put_item(Item=row, ConditionExpression='rev = :rev',
+                           ExpressionAttributeValues={':rev': expected_rev})
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    except Exception as e:
+        print(f"ダイジェストの書き込みエラー ({row['spaceId']}, {row['rate_key']}): {e}")
+        return False
+
+
+def bump_versions(space_ids, scan_date, table_name=None, sort_key='rate_key'):
+    """価格を書き込んだスペースの版数を1つ進め、最新の scan_date を記録する（失敗しても書き込みは成功扱い）"""
+    table = get_dynamodb().Table(table_name or TABLE_NAME)
+    updated_at = datetime.now(timezone(timedelta(hours=9))).isoformat()
+    for space_id in sorted(set(space_ids)):
+        try:
+            table.update_item(
+                Key={'spaceId': space_id, sort_key: VERSION_KEY},
+                UpdateExpression='ADD #v :one SET scan_date = :d, updated_at = :u',
+                ExpressionAttributeNames={'#v': 'version'},
+                ExpressionAttributeValues={':one': 1, ':d': scan_date, ':u': updated_at},
+            )
+        except Exception as e:
+            print(f"版数の更新エラー ({space_id}): {e}")
+
+
+def week_start(date):
+    """日付（YYYY-MM-DD）を含む週の月曜日（YYYY-MM-DD）"""
+    day = datetime.strptime(date, '%Y-%m-%d')
+    return (day - timedelta(days=day.weekday())).strftime('%Y-%m-%d')
+
+
+def agg_key(date, day_type, plan_id):
+    """集計テーブルのソートキー（週の月曜日#day_type#planId）"""
+    return f"{week_start(date)}#{day_type}#{plan_id}"
+
+
+def add_price_deltas(agg_deltas, space_id, date, plan_id, prices, old_prices, item):
+    """
+    1日分の価格（{時(HH): price}、保存するダイジェストの価格）を、集計済みの前回価格 old_prices との差分として agg_deltas に加える。
+    新しい時間は合計 +価格・件数 +1、価格が変わった時間は合計 +(新 - 旧)、変わらない時間は何もしない。
+    item: day_type・表示名を取るその日のアイテム
+    """
+    day_type = item.get('day_type', '')
+    for hh, price in prices.items():
+        price = int(price)
+        if hh in old_prices:
+            delta = (price - int(old_prices[hh]), 0)
+        else:
+            delta = (price, 1)
+        if delta == (0, 0):
+            continue
+        row = agg_deltas.setdefault((space_id, agg_key(date, day_type, plan_id)), {
+            'planId': plan_id,
+            'planDisplayName': item.get('planDisplayName', ''),
+            'day_type': day_type,
+            'week_start': week_start(date),
+            'hours': {},
+        })
+        total = row['hours'].setdefault(hh, [0, 0])
+        total[0] += delta[0]
+        total[1] += delta[1]
+
+
+def update_aggregates(agg_deltas, table_name=None):
+    """
+    add_price_deltas でまとめた差分を集計テーブルに ADD する。
+    差分は条件付きで書き込めたダイジェストの分だけなので、同じ日付を複数のジョブが処理しても二重には数えない
+    （ダイジェストの更新後にここで失敗した差分は失われるため、エラーを記録する）。
+    戻り値: 更新した集計アイテムの数
+    """
+    table = get_dynamodb().Table(table_name or AGG_TABLE_NAME)
+    updated = 0
+    for (space_id, key), row in agg_deltas.items():
+        adds = []
+        values = {':p': row['planId'], ':n': row['planDisplayName'], ':t': row['day_type'], ':w': row['week_start']}
+        for hh, (price_sum, count) in sorted(row['hours'].items()):
+            if price_sum:
+                adds.append(f"h{hh}_sum :s{hh}")
+                values[f":s{hh}"] = price_sum
+            if count:
+                adds.append(f"h{hh}_cnt :c{hh}")
+                values[f":c{hh}"] = count
+        if not adds:
+            continue
+        try:
+            table.update_item(
+                Key={'spaceId': space_id, 'agg_key': key},
+                UpdateExpression='SET planId = :p, planDisplayName = :n, day_type = :t, week_start = :w ADD '
+                                 + ', '.join(adds),
+                ExpressionAttributeValues=values,
+            )
+            updated += 1
+        except Exception as e:
+            print(f"集計テーブルの更新エラー ({space_id}, {key}): {e}")
+    print(f"集計テーブル更新: {updated}/{len(agg_deltas)}件")
+    return updated
+
+
+def group_items_by_day(items):
+    """アイテムを (spaceId, 日付, planId) ごとに {時(HH): item} へまとめる（同一キーは後勝ち）"""
+    groups = {}
+    for item in items:
+        dt = item['datetime']
+        groups.setdefault((item['spaceId'], dt[:10], item['planId']), {})[dt[11:13]] = item
+    return groups
+
+
+def digest_key(date, plan_id):
+    return f"{DIGEST_PREFIX}{date}#{plan_id}"
+
+
+def item_digest(item):
+    """時間別アイテムの VOLATILE_ITEM_KEYS 以外の属性のハッシュ"""
+    stable = {k: v for k, v in item.items() if k not in VOLATILE_ITEM_KEYS}
+    text = json.dumps(stable, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def get_digests(group_keys, table_name=None):
+    """
+    (spaceId, 日付, planId) の一覧に対応するダイジェスト行を取得する。
+    戻り値: {(spaceId, rate_key): item}
+    """
+    table_name = table_name or TABLE_NAME
+    keys = [{'spaceId': space_id, 'rate_key': digest_key(date, plan_id)}
+            for space_id, date, plan_id in group_keys]
+    found = {}
+    dynamodb = get_dynamodb()
+    for i in range(0, len(keys), GET_BATCH_SIZE):
+        request_items = {table_name: {'Keys': keys[i:i + GET_BATCH_SIZE],
+                                      'ProjectionExpression': 'spaceId, rate_key, prices, #items, aggregated, rev',
+                                      'ExpressionAttributeNames': {'#items': 'items'},
+                                      'ConsistentRead': True}}
+        attempt = 0
+        while request_items:
+            resp = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in resp.get('Responses', {}).get(table_name, []):
+                found[(item['spaceId'], item['rate_key'])] = item
+            request_items = resp.get('UnprocessedKeys') or {}
+            if not request_items:
+                break
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                # 取得できなかった分は「前回なし」として全時間帯を書き込む
+                print(f"ダイジェスト取得未処理: {len(request_items[table_name]['Keys'])}件")
+                break
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+            time.sleep(random.uniform(delay / 2, delay))
+    return found
+
+
+def build_daily_rows(items):
+    """
+    時間別アイテムを (spaceId, 日付, planId) ごとの日別アイテムにまとめる。
+    prices は0時〜23時の24要素の配列で、取得できなかった時間は None。
+    """
+    rows = []
+    for (space_id, date, plan_id), hourly in group_items_by_day(items).items():
+        prices = [None] * DAILY_SLOTS
+        for hh, item in hourly.items():
+            prices[int(hh)] = item['price']
+        latest = max(hourly.values(), key=lambda it: it.get('created_at', ''))
+        row = {
+            'spaceId': space_id,
+            'day_key': f"{date}#{plan_id}",
+            'date': date,
+            'planId': plan_id,
+            'prices': prices,
+        }
+        row.update({k: latest[k] for k in DAILY_META_KEYS if k in latest})
+        rows.append(row)
+    return rows
+
+
+def write_daily_items(items, table_name=None):
+    """
+    時間別アイテムを日別レイアウトのテーブルに書き込む。
+    既存アイテムは取得できた時間の要素だけを更新するため、
+    複数ジョブが同じ日付の別の時間帯（24時以降の翌日扱い分など）を並行して書いても互いに消さない。
+    戻り値: {'items', 'written', 'duplicates', 'batches', 'retries', 'elapsed_ms'}
+    """
+    table = get_dynamodb().Table(table_name or DAILY_TABLE_NAME)
+    started = time.monotonic()
+    rows = build_daily_rows(items)
+    stats = {'items': len(items), 'written': 0, 'duplicates': 0, 'batches': 0, 'retries': 0, 'elapsed_ms': 0}
+
+    for row in rows:
+        slots = {i: price for i, price in enumerate(row['prices']) if price is not None}
+        meta = {k: row[k] for k in DAILY_META_KEYS if k in row}
+        names = {f"#m{i}": k for i, k in enumerate(meta)}
+        values = {f":m{i}": v for i, v in enumerate(meta.values())}
+        values.update({f":p{i}": price for i, price in slots.items()})
+        sets = [f"prices[{i}] = :p{i}" for i in slots] + [f"#m{i} = :m{i}" for i in range(len(meta))]
+
+        while True:
+            stats['batches'] += 1
+            try:
+                # 既存アイテムは該当する時間の要素だけを更新
+                table.update_item(
+                    Key={'spaceId': row['spaceId'], 'day_key': row['day_key']},
+                    UpdateExpression='SET ' + ', '.join(sets),
+                    ConditionExpression='attribute_exists(prices)',
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values,
+                )
+                break
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                pass
+            stats['batches'] += 1
+            try:
+                # 新規アイテムは配列ごと作成（他のジョブが先に作成していたら更新をやり直す）
+                table.put_item(Item=row, ConditionExpression='attribute_not_exists(prices)')
+                break
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                stats['retries'] += 1
+        stats['written'] += 1
+
+    stats['elapsed_ms'] = int((time.monotonic() - started) * 1000)
+    print(f"DynamoDB 日別書き込み: {stats['written']}日分 ({stats['items']}時間分, "
+          f"{stats['batches']}リクエスト, {stats['elapsed_ms']}ms)")
+    return stats
+
+
+def start_background_writer(write_fn, queue_size=None):
+    """
+    write_fn(items) を別スレッドで順に実行する書き込み用スレッドを起動する。
+    スクレイピング中も書き込みが進むため、途中でタイムアウトしてもそれまでの日付は保存される。
+    戻り値: submit / finish に渡す dict（'records': 書き込んだ件数、'stats': write_fn の戻り値の合計、'errors'）
+    """
+    writer = {
+        'queue': queue.Queue(maxsize=queue_size or WRITE_QUEUE_SIZE),
+        'records': 0,
+        'stats': {},
+        'errors': [],
+    }
+
+    def run():
+        while True:
+            task = writer['queue'].get()
+            if task is None:
+                break
+            label, items, done = task
+            try:
+                if items:
+                    stats = write_fn(items) or {}
+                    writer['records'] += len(items)
+                    for key, value in stats.items():
+                        writer['stats'][key] = writer['stats'].get(key, 0) + value
+            except Exception as e:
+                print(f"書き込みエラー ({label}): {e}")
+                writer['errors'].append({'url': label, 'error': str(e)})
+                continue
+            if done:
+                # 書き込みが成功した後の処理（チェックポイントの記録など）
+                try:
+                    done()
+                except Exception as e:
+                    print(f"書き込み後処理エラー ({label}): {e}")
+
+    writer['thread'] = threading.Thread(target=run, daemon=True)
+    writer['thread'].start()
+    return writer
+
+
+def submit(writer, label, items, done=None):
+    """
+    アイテムを書き込みキューに追加する（キューが満杯なら空くまで待つ）。
+    done() は書き込みが成功した後に書き込みスレッドで呼ばれる（items が空でも呼ばれる）。
+    """
+    writer['queue'].put((label, items, done))
+
+
+def finish(writer):
+    """キューに残ったアイテムを書き込み終えるまで待つ"""
+    writer['queue'].put(None)
+    writer['thread'].join()
+    return writer
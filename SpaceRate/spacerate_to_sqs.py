@@ -1,12 +1,29 @@
 import json
-import boto3
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
+import job_planner
+import sqs_enqueue
+
+# スキャン対象の日数（今日から約3ヶ月）
+TOTAL_SCAN_DAYS = int(os.environ.get('TOTAL_SCAN_DAYS', '84'))
+
+# コスト表に実績がないURLの見積もり（従来どおり約2週間ずつのジョブになる値）
+DEFAULT_COSTS_MS = {
+    'url_ms': int(os.environ.get('DEFAULT_URL_COST_MS', '60000')),
+    'date_ms': int(os.environ.get('DEFAULT_DATE_COST_MS', '38000')),
+}
+
+# ジョブを一度に流さず分散させる設定（DelaySeconds、最大900秒）
+# RELEASE_RATE_PER_MINUTE: 1分あたりに受信可能にするジョブ数、RELEASE_WINDOW_SECONDS: 全ジョブを分散させる時間
+# どちらも 0 の場合は従来どおり一度に流す
+RELEASE_RATE_PER_MINUTE = float(os.environ.get('RELEASE_RATE_PER_MINUTE', '0'))
+RELEASE_WINDOW_SECONDS = int(os.environ.get('RELEASE_WINDOW_SECONDS', '0'))
 
 def lambda_handler(event, context):
     """
     GASからのリクエストを受けてジョブを分割
-    毎回、全URL × 6期間（3ヶ月分）のジョブを生成
+    毎回、全URL × 3ヶ月分を、URLごとの処理時間の実績に応じた期間に分けてジョブを生成
+    （速いスペースは長い期間・複数URLをまとめ、遅いスペースは短い期間に分ける）
     """
     
     # URLリストの取得
@@ -32,52 +49,74 @@ def lambda_handler(event, context):
             'body': json.dumps({'error': 'URLリストが指定されていません'})
         }
     
-    # 固定の期間分割設定（3ヶ月を2週間ごとに6分割）
-    job_configs = [
-        {"offset_days": 0, "scan_days": 14},    # 今日から2週間
-        {"offset_days": 14, "scan_days": 14},   # 2週間後から2週間
-        {"offset_days": 28, "scan_days": 14},   # 4週間後から2週間
-        {"offset_days": 42, "scan_days": 14},   # 6週間後から2週間
-        {"offset_days": 56, "scan_days": 14},   # 8週間後から2週間
-        {"offset_days": 70, "scan_days": 14},   # 10週間後から2週間
-    ]
+    # URLごとに期間を分割し、同じ期間のジョブは見積もり時間の合計が目標に収まるだけ1メッセージにまとめる
+    jobs = plan_jobs(urls)
     
-    # SQSクライアント
-    sqs = boto3.client('sqs')
     queue_url = os.environ['SQS_QUEUE_URL']
+    execution_time = datetime.now().isoformat()
+    messages = [
+        {
+            "urls": job["urls"],
+            "offset_days": job["offset_days"],
+            "scan_days": job["scan_days"],
+            "execution_time": execution_time
+        }
+        for job in jobs
+    ]
     
-    # ジョブカウンター
-    total_jobs = 0
+    # ジョブごとの受信可能になるまでの遅延と、その場合の同時実行数の見積もり
+    delays = sqs_enqueue.release_delays(len(messages), RELEASE_WINDOW_SECONDS, RELEASE_RATE_PER_MINUTE)
+    curve = sqs_enqueue.simulate_concurrency(delays, [job['estimated_ms'] / 1000 for job in jobs])
+    peak_concurrency = max((active for _, active, _ in curve), default=0)
+    print(f"投入間隔: 最大{max(delays, default=0)}秒後まで分散、見積もり最大同時実行数: {peak_concurrency}")
     
-    # 各URLに対して6つのジョブを作成
-    for url in urls:
-        for config in job_configs:
-            message = {
-                "urls": [url],
-                "offset_days": config["offset_days"],
-                "scan_days": config["scan_days"],
-                "execution_time": datetime.now().isoformat()
-            }
-            
-            # SQSにメッセージ送信
-            try:
-                sqs.send_message(
-                    QueueUrl=queue_url,
-                    MessageBody=json.dumps(message)
-                )
-                total_jobs += 1
-            except Exception as e:
-                print(f"SQS送信エラー: {url} - {e}")
+    # SQSにメッセージ送信（10件ずつのバッチを並行送信）
+    result = sqs_enqueue.send_messages(queue_url, messages, delays)
+    total_jobs = result['sent']
+    for failure in result['failed']:
+        print(f"SQS送信エラー: {failure['body']['urls']} - {failure['error']}")
     
     # 実行ログ
-    print(f"ジョブ生成完了: {len(urls)}個のURL × 6期間 = {total_jobs}ジョブ")
+    print(f"ジョブ生成完了: {len(urls)}個のURL × {TOTAL_SCAN_DAYS}日 = {total_jobs}ジョブ")
     
     return {
         'statusCode': 200,
         'body': json.dumps({
             'message': f'{total_jobs}個のジョブを生成しました',
             'urls_count': len(urls),
-            'periods': 6,
-            'total_jobs': total_jobs
+            # 期間の分け方の数（従来の固定6期間に相当。URLごとの実績によって変わる）
+            'periods': len({(job['offset_days'], job['scan_days']) for job in jobs}),
+            'scan_days': TOTAL_SCAN_DAYS,
+            'total_jobs': total_jobs,
+            'failed_jobs': len(result['failed']),
+            'release_seconds': max(delays, default=0),
+            'estimated_peak_concurrency': peak_concurrency,
+            'enqueue_ms': result['elapsed_ms']
         }, ensure_ascii=False)
-    }
\ No newline at end of file
+    }
+
+
+def plan_jobs(urls):
+    """
+    コスト表の実績から [{'urls': [...], 'offset_days': n, 'scan_days': n, 'estimated_ms': n}, ...] を作る。
+    同じ期間（offset_days, scan_days）のURLだけを1つのジョブにまとめる（ハンドラは期間をメッセージ単位で受け取るため）。
+    """
+    costs = job_planner.load_costs('SpaceRate', urls)
+    by_range = {}
+    for url in dict.fromkeys(urls):
+        url_ms, date_ms = job_planner.estimate(costs.get(url), DEFAULT_COSTS_MS)
+        for offset_days, scan_days in job_planner.split_days(url_ms, date_ms, TOTAL_SCAN_DAYS):
+            cost = job_planner.job_cost_ms(url_ms, date_ms, scan_days)
+            by_range.setdefault((offset_days, scan_days), []).append((url, cost))
+
+    jobs = []
+    for (offset_days, scan_days), entries in sorted(by_range.items()):
+        url_costs = dict(entries)
+        for job_urls in job_planner.pack(entries):
+            jobs.append({
+                'urls': job_urls,
+                'offset_days': offset_days,
+                'scan_days': scan_days,
+                'estimated_ms': sum(url_costs[u] for u in job_urls),
+            })
+    return jobs
\ No newline at end of file
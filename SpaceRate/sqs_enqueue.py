@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import random
+import heapq
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+
+# 複数のメッセージを send_message_batch（1回10件まで）で SQS に送信する。
+# バッチは小さなスレッドプールで並行に送り、失敗したエントリだけを指数バックオフで再送する。
+# 同じ内容のメッセージ（execution_time / timestamp を除いて同一）は1回の呼び出しの中で1件にまとめ、
+# FIFO キューの場合は内容から MessageDeduplicationId を作る（GAS からの再実行で同じジョブが重複しない）。
+# release_delays で DelaySeconds を割り振ると、ジョブを一度に流さず一定の間隔で受信可能にできる
+# （python sqs_enqueue.py --jobs 300 --rate 20 で同時実行数の推移をシミュレーションできる）。
+
+BATCH_SIZE = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+# 並行して送信するバッチ数
+ENQUEUE_WORKERS = int(os.environ.get('ENQUEUE_WORKERS', '4'))
+
+# 失敗したエントリの再送回数とバックオフ（秒）
+ENQUEUE_MAX_RETRIES = int(os.environ.get('ENQUEUE_MAX_RETRIES', '5'))
+BACKOFF_BASE_SECONDS = 0.1
+BACKOFF_MAX_SECONDS = 2.0
+
+# 重複判定に含めない（送信のたびに変わる）キー
+VOLATILE_KEYS = ('execution_time', 'timestamp')
+
+# SQS の DelaySeconds の上限
+MAX_DELAY_SECONDS = 900
+
+_sqs = None
+
+
+def get_sqs():
+    global _sqs
+    if _sqs is None:
+        _sqs = boto3.client('sqs')
+    return _sqs
+
+
+def dedupe_id(body):
+    """メッセージ本文（VOLATILE_KEYS を除く）から重複排除用のIDを作る"""
+    stable = {k: v for k, v in body.items() if k not in VOLATILE_KEYS} if isinstance(body, dict) else body
+    text = json.dumps(stable, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def release_delays(count, window_seconds=0, rate_per_minute=0):
+    """
+    count 件のジョブの DelaySeconds を先頭から順に割り振る。
+    rate_per_minute > 0 の場合は1分あたりその件数ずつ、window_seconds > 0 の場合はその時間内に均等に受信可能にする
+    （両方指定した場合は遅い方＝間隔の広い方）。どちらも 0 の場合は全て 0（従来どおり一度に流す）。
+    SQS の上限（900秒）を超える分は 900 秒にまとめる。
+    """
+    interval = 0.0
+    if rate_per_minute > 0:
+        interval = 60.0 / rate_per_minute
+    if window_seconds > 0 and count > 1:
+        interval = max(interval, min(window_seconds, MAX_DELAY_SECONDS) / (count - 1))
+    delays = [min(MAX_DELAY_SECONDS, int(i * interval)) for i in range(count)]
+    overflow = sum(1 for i in range(count) if i * interval > MAX_DELAY_SECONDS)
+    if overflow:
+        print(f"DelaySeconds の上限({MAX_DELAY_SECONDS}秒)を超える{overflow}件は{MAX_DELAY_SECONDS}秒後にまとめて受信可能になります")
+    return delays
+
+
+def simulate_concurrency(delays, durations, max_concurrency=None, step_seconds=60):
+    """
+    ジョブ i が delays[i] 秒後に受信可能になり durations[i] 秒かかる場合の同時実行数の推移を求める。
+    max_concurrency を指定した場合は、それを超えるジョブは空きができるまで待つ（Lambda の予約同時実行数を想定）。
+    戻り値: [(経過秒, 実行中, 待機中), ...]（step_seconds ごと）
+    """
+    jobs = sorted(zip(delays, durations))
+    running = []  # 終了時刻のヒープ
+    starts = []
+    for arrival, duration in jobs:
+        start = arrival
+        while running and running[0] <= start:
+            heapq.heappop(running)
+        if max_concurrency and len(running) >= max_concurrency:
+            start = heapq.heappop(running)
+        heapq.heappush(running, start + duration)
+        starts.append((arrival, start, start + duration))
+
+    end = max((finish for _, _, finish in starts), default=0)
+    curve = []
+    t = 0
+    while t <= end:
+        active = sum(1 for _, start, finish in starts if start <= t < finish)
+        waiting = sum(1 for arrival, start, _ in starts if arrival <= t < start)
+        curve.append((t, active, waiting))
+        t += step_seconds
+    return curve
+
+
+def send_messages(queue_url, bodies, delays=None):
+    """
+    bodies（dict のリスト）を queue_url に送信する。
+    delays を指定した場合は bodies と同じ順の DelaySeconds として付ける（FIFO キューでは使えないため無視する）。
+    戻り値: {'sent', 'duplicates', 'batches', 'retries', 'failed': [{'body', 'error'}, ...], 'elapsed_ms'}
+    """
+    started = time.time()
+    fifo = queue_url.endswith('.fifo')
+    if delays and fifo:
+        print("FIFO キューではメッセージごとの DelaySeconds を指定できないため無視します")
+
+    entries = []
+    seen = set()
+    for i, body in enumerate(bodies):
+        message_id = dedupe_id(body)
+        if message_id in seen:
+            continue
+        seen.add(message_id)
+        entry = {'Id': str(len(entries)), 'MessageBody': json.dumps(body, ensure_ascii=False)}
+        if fifo:
+            entry['MessageDeduplicationId'] = message_id
+            entry['MessageGroupId'] = message_id
+        elif delays and delays[i]:
+            entry['DelaySeconds'] = int(delays[i])
+        entries.append((entry, body))
+
+    stats = {'sent': 0, 'duplicates': len(bodies) - len(entries), 'batches': 0, 'retries': 0, 'failed': []}
+    batches = split_batches(entries)
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(ENQUEUE_WORKERS, len(batches)))) as pool:
+            for result in pool.map(lambda batch: _send_batch(queue_url, batch), batches):
+                stats['sent'] += result['sent']
+                stats['batches'] += result['batches']
+                stats['retries'] += result['retries']
+                stats['failed'].extend(result['failed'])
+
+    stats['elapsed_ms'] = int((time.time() - started) * 1000)
+    print(f"SQS送信: {stats['sent']}/{len(entries)}件 ({stats['batches']}バッチ, 再送{stats['retries']}回, "
+          f"重複{stats['duplicates']}件, 失敗{len(stats['failed'])}件, {stats['elapsed_ms']}ms)")
+    return stats
+
+
+def split_batches(entries):
+    """エントリを BATCH_SIZE 件・合計 MAX_BATCH_BYTES 以内のバッチに分ける"""
+    batches = []
+    batch, size = [], 0
+    for entry, body in entries:
+        entry_size = len(entry['MessageBody'].encode('utf-8'))
+        if batch and (len(batch) >= BATCH_SIZE or size + entry_size > MAX_BATCH_BYTES):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append((entry, body))
+        size += entry_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _send_batch(queue_url, batch):
+    """1バッチを送信し、失敗したエントリ（送信側の誤りでないもの）を再送する"""
+    result = {'sent': 0, 'batches': 0, 'retries': 0, 'failed': []}
+    pending = {entry['Id']: (entry, body) for entry, body in batch}
+    last_error = ''
+
+    for attempt in range(ENQUEUE_MAX_RETRIES + 1):
+        if attempt:
+            result['retries'] += 1
+            time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))))
+        result['batches'] += 1
+        try:
+            resp = get_sqs().send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[entry for entry, _ in pending.values()]
+            )
+        except Exception as e:
+            print(f"SQS送信エラー（バッチ全体を再送）: {e}")
+            last_error = str(e)
+            continue
+
+        result['sent'] += len(resp.get('Successful', []))
+        retry = {}
+        for failure in resp.get('Failed', []):
+            entry, body = pending[failure['Id']]
+            error = f"{failure.get('Code')}: {failure.get('Message', '')}"
+            if failure.get('SenderFault'):
+                # メッセージ自体の誤りは再送しても成功しない
+                result['failed'].append({'body': body, 'error': error})
+            else:
+                retry[failure['Id']] = (entry, body)
+                last_error = error
+        pending = retry
+        if not pending:
+            return result
+
+    for entry, body in pending.values():
+        result['failed'].append({'body': body, 'error': last_error})
+    return result
+
+
+if __name__ == '__main__':
+    # ローカルでのシミュレーション: 受信間隔を変えたときの同時実行数の推移を表示する
+    parser = argparse.ArgumentParser(description='DelaySeconds による投入間隔と同時実行数のシミュレーション')
+    parser.add_argument('--jobs', type=int, default=300, help='ジョブ数')
+    parser.add_argument('--job-seconds', type=int, default=600, help='1ジョブの処理時間（秒）')
+    parser.add_argument('--window', type=int, default=0, help='投入を分散させる時間（秒、最大900）')
+    parser.add_argument('--rate', type=float, default=0, help='1分あたりの受信可能にするジョブ数')
+    parser.add_argument('--max-concurrency', type=int, default=0, help='同時実行数の上限（0 = 上限なし）')
+    parser.add_argument('--step', type=int, default=60, help='表示間隔（秒）')
+    args = parser.parse_args()
+
+    sim_delays = release_delays(args.jobs, args.window, args.rate)
+    curve = simulate_concurrency(sim_delays, [args.job_seconds] * args.jobs,
+                                 args.max_concurrency or None, args.step)
+    peak = max((active for _, active, _ in curve), default=0)
+    for t, active, waiting in curve:
+        bar = '#' * round(active * 50 / peak) if peak else ''
+        print(f"{t // 60:4d}分 実行中{active:4d} 待機{waiting:4d} {bar}")
+    print(f"最大同時実行数: {peak}、全ジョブ完了: {curve[-1][0] // 60 if curve else 0}分後")
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import threading
+import boto3
+
+# Lambda の残り時間（context.get_remaining_time_in_millis）を見て、締め切り前に処理を打ち切るための時間予算。
+# URL・日付1件あたりの処理時間を実績から指数移動平均で見積もり、次の1件が締め切りまでに終わらない場合は打ち切る。
+# 打ち切った残りの URL・日付は requeue で新しい SQS メッセージとして戻し、次の実行で続きを処理する。
+# 実績は /tmp に保存するため、同じコンテナの次回以降の実行でも使われる。
+
+# 'on' = 時間予算を使う、'off' = 締め切りを見ない（従来どおり）
+TIME_BUDGET_MODE = os.environ.get('TIME_BUDGET_MODE', 'on')
+
+# 打ち切り後の書き込み待ち・再投入・レスポンス作成に残しておく時間
+SAFETY_MARGIN_MS = int(os.environ.get('TIME_BUDGET_MARGIN_MS', '20000'))
+
+# 処理時間の実績の保存先と、新しい実績の重み
+COST_FILE = os.environ.get('TIME_BUDGET_COST_FILE', '/tmp/cost_history.json')
+COST_ALPHA = float(os.environ.get('TIME_BUDGET_COST_ALPHA', '0.3'))
+
+# 再投入先のキュー（未指定の場合は SQS レコードの eventSourceARN から求める）
+REQUEUE_QUEUE_URL = os.environ.get('REQUEUE_QUEUE_URL', '')
+
+# 同じジョブを再投入する回数の上限（1件も進まない場合に無限に再投入しないため）
+MAX_REQUEUES = int(os.environ.get('TIME_BUDGET_MAX_REQUEUES', '10'))
+
+# 処理時間の実績 {種別: 平均ミリ秒}（Lambda のウォームスタート間で再利用）
+_costs = None
+_costs_lock = threading.Lock()
+_sqs = None
+
+
+def is_enabled():
+    return TIME_BUDGET_MODE != 'off'
+
+
+def start(context, defaults):
+    """
+    ハンドラの開始時に呼び、時間予算の dict を返す。
+    defaults: 実績がない場合の見積もり {種別: ミリ秒}
+    context が None（ローカル実行など）の場合は締め切りなしとして扱う。
+    """
+    deadline = None
+    if is_enabled() and context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000
+    return {'deadline': deadline, 'defaults': dict(defaults), 'stopped': False}
+
+
+def now():
+    return time.monotonic()
+
+
+def remaining_ms(budget):
+    """締め切りまでの残りミリ秒（締め切りなしの場合は None）"""
+    if budget['deadline'] is None:
+        return None
+    return int((budget['deadline'] - time.monotonic()) * 1000)
+
+
+def estimate_ms(budget, kind, units=1):
+    """種別 kind の処理 units 件分の見積もりミリ秒"""
+    costs = _load_costs()
+    return int(costs.get(kind, budget['defaults'].get(kind, 0)) * units)
+
+
+def can_afford(budget, kind, units=1):
+    """
+    kind の処理 units 件を締め切り（安全マージンを除く）までに終えられる見込みなら True。
+    一度 False になった予算は以降も False を返す（打ち切った後に別の処理を始めないため）。
+    """
+    if budget['stopped']:
+        return False
+    remaining = remaining_ms(budget)
+    if remaining is None:
+        return True
+    needed = estimate_ms(budget, kind, units)
+    if remaining - SAFETY_MARGIN_MS >= needed:
+        return True
+    budget['stopped'] = True
+    print(f"時間予算切れのため打ち切り: 残り{remaining}ms、{kind}の見積もり{needed}ms (マージン{SAFETY_MARGIN_MS}ms)")
+    return False
+
+
+def record(kind, started, units=1):
+    """started（now() の戻り値）からの経過時間を kind の処理 units 件分の実績として記録する"""
+    if units <= 0:
+        return
+    elapsed_ms = (time.monotonic() - started) * 1000 / units
+    with _costs_lock:
+        costs = _load_costs()
+        previous = costs.get(kind)
+        costs[kind] = elapsed_ms if previous is None else previous + COST_ALPHA * (elapsed_ms - previous)
+        try:
+            with open(COST_FILE, 'w') as f:
+                json.dump(costs, f)
+        except OSError as e:
+            print(f"処理時間の実績の保存エラー: {e}")
+
+
+def queue_url_for_record(record):
+    """再投入先のキューURL（REQUEUE_QUEUE_URL、なければ SQS レコードの送信元キュー）"""
+    if REQUEUE_QUEUE_URL:
+        return REQUEUE_QUEUE_URL
+    arn = (record or {}).get('eventSourceARN', '')
+    parts = arn.split(':')
+    if len(parts) != 6 or parts[2] != 'sqs':
+        return None
+    try:
+        return _get_sqs().get_queue_url(QueueName=parts[5], QueueOwnerAWSAccountId=parts[4])['QueueUrl']
+    except Exception as e:
+        print(f"キューURL取得エラー ({arn}): {e}")
+        return None
+
+
+def requeue(queue_url, body):
+    """
+    打ち切った残りの処理を新しいメッセージとして送信する。
+    body['requeue_count'] が MAX_REQUEUES を超える場合は送信しない。
+    戻り値: 送信できたら True
+    """
+    if not queue_url:
+        print(f"再投入先のキューが不明のため破棄: {body}")
+        return False
+    if body.get('requeue_count', 0) > MAX_REQUEUES:
+        print(f"再投入回数の上限({MAX_REQUEUES})を超えたため破棄: {body}")
+        return False
+    try:
+        _get_sqs().send_message(QueueUrl=queue_url, MessageBody=json.dumps(body, ensure_ascii=False))
+        print(f"未処理分を再投入: {body}")
+        return True
+    except Exception as e:
+        print(f"再投入エラー: {e}")
+        return False
+
+
+def _load_costs():
+    global _costs
+    if _costs is None:
+        try:
+            with open(COST_FILE) as f:
+                _costs = json.load(f)
+        except (OSError, ValueError):
+            _costs = {}
+    return _costs
+
+
+def _get_sqs():
+    global _sqs
+    if _sqs is None:
+        _sqs = boto3.client('sqs')
+    return _sqs